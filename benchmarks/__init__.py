@@ -0,0 +1,3 @@
+"""
+Benchmarks for the SNAC Codec Audio Processing Pipeline
+"""
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+CPU encoding scaling benchmark: sweeps the number of CPU workers and the intra-op
+threads per worker on a synthetic waveform corpus.
+
+Every worker loads its own SNACCoder on the CPU, encodes an interleaved share of the
+corpus and reports back. Model loading is not timed. Reports samples/s and audio-seconds/s
+per configuration, which is what `cpu_workers` and `cpu_threads_per_worker` should be
+tuned by (workers × threads should not exceed the physical cores).
+
+    python -m benchmarks.bench_cpu_scaling --workers 1,2,4 --threads 1,2,4 --items 64
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import torch
+
+from benchmarks.common import save_results
+from utils.snac_codec import SNACCoder
+
+
+def synthetic_corpus(num_items: int, min_seconds: float, max_seconds: float,
+                     sample_rate: int, seed: int = 0):
+    """Deterministic noise clips with uniformly distributed durations"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.uniform(min_seconds, max_seconds, num_items) * sample_rate
+    return [(rng.standard_normal(int(n)) * 0.1).astype(np.float32) for n in lengths]
+
+
+def _worker(index, num_workers, threads, args, ready_q, go, result_q):
+    torch.set_num_threads(threads)
+    model = SNACCoder(f"cpu:{index}", model_id=args.model_id)
+    corpus = synthetic_corpus(args.items, args.min_seconds, args.max_seconds, args.sample_rate)[index::num_workers]
+    ready_q.put(index)
+    go.wait()
+
+    samples = 0
+    for start in range(0, len(corpus), args.batch_size):
+        batch = corpus[start:start + args.batch_size]
+        model.encode_batch(batch)
+        samples += sum(wave.shape[0] for wave in batch)
+    result_q.put((len(corpus), samples))
+
+
+def run_case(num_workers: int, threads: int, args) -> dict:
+    """Runs one workers × threads configuration and returns its measurements"""
+    ready_q = mp.Queue()
+    result_q = mp.Queue()
+    go = mp.Event()
+
+    procs = [
+        mp.Process(target=_worker, args=(i, num_workers, threads, args, ready_q, go, result_q))
+        for i in range(num_workers)
+    ]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready_q.get()
+
+    start = time.perf_counter()
+    go.set()
+    results = [result_q.get() for _ in procs]
+    elapsed = time.perf_counter() - start
+    for p in procs:
+        p.join()
+
+    items = sum(n for n, _ in results)
+    audio_seconds = sum(s for _, s in results) / args.sample_rate
+    return {
+        "workers": num_workers,
+        "threads_per_worker": threads,
+        "items": items,
+        "elapsed_s": round(elapsed, 3),
+        "samples_per_s": round(items / elapsed, 2),
+        "audio_seconds_per_s": round(audio_seconds / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-id", default="hubertsiuzdak/snac_24khz")
+    parser.add_argument("--sample-rate", type=int, default=24000)
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--threads", default="1,2,4", help="Comma-separated threads per worker")
+    parser.add_argument("--items", type=int, default=64)
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    parser.add_argument("--max-seconds", type=float, default=10.0)
+    parser.add_argument("--batch-size", type=int, default=1)
+    args = parser.parse_args()
+
+    mp.set_start_method("spawn", force=True)
+    cores = os.cpu_count()
+
+    results = []
+    for num_workers in map(int, args.workers.split(",")):
+        for threads in map(int, args.threads.split(",")):
+            res = run_case(num_workers, threads, args)
+            res["oversubscribed"] = num_workers * threads > cores
+            print(f"🧮 {num_workers:>2} workers × {threads:>2} threads: {res['samples_per_s']:>8,.2f} samples/s | "
+                  f"{res['audio_seconds_per_s']:>8,.1f} audio-s/s"
+                  + (f" (oversubscribed: {cores} cores)" if res["oversubscribed"] else ""))
+            results.append(res)
+
+    if results:
+        best = max(results, key=lambda r: r["audio_seconds_per_s"])
+        print(f"🏆 Best: cpu_workers: {best['workers']}, cpu_threads_per_worker: {best['threads_per_worker']}")
+
+    save_results("cpu_scaling", {"args": vars(args), "cpu_count": cores, "cases": results})
+
+
+if __name__ == "__main__":
+    main()
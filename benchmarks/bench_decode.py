@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Reader decode benchmark: samples/s of turning an audiofolder dataset into mono waveforms
+at the codec sample rate, comparing
+- the `datasets` path (`cast_column(Audio(sample_rate))`: float64 decode, librosa resample),
+- `AudioDecoder` (float32 decode, soxr, `--threads` decode threads),
+- `AudioDecoder` reading a warm resampled-PCM cache.
+
+Checks that the fast path matches the `datasets` waveforms.
+
+    python -m benchmarks.bench_decode --items 200 --source-rate 44100 --channels 2 --threads 1,4
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from datasets import Audio, load_dataset, disable_progress_bars
+
+from benchmarks.common import peak_rss_mb, save_results
+from benchmarks.synthetic_dataset import write_dataset
+from utils.audio_decode import RESAMPLER, AudioDecoder
+
+
+def timed(rows) -> tuple:
+    """Consumes (row, example) pairs. Returns samples/s and the waveforms"""
+    start = time.perf_counter()
+    waves = [ex["audio"]["array"] for _, ex in rows]
+    return len(waves) / (time.perf_counter() - start), waves
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--min-seconds", type=float, default=2.0)
+    parser.add_argument("--max-seconds", type=float, default=10.0)
+    parser.add_argument("--source-rate", type=int, default=44100)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--format", default="flac", choices=["flac", "wav"])
+    parser.add_argument("--sample-rate", type=int, default=24000)
+    parser.add_argument("--threads", default="1,4", help="Comma-separated decode thread counts")
+    args = parser.parse_args()
+
+    disable_progress_bars()
+    work_dir = tempfile.mkdtemp(prefix="snac-bench-decode-")
+    results = {"resampler": RESAMPLER}
+    try:
+        data_dir = os.path.join(work_dir, "data")
+        os.makedirs(data_dir)
+        write_dataset(data_dir, args.items, f"uniform:{args.min_seconds},{args.max_seconds}",
+                      args.source_rate, args.channels, args.format)
+        ds = load_dataset("audiofolder", data_dir=data_dir, split="train", cache_dir=os.path.join(work_dir, "hf"))
+
+        rate, reference = timed(enumerate(ds.cast_column("audio", Audio(args.sample_rate))))
+        results["datasets_samples_per_s"] = round(rate, 1)
+        print(f"📦 datasets Audio({args.sample_rate}): {rate:,.1f} samples/s")
+
+        raw = ds.cast_column("audio", Audio(decode=False))
+        for threads in [int(t) for t in args.threads.split(",")]:
+            decoder = AudioDecoder(args.sample_rate, threads=threads)
+            rate, fast_waves = timed(decoder.decode_rows(enumerate(raw), "audio"))
+            max_diff = max(float(np.abs(w - r).max()) for w, r in zip(fast_waves, reference))
+            results[f"fast_{threads}t_samples_per_s"] = round(rate, 1)
+            results[f"fast_{threads}t_max_abs_diff"] = max_diff
+            print(f"⚡ AudioDecoder ({RESAMPLER}, {threads} thread(s)): {rate:,.1f} samples/s "
+                  f"| {rate / results['datasets_samples_per_s']:.2f}x | max |diff| {max_diff:.2e}")
+
+        decoder = AudioDecoder(args.sample_rate, cache_dir=os.path.join(work_dir, "pcm"))
+        rate, _ = timed(decoder.decode_rows(enumerate(raw), "audio"))
+        results["pcm_cache_cold_samples_per_s"] = round(rate, 1)
+        rate, waves = timed(decoder.decode_rows(enumerate(raw), "audio"))
+        assert all(np.array_equal(w, r) for w, r in zip(waves, fast_waves))
+        results["pcm_cache_warm_samples_per_s"] = round(rate, 1)
+        print(f"💾 PCM cache: {results['pcm_cache_cold_samples_per_s']:,.1f} samples/s cold, "
+              f"{rate:,.1f} warm | {rate / results['datasets_samples_per_s']:.2f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    save_results("decode", {"args": vars(args), **results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Stage microbenchmarks: each pipeline stage in isolation on synthetic data, so a regression
+shows up in the stage that caused it rather than only in end-to-end throughput.
+
+- prepare_item: `DatasetProcessor.prepare_item` on decoded examples (items/s)
+- queue: reader → worker transfer through `BudgetedQueue` from a producer process (items/s, MB/s)
+- encode: `SNACCoder.encode_batch` with the tiny random model by default (items/s, audio-s/s)
+- dump_line: `JsonlGzShardWriter._dump_line` serialization into an uncompressed buffer (records/s)
+- gzip: compressing the serialized lines at `--gzip-level` (MB/s)
+- assembly: `convert_shard` of a jsonl.gz shard into an Arrow file (records/s)
+
+Every case reports the median of `--repeats` runs.
+
+    python -m benchmarks.bench_micro --items 200 --records 20000 --only encode,gzip
+"""
+
+import argparse
+import gzip
+import io
+import multiprocessing as mp
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_cpu_scaling import synthetic_corpus
+from benchmarks.bench_shard_formats import synthetic_records
+from benchmarks.common import save_results
+
+CASES = ["prepare_item", "queue", "encode", "dump_line", "gzip", "assembly"]
+
+
+def median_seconds(repeats: int, fn) -> float:
+    """Runs fn (which returns the seconds it measured) repeats times. Returns the median"""
+    return statistics.median(fn() for _ in range(repeats))
+
+
+def bench_prepare_item(args) -> dict:
+    from utils.config_manager import DatasetConfig
+    from utils.dataset_processor import DatasetProcessor
+
+    config = DatasetConfig("audiofolder", "text", "audio", "speaker", [{"key": "lang", "value": "en"}])
+    processor = DatasetProcessor(config, args.sample_rate)
+    wave = np.zeros(args.sample_rate, dtype=np.float32)
+    examples = [{"text": f"clip {i}", "speaker": f"spk{i % 8}", "audio": {"array": wave, "sampling_rate": args.sample_rate}}
+                for i in range(args.records)]
+
+    def run():
+        start = time.perf_counter()
+        for ex in examples:
+            processor.prepare_item(ex)
+        return time.perf_counter() - start
+
+    seconds = median_seconds(args.repeats, run)
+    return {"items_per_s": round(len(examples) / seconds, 1)}
+
+
+def _queue_producer(q, num_items, num_samples, sample_rate, go):
+    wave = np.random.default_rng(0).standard_normal(num_samples).astype(np.float32)
+    go.wait()
+    for i in range(num_items):
+        q.put({"wave": wave, "text": f"clip {i}"}, wave.nbytes, num_samples / sample_rate)
+    q.put(None)
+
+
+def bench_queue(args) -> dict:
+    from utils.sample_queue import BudgetedQueue
+
+    num_samples = int(args.seconds * args.sample_rate)
+
+    def run():
+        q = BudgetedQueue(256, max_bytes=64 << 20)
+        go = mp.Event()
+        proc = mp.Process(target=_queue_producer, args=(q, args.items * 10, num_samples, args.sample_rate, go))
+        proc.start()
+        start = time.perf_counter()
+        go.set()
+        while q.get() is not None:
+            pass
+        seconds = time.perf_counter() - start
+        proc.join()
+        return seconds
+
+    seconds = median_seconds(args.repeats, run)
+    items = args.items * 10
+    return {"items_per_s": round(items / seconds, 1), "mb_per_s": round(items * num_samples * 4 / seconds / 1e6, 1)}
+
+
+def bench_encode(args) -> dict:
+    import torch
+    from utils.snac_codec import SNACCoder
+
+    torch.set_num_threads(args.threads)
+    model = SNACCoder(args.device, model_id=args.model_id)
+    corpus = synthetic_corpus(args.items, args.seconds / 2, args.seconds * 1.5, model.snac_model.sampling_rate)
+    model.encode_batch(corpus[:args.batch_size])
+
+    def run():
+        start = time.perf_counter()
+        for first in range(0, len(corpus), args.batch_size):
+            model.encode_batch(corpus[first:first + args.batch_size])
+        return time.perf_counter() - start
+
+    seconds = median_seconds(args.repeats, run)
+    audio_seconds = sum(w.shape[0] for w in corpus) / model.snac_model.sampling_rate
+    return {"items_per_s": round(len(corpus) / seconds, 1), "audio_seconds_per_s": round(audio_seconds / seconds, 1)}
+
+
+def _serialized(records, num_layers: int) -> bytes:
+    """The jsonl bytes a shard writer produces for the records"""
+    from utils.shard_writer import JsonlGzShardWriter
+
+    writer = JsonlGzShardWriter(os.devnull, num_layers)
+    buf = io.BytesIO()
+    txt = io.TextIOWrapper(buf, encoding="utf-8", newline="\n", write_through=True)
+    for rec in records:
+        writer._dump_line(dict(rec), buf, txt)
+    writer.close()
+    txt.detach()
+    return buf.getvalue()
+
+
+def bench_dump_line(args, records) -> dict:
+    def run():
+        start = time.perf_counter()
+        _serialized(records, args.num_layers)
+        return time.perf_counter() - start
+
+    seconds = median_seconds(args.repeats, run)
+    return {"records_per_s": round(len(records) / seconds, 1)}
+
+
+def bench_gzip(args, records) -> dict:
+    data = _serialized(records, args.num_layers)
+
+    def run():
+        start = time.perf_counter()
+        gzip.compress(data, args.gzip_level, mtime=0)
+        return time.perf_counter() - start
+
+    seconds = median_seconds(args.repeats, run)
+    ratio = len(data) / len(gzip.compress(data, args.gzip_level, mtime=0))
+    return {"mb_per_s": round(len(data) / seconds / 1e6, 1), "compression_ratio": round(ratio, 2)}
+
+
+def bench_assembly(args, records) -> dict:
+    from utils.assembly import convert_shard
+    from utils.shard_writer import JsonlGzShardWriter
+
+    work_dir = tempfile.mkdtemp(prefix="snac-bench-micro-")
+    try:
+        shard = os.path.join(work_dir, "bench-worker00-00000.jsonl.gz")
+        writer = JsonlGzShardWriter(shard, args.num_layers, gzip_level=args.gzip_level)
+        for rec in records:
+            writer.write(dict(rec))
+        writer.close()
+
+        def run():
+            start = time.perf_counter()
+            convert_shard(shard, os.path.join(work_dir, "bench.arrow"), args.num_layers)
+            return time.perf_counter() - start
+
+        seconds = median_seconds(args.repeats, run)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {"records_per_s": round(len(records) / seconds, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", default=",".join(CASES), help="Comma-separated cases to run")
+    parser.add_argument("--items", type=int, default=64, help="Waveforms for the encode and queue cases")
+    parser.add_argument("--seconds", type=float, default=4.0, help="Mean waveform length in seconds")
+    parser.add_argument("--records", type=int, default=5000, help="Records for prepare_item and the writer cases")
+    parser.add_argument("--num-layers", type=int, default=3)
+    parser.add_argument("--sample-rate", type=int, default=24000)
+    parser.add_argument("--model-id", default="random:snac_24khz")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--gzip-level", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [c for c in args.only.split(",") if c]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown case(s) {', '.join(sorted(unknown))}, choose from {', '.join(CASES)}")
+
+    records = synthetic_records(args.records, args.num_layers) if {"dump_line", "gzip", "assembly"} & set(cases) else None
+    runners = {
+        "prepare_item": lambda: bench_prepare_item(args),
+        "queue": lambda: bench_queue(args),
+        "encode": lambda: bench_encode(args),
+        "dump_line": lambda: bench_dump_line(args, records),
+        "gzip": lambda: bench_gzip(args, records),
+        "assembly": lambda: bench_assembly(args, records),
+    }
+    results = {"args": vars(args)}
+    for case in cases:
+        results[case] = runners[case]()
+        print(f"⏱️ {case}: " + ", ".join(f"{k} {v:,}" for k, v in results[case].items()))
+    save_results("micro", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+End-to-end pipeline benchmark: runs the full `PipelineManager` (readers, workers, shard
+writing, final assembly and save) over generated synthetic datasets and reports samples/s,
+audio-seconds/s and the per-stage breakdown from the run's metrics.
+
+Runs offline on CPU by default: the datasets are written by `benchmarks.synthetic_dataset`
+and the codec is a tiny random model (`random:snac_24khz`). Pass a real model id with
+`--model-id` (and `--gpu-workers -1`) to measure production throughput. Any base setting can
+be overridden with `--set KEY=VALUE`; generated datasets are kept between runs with the
+same parameters in `--data-dir`.
+
+    python -m benchmarks.bench_pipeline --items 400 --datasets 2 --durations lognormal:4,0.6 \
+        --cpu-workers 2 --num-readers 2 --set max_batch_size=8 --set shard_format=parquet
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from benchmarks.common import peak_rss_mb, save_results
+from benchmarks.synthetic_dataset import dataset_config, parse_constants, write_dataset
+
+
+def prepare_datasets(args) -> list:
+    """Writes the synthetic datasets unless they exist already. Returns their config entries"""
+    entries = []
+    for i in range(args.datasets):
+        key = f"{args.items}-{args.durations}-{args.source_rate}-{args.speakers}-{i}".replace(":", "_").replace(",", "_")
+        data_dir = os.path.join(args.data_dir, f"synth{i}-{key}")
+        if not os.path.exists(os.path.join(data_dir, "metadata.csv")):
+            shutil.rmtree(data_dir, ignore_errors=True)
+            stats = write_dataset(data_dir + ".tmp", args.items, args.durations, args.source_rate,
+                                  speakers=args.speakers, seed=i)
+            os.replace(data_dir + ".tmp", data_dir)
+            print(f"🎲 Wrote {stats['items']:,} clips ({stats['audio_seconds'] / 60:.1f} min) to {data_dir}")
+        entries.append(dataset_config(data_dir, args.speakers, parse_constants(args.constant)))
+    return entries
+
+
+def write_config(work_dir: str, datasets: list, args) -> str:
+    """Writes the pipeline config of the benchmark run"""
+    base = {
+        "audio_codec": args.model_id,
+        "num_readers": args.num_readers,
+        "qsize": 256,
+        "OUT_DIR": os.path.join(work_dir, "out"),
+        "gzip_level": 1,
+        "buffer_size": 1 << 20,
+        "lines_per_file": args.lines_per_file,
+        "load_dataset_num_proc": 1,
+        "gpu_workers": args.gpu_workers,
+        "cpu_workers": args.cpu_workers,
+        "metrics_interval": 2.0,
+    }
+    for value in args.set or []:
+        key, _, val = value.partition("=")
+        base[key] = yaml.safe_load(val)
+    config = {
+        "base_settings": base,
+        "save_settings": {"local": os.path.join(work_dir, "final"), "hf_upload": None},
+        "hf_datasets": datasets,
+    }
+    path = os.path.join(work_dir, "config.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    return path
+
+
+def stage_summary(totals: dict) -> dict:
+    """Total seconds and p50 per stage of readers and workers"""
+    return {
+        role: {stage: {"total_s": s["total_s"], "p50_s": s["p50_s"]} for stage, s in totals[role]["stages"].items()}
+        for role in ("reader", "worker") if role in totals
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=200, help="Clips per dataset")
+    parser.add_argument("--datasets", type=int, default=2)
+    parser.add_argument("--durations", default="lognormal:4,0.6,20", help="Clip duration distribution")
+    parser.add_argument("--source-rate", type=int, default=24000, help="Sample rate of the generated files")
+    parser.add_argument("--speakers", type=int, default=8)
+    parser.add_argument("--constant", action="append", default=None, help="KEY=VALUE constant column (repeatable)")
+    parser.add_argument("--model-id", default="random:snac_24khz")
+    parser.add_argument("--cpu-workers", type=int, default=2)
+    parser.add_argument("--gpu-workers", type=int, default=0)
+    parser.add_argument("--num-readers", type=int, default=2)
+    parser.add_argument("--lines-per-file", type=int, default=1000)
+    parser.add_argument("--set", action="append", default=None, help="Base setting override KEY=VALUE (repeatable)")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "snac-bench-data"),
+                        help="Where generated datasets are kept")
+    parser.add_argument("--keep", action="store_true", help="Keep the run's output directory")
+    args = parser.parse_args()
+
+    from utils.logging_config import setup_logging
+    from utils.pipeline_manager import PipelineManager
+
+    setup_logging()
+    datasets = prepare_datasets(args)
+    work_dir = tempfile.mkdtemp(prefix="snac-bench-pipeline-")
+    try:
+        pipeline = PipelineManager(config_path=write_config(work_dir, datasets, args))
+        pipeline.validate()
+        start = time.perf_counter()
+        pipeline.process_datasets(pipeline.config_manager.get_datasets())
+        encode_s = time.perf_counter() - start
+        start = time.perf_counter()
+        pipeline.assemble_and_save_final_dataset()
+        assembly_s = time.perf_counter() - start
+
+        with open(os.path.join(pipeline.metrics_dir, "run_report.json")) as f:
+            report = json.load(f)
+        counters = report["totals"].get("worker", {}).get("counters", {})
+        items, audio_seconds = counters.get("items", 0), counters.get("audio_seconds", 0.0)
+        results = {
+            "args": vars(args),
+            "items": items,
+            "audio_seconds": round(audio_seconds, 1),
+            "encode_s": round(encode_s, 2),
+            "assembly_s": round(assembly_s, 2),
+            "items_per_s": round(items / encode_s, 2),
+            "audio_seconds_per_s": round(audio_seconds / encode_s, 2),
+            "bottleneck": report.get("bottleneck"),
+            "errors": report.get("error_count", 0),
+            "queues": report.get("queues"),
+            "stages": stage_summary(report["totals"]),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "peak_child_rss_mb": round(peak_rss_mb(children=True), 1),
+        }
+    finally:
+        if args.keep:
+            print(f"📁 Run kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n⏱️ Pipeline: {results['items']:,} items in {encode_s:.1f}s "
+          f"({results['items_per_s']:,.1f} items/s, {results['audio_seconds_per_s']:,.1f} audio-s/s, "
+          f"{results['bottleneck']}), assembly {assembly_s:.1f}s")
+    save_results("pipeline", results)
+
+
+if __name__ == "__main__":
+    main()
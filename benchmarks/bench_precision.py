@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Inference mode benchmark: encode throughput and token agreement of SNACCoder's precision
+and compile modes against float32 eager mode, on a synthetic waveform corpus.
+
+Every mode first encodes the corpus once (which also compiles the model's graphs, reported
+as the warm-up time) and is then timed on a second pass. The mismatch rate is the fraction
+of tokens per layer that differ from float32 eager codes of the same waveforms.
+
+    python -m benchmarks.bench_precision --device cpu --modes fp32,bf16,fp32+compile,bf16+compile
+"""
+
+import argparse
+import time
+
+import torch
+
+from benchmarks.bench_cpu_scaling import synthetic_corpus
+from benchmarks.common import peak_rss_mb, save_results
+from utils.snac_codec import SNACCoder
+
+
+def encode_corpus(model: SNACCoder, corpus, batch_size: int) -> tuple:
+    """Encodes the corpus in batches. Returns the seconds it took and the codes"""
+    if model.device.type == "cuda":
+        torch.cuda.synchronize(model.device)
+    start = time.perf_counter()
+    codes = []
+    for i in range(0, len(corpus), batch_size):
+        codes.extend(model.encode_batch(corpus[i:i + batch_size]))
+    if model.device.type == "cuda":
+        torch.cuda.synchronize(model.device)
+    return time.perf_counter() - start, codes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-id", default="hubertsiuzdak/snac_24khz")
+    parser.add_argument("--device", default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--modes", default="fp32,bf16,fp32+compile,bf16+compile",
+                        help="Comma-separated precisions, each optionally with +compile")
+    parser.add_argument("--compile-mode", default="default")
+    parser.add_argument("--items", type=int, default=32)
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    parser.add_argument("--max-seconds", type=float, default=8.0)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=0, help="PyTorch intra-op threads (0 = default)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = SNACCoder(args.device, model_id=args.model_id)
+    corpus = synthetic_corpus(args.items, args.min_seconds, args.max_seconds, model.snac_model.sampling_rate)
+    audio_seconds = sum(wave.shape[0] for wave in corpus) / model.snac_model.sampling_rate
+
+    results = {}
+    for mode in args.modes.split(","):
+        precision, _, compiled = mode.partition("+")
+        model.set_inference_mode(precision, compile_model=compiled == "compile", compile_mode=args.compile_mode)
+        warmup_s, codes = encode_corpus(model, corpus, args.batch_size)
+        seconds, _ = encode_corpus(model, corpus, args.batch_size)
+        counts = model.token_agreement(corpus, codes)
+        mismatch = [round(m / n, 6) if n else 0.0 for m, n in counts]
+        results[mode] = {
+            "warmup_s": round(warmup_s, 2),
+            "seconds": round(seconds, 3),
+            "audio_s_per_s": round(audio_seconds / seconds, 1),
+            "mismatch_rate_per_layer": mismatch,
+        }
+        print(f"🚀 {mode:>14}: {audio_seconds / seconds:8.1f} audio-s/s | warm-up {warmup_s:6.1f}s | "
+              f"mismatch {' / '.join(f'{m:.3%}' for m in mismatch)}")
+
+    baseline = results.get("fp32")
+    if baseline is not None:
+        for mode, r in results.items():
+            r["speedup"] = round(baseline["seconds"] / r["seconds"], 2)
+
+    results["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    save_results("precision", {"args": vars(args), "audio_seconds": round(audio_seconds, 1), **results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Shard format benchmark: write throughput, file size and final-assembly time of
+the jsonl.gz, parquet and arrow shard writers on synthetic encoded records.
+
+    python -m benchmarks.bench_shard_formats --records 20000 --lines-per-file 5000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from datasets import load_dataset, disable_progress_bars
+
+from benchmarks.common import save_results
+from utils.shard_writer import SHARD_WRITERS
+
+
+def synthetic_records(num_records: int, num_layers: int, seed: int = 0):
+    """Records shaped like SNAC 24 kHz output for 1-15 s clips"""
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(num_records):
+        seconds = rng.uniform(1.0, 15.0)
+        base = max(1, int(seconds * 12))
+        lengths = [base * 2 ** layer for layer in range(num_layers)]
+        rec = {"text": f"synthetic utterance number {i} " * 3}
+        for layer, n in enumerate(lengths, start=1):
+            rec[f"snac_layer_{layer}"] = rng.integers(0, 4096, n, dtype=np.int64)
+        rec["num_layers"] = num_layers
+        rec["token_lengths"] = lengths
+        rec["speaker"] = f"spk{i % 50}"
+        rec["lang"] = "en"
+        records.append(rec)
+    return records
+
+
+def run_format(name: str, records, args, work_dir: str) -> dict:
+    """Writes all records in one format with rotation and loads them back"""
+    writer_cls = SHARD_WRITERS[name]
+    out_dir = os.path.join(work_dir, name.replace(".", "_"))
+    os.makedirs(out_dir)
+
+    start = time.perf_counter()
+    for file_idx, first in enumerate(range(0, len(records), args.lines_per_file)):
+        path = os.path.join(out_dir, f"bench-worker00-{file_idx:05d}{writer_cls.extension}")
+        writer = writer_cls(path, args.num_layers, gzip_level=args.gzip_level,
+                            row_group_size=args.lines_per_file)
+        for rec in records[first:first + args.lines_per_file]:
+            writer.write(rec)
+        writer.close()
+    write_s = time.perf_counter() - start
+
+    size = sum(os.path.getsize(os.path.join(out_dir, f)) for f in os.listdir(out_dir))
+
+    start = time.perf_counter()
+    ds = load_dataset(writer_cls.builder, data_dir=out_dir, data_files=f"*{writer_cls.extension}",
+                      split="train", cache_dir=os.path.join(work_dir, f"cache_{name}"))
+    assert len(ds) == len(records)
+    assemble_s = time.perf_counter() - start
+
+    return {
+        "format": name,
+        "write_s": round(write_s, 3),
+        "records_per_s": round(len(records) / write_s, 1),
+        "size_mb": round(size / 1024 ** 2, 2),
+        "assemble_s": round(assemble_s, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--lines-per-file", type=int, default=5000)
+    parser.add_argument("--num-layers", type=int, default=3)
+    parser.add_argument("--gzip-level", type=int, default=1)
+    parser.add_argument("--formats", nargs="+", default=list(SHARD_WRITERS))
+    args = parser.parse_args()
+
+    disable_progress_bars()
+    records = synthetic_records(args.records, args.num_layers)
+    work_dir = tempfile.mkdtemp(prefix="snac-bench-formats-")
+
+    results = []
+    try:
+        for name in args.formats:
+            res = run_format(name, records, args, work_dir)
+            print(f"🧾 {name:>8}: write {res['records_per_s']:>9,.0f} rec/s | "
+                  f"{res['size_mb']:>7.1f} MB | assemble {res['assemble_s']:.2f}s")
+            results.append(res)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_results("shard_formats", {"args": vars(args), "cases": results})
+
+
+if __name__ == "__main__":
+    main()
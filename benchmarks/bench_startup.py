@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Worker startup benchmark: seconds from spawning a process to its first encoded sample,
+loading the codec with `SNAC.from_pretrained` versus from the memory-mapped model cache,
+and the import time of a reader process (which should not import torch).
+
+Every case runs in a freshly spawned process, as pipeline workers do, and is repeated
+`--repeats` times; the median is reported. Times are split into imports (torch, snac),
+model load and the first encode.
+
+    python -m benchmarks.bench_startup --model-id hubertsiuzdak/snac_24khz --repeats 3
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.common import save_results
+
+
+def _first_sample(t0: float, model_id: str, cache_dir, result_q):
+    """Worker-like startup: import the codec, load the model, encode one second of audio"""
+    t_start = time.time()
+    import numpy as np
+    from utils.snac_codec import SNACCoder
+    t_imported = time.time()
+    model = SNACCoder("cpu", model_id=model_id, cache_dir=cache_dir)
+    t_loaded = time.time()
+    model(np.zeros(model.snac_model.sampling_rate, dtype=np.float32))
+    t_first = time.time()
+    result_q.put({
+        "spawn_s": t_start - t0,
+        "import_s": t_imported - t_start,
+        "load_s": t_loaded - t_imported,
+        "first_encode_s": t_first - t_loaded,
+        "total_s": t_first - t0,
+    })
+
+
+def _reader_imports(t0: float, result_q):
+    """Reader-like startup: import the reader worker module"""
+    t_start = time.time()
+    import utils.reader_worker  # noqa: F401
+    result_q.put({
+        "spawn_s": t_start - t0,
+        "import_s": time.time() - t_start,
+        "total_s": time.time() - t0,
+        "imports_torch": "torch" in sys.modules,
+    })
+
+
+def run_spawned(target, *args) -> dict:
+    """Runs target in a spawned process and returns what it reports"""
+    ctx = mp.get_context("spawn")
+    result_q = ctx.Queue()
+    proc = ctx.Process(target=target, args=(time.time(), *args, result_q))
+    proc.start()
+    result = result_q.get()
+    proc.join()
+    return result
+
+
+def median_case(repeats: int, target, *args) -> dict:
+    """Median of every reported time over several runs"""
+    runs = [run_spawned(target, *args) for _ in range(repeats)]
+    return {key: (round(statistics.median(r[key] for r in runs), 3) if isinstance(runs[0][key], float)
+                  else runs[0][key])
+            for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-id", default="hubertsiuzdak/snac_24khz")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="snac-bench-startup-")
+    results = {}
+    try:
+        results["reader"] = median_case(args.repeats, _reader_imports)
+        r = results["reader"]
+        print(f"📖 Reader: {r['total_s']:.2f}s to import ({r['import_s']:.2f}s imports), "
+              f"torch imported: {r['imports_torch']}")
+
+        results["from_pretrained"] = median_case(args.repeats, _first_sample, args.model_id, None)
+        cache_dir = os.path.join(work_dir, "models")
+        from utils.snac_codec import cache_model
+        cache_model(args.model_id, cache_dir)
+        results["model_cache"] = median_case(args.repeats, _first_sample, args.model_id, cache_dir)
+
+        for case in ("from_pretrained", "model_cache"):
+            r = results[case]
+            print(f"🚀 {case:>15}: {r['total_s']:.2f}s to the first sample | spawn {r['spawn_s']:.2f}s, "
+                  f"imports {r['import_s']:.2f}s, load {r['load_s']:.2f}s, first encode {r['first_encode_s']:.2f}s")
+        results["load_speedup"] = round(results["from_pretrained"]["load_s"] / max(1e-9, results["model_cache"]["load_s"]), 2)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_results("startup", {"args": vars(args), **results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Token store benchmark: open time and random-access samples/s of a memory-mapped token
+store against the same shards loaded with load_dataset("json"), plus the one-off cost of
+converting the jsonl.gz shards.
+
+    python -m benchmarks.bench_token_store --records 20000 --reads 20000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from datasets import load_dataset, disable_progress_bars
+
+from benchmarks.bench_shard_formats import synthetic_records
+from benchmarks.common import peak_rss_mb, save_results
+from utils.shard_writer import JsonlGzShardWriter
+from utils.token_store import TokenStore, convert_shards, find_shards
+
+
+def write_shards(records, args, out_dir: str):
+    """Writes records as rotated jsonl.gz shards like the workers do"""
+    for file_idx, first in enumerate(range(0, len(records), args.lines_per_file)):
+        path = os.path.join(out_dir, f"bench-worker00-{file_idx:05d}{JsonlGzShardWriter.extension}")
+        writer = JsonlGzShardWriter(path, args.num_layers, gzip_level=args.gzip_level)
+        for rec in records[first:first + args.lines_per_file]:
+            writer.write(rec)
+        writer.close()
+
+
+def random_reads(get_sample, indices) -> float:
+    """Reads the samples at the given indices, touching every token. Returns samples/s"""
+    start = time.perf_counter()
+    total = 0
+    for idx in indices:
+        for tokens in get_sample(int(idx)):
+            total += len(tokens)
+    assert total > 0
+    return len(indices) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--reads", type=int, default=20000)
+    parser.add_argument("--lines-per-file", type=int, default=5000)
+    parser.add_argument("--num-layers", type=int, default=3)
+    parser.add_argument("--gzip-level", type=int, default=1)
+    args = parser.parse_args()
+
+    disable_progress_bars()
+    records = synthetic_records(args.records, args.num_layers)
+    indices = np.random.default_rng(1).integers(0, args.records, args.reads)
+    layer_keys = [f"snac_layer_{i}" for i in range(1, args.num_layers + 1)]
+    work_dir = tempfile.mkdtemp(prefix="snac-bench-tokens-")
+
+    try:
+        shard_dir = os.path.join(work_dir, "shards")
+        os.makedirs(shard_dir)
+        write_shards(records, args, shard_dir)
+
+        start = time.perf_counter()
+        store_dir = os.path.join(work_dir, "tokens")
+        convert_shards(find_shards(shard_dir), store_dir)
+        convert_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ds = load_dataset("json", data_dir=shard_dir, data_files="*.jsonl.gz", split="train",
+                          cache_dir=os.path.join(work_dir, "cache"))
+        json_load_s = time.perf_counter() - start
+        json_rate = random_reads(lambda i: [ds[i][k] for k in layer_keys], indices)
+        json_columns = ds.select_columns(layer_keys)
+        json_columns_rate = random_reads(lambda i: list(json_columns[i].values()), indices)
+
+        start = time.perf_counter()
+        store = TokenStore(store_dir)
+        store_open_s = time.perf_counter() - start
+        store_rate = random_reads(store.layers, indices)
+        store_full_rate = random_reads(lambda i: [store[i][k] for k in layer_keys], indices)
+
+        for idx in indices[:100]:
+            for i, k in enumerate(layer_keys):
+                assert np.array_equal(store.layers(int(idx))[i], records[idx][k])
+
+        store_mb = sum(os.path.getsize(os.path.join(store_dir, f)) for f in os.listdir(store_dir)) / 1024 ** 2
+        shards_mb = sum(os.path.getsize(p) for p in find_shards(shard_dir)) / 1024 ** 2
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        "convert_s": round(convert_s, 3),
+        "shards_mb": round(shards_mb, 2),
+        "store_mb": round(store_mb, 2),
+        "json_load_s": round(json_load_s, 3),
+        "json_samples_per_s": round(json_rate, 1),
+        "json_layer_columns_samples_per_s": round(json_columns_rate, 1),
+        "store_open_s": round(store_open_s, 6),
+        "store_layers_samples_per_s": round(store_rate, 1),
+        "store_full_samples_per_s": round(store_full_rate, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(f"🔄 Convert {args.records:,} records: {convert_s:.2f}s ({shards_mb:.1f} MB shards -> {store_mb:.1f} MB store)")
+    print(f"📦 load_dataset('json'): load {json_load_s:.2f}s | {json_rate:,.0f} samples/s "
+          f"({json_columns_rate:,.0f} with only layer columns)")
+    print(f"🧱 TokenStore: open {store_open_s * 1000:.2f} ms | {store_rate:,.0f} samples/s layers only, "
+          f"{store_full_rate:,.0f} with metadata | {store_rate / json_rate:.0f}x")
+
+    save_results("token_store", {"args": vars(args), **results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Reader → worker transport benchmark: pickled waveforms on a multiprocessing.Queue
+versus the shared-memory ring (utils.shm_transport).
+
+Readers push synthetic float64 waveforms (as datasets returns them), consumers touch
+every sample and release the slot. Reports items/s and peak RSS per process.
+
+    python -m benchmarks.bench_transport --items 2000 --seconds 10
+"""
+
+import argparse
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+from benchmarks.common import peak_rss_mb, save_results
+from utils.shm_transport import SharedWaveTransport, pack_item, unpack_item, release_item
+
+
+def _producer(reader_id, num_items, num_samples, q, writer, stats_q, ready_q, go):
+    rng = np.random.default_rng(reader_id)
+    wave = rng.standard_normal(num_samples)
+    ready_q.put(reader_id)
+    go.wait()
+    for i in range(num_items):
+        q.put(pack_item({"text": f"{reader_id}-{i}", "wave": wave.copy()}, writer))
+    if writer is not None:
+        writer.close()
+    stats_q.put(("reader", peak_rss_mb()))
+
+
+def _consumer(q, reader, stats_q, ready_q):
+    total = 0.0
+    ready_q.put(-1)
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        unpack_item(item, reader)
+        total += float(item["wave"][::997].sum())
+        release_item(item, reader)
+    if reader is not None:
+        reader.close()
+    stats_q.put(("worker", peak_rss_mb()))
+
+
+def run_case(use_shm: bool, args) -> dict:
+    """Runs one transport configuration and returns its measurements"""
+    q = mp.Queue(maxsize=args.qsize)
+    stats_q = mp.Queue()
+    ready_q = mp.Queue()
+    go = mp.Event()
+    transport = SharedWaveTransport(args.readers, args.slab_mb * 1024 ** 2) if use_shm else None
+    num_samples = int(args.seconds * args.sample_rate)
+
+    consumers = [
+        mp.Process(target=_consumer, args=(q, transport.reader() if transport else None, stats_q, ready_q))
+        for _ in range(args.workers)
+    ]
+    producers = [
+        mp.Process(target=_producer, args=(i, args.items // args.readers, num_samples, q,
+                                           transport.writer(i) if transport else None,
+                                           stats_q, ready_q, go))
+        for i in range(args.readers)
+    ]
+
+    for p in consumers + producers:
+        p.start()
+    # Process start-up (interpreter and imports) is not part of the transport cost
+    for _ in range(len(consumers) + len(producers)):
+        ready_q.get()
+    start = time.perf_counter()
+    go.set()
+    for p in producers:
+        p.join()
+    for _ in consumers:
+        q.put(None)
+    for p in consumers:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    if transport is not None:
+        transport.close()
+
+    rss = {"reader": [], "worker": []}
+    for _ in range(len(producers) + len(consumers)):
+        role, mb = stats_q.get()
+        rss[role].append(mb)
+
+    items = (args.items // args.readers) * args.readers
+    return {
+        "transport": "shm" if use_shm else "queue",
+        "items": items,
+        "elapsed_s": round(elapsed, 3),
+        "items_per_s": round(items / elapsed, 1),
+        "peak_rss_reader_mb": round(max(rss["reader"]), 1),
+        "peak_rss_worker_mb": round(max(rss["worker"]), 1),
+        "peak_rss_total_mb": round(sum(rss["reader"]) + sum(rss["worker"]), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duration of each synthetic clip")
+    parser.add_argument("--sample-rate", type=int, default=24000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--qsize", type=int, default=10000)
+    parser.add_argument("--slab-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    mp.set_start_method("spawn", force=True)
+
+    results = []
+    for use_shm in (False, True):
+        res = run_case(use_shm, args)
+        print(f"🚚 {res['transport']:>5}: {res['items_per_s']:>9,.1f} items/s | "
+              f"peak RSS reader {res['peak_rss_reader_mb']:.0f} MB, "
+              f"worker {res['peak_rss_worker_mb']:.0f} MB, total {res['peak_rss_total_mb']:.0f} MB")
+        results.append(res)
+
+    save_results("transport", {"args": vars(args), "cases": results})
+
+
+if __name__ == "__main__":
+    main()
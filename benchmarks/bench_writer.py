@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Writer stage benchmark: how much of the encode loop is spent writing shards when
+records are written inline, through the background writer thread, and through the
+writer thread with parallel gzip compression.
+
+The encode step is simulated by sleeping (like waiting for a GPU), so the numbers
+show the storage cost the device would otherwise wait for.
+
+    python -m benchmarks.bench_writer --records 20000 --encode-ms 0.5 --compress-threads 4
+"""
+
+import argparse
+import gzip
+import os
+import tempfile
+import time
+
+from benchmarks.bench_shard_formats import synthetic_records
+from benchmarks.common import save_results
+from utils.audio_worker import WriterThread
+from utils.shard_writer import JsonlGzShardWriter
+
+
+def run_case(name: str, records, args, work_dir: str, queue_size: int, compress_threads: int) -> dict:
+    """Runs a simulated encode loop and returns how long it spent on storage"""
+    path = os.path.join(work_dir, f"{name}.jsonl.gz")
+    writer = JsonlGzShardWriter(path, args.num_layers, gzip_level=args.gzip_level,
+                                compress_threads=compress_threads)
+    thread = WriterThread(queue_size) if queue_size else None
+    if thread is not None:
+        thread.start()
+
+    store_s = 0.0
+    start = time.perf_counter()
+    for rec in records:
+        time.sleep(args.encode_ms / 1000.0)
+        step_start = time.perf_counter()
+        if thread is not None:
+            thread.submit(writer.write, rec)
+        else:
+            writer.write(rec)
+        store_s += time.perf_counter() - step_start
+
+    if thread is not None:
+        thread.submit(writer.close)
+        thread.stop()
+    else:
+        writer.close()
+    wall_s = time.perf_counter() - start
+
+    with gzip.open(path, "rb") as f:
+        assert sum(1 for _ in f) == len(records)
+
+    encode_s = len(records) * args.encode_ms / 1000.0
+    return {
+        "case": name,
+        "wall_s": round(wall_s, 3),
+        "encode_thread_storage_s": round(store_s, 3),
+        "off_thread_storage_s": round(thread.busy_s, 3) if thread is not None else 0.0,
+        "overhead_vs_encode": round(wall_s / encode_s - 1, 3),
+        "size_mb": round(os.path.getsize(path) / 1024 ** 2, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--num-layers", type=int, default=3)
+    parser.add_argument("--gzip-level", type=int, default=1)
+    parser.add_argument("--encode-ms", type=float, default=0.5, help="Simulated encode time per record")
+    parser.add_argument("--queue-size", type=int, default=1024)
+    parser.add_argument("--compress-threads", type=int, default=4)
+    args = parser.parse_args()
+
+    records = synthetic_records(args.records, args.num_layers)
+    cases = [
+        ("inline", 0, 1),
+        ("writer_thread", args.queue_size, 1),
+        (f"writer_thread_gzip{args.compress_threads}", args.queue_size, args.compress_threads),
+    ]
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, queue_size, compress_threads in cases:
+            res = run_case(name, records, args, work_dir, queue_size, compress_threads)
+            print(f"✍️  {name:>22}: wall {res['wall_s']:7.2f}s | storage on encode thread "
+                  f"{res['encode_thread_storage_s']:6.2f}s | overhead {res['overhead_vs_encode']:+.1%} | "
+                  f"{res['size_mb']:.1f} MB")
+            results.append(res)
+
+    save_results("writer", {"args": vars(args), "cases": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Shared helpers for benchmark scripts.
+"""
+
+import json
+import os
+import platform
+import resource
+import time
+from typing import Any, Dict
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """Peak resident set size of this process (or its largest waited-for child) in MB"""
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def save_results(name: str, results: Dict[str, Any], out_dir: str = RESULTS_DIR) -> str:
+    """Saves benchmark results as timestamped JSON and returns the path"""
+    os.makedirs(out_dir, exist_ok=True)
+    payload = {
+        "benchmark": name,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    path = os.path.join(out_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+    print(f"💾 Results saved to {path}")
+    return path
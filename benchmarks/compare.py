@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Compares two saved benchmark results: every numeric result present in both runs, with its
+relative change. Arguments are not compared.
+
+    python -m benchmarks.compare benchmarks/results/pipeline-A.json benchmarks/results/pipeline-B.json
+"""
+
+import argparse
+import json
+from typing import Any, Dict
+
+
+def numeric_leaves(obj: Any, prefix: str = "") -> Dict[str, float]:
+    """Flattens nested results into {"a.b.c": value} for their numbers"""
+    if isinstance(obj, bool):
+        return {}
+    if isinstance(obj, (int, float)):
+        return {prefix: float(obj)}
+    if isinstance(obj, dict):
+        leaves = {}
+        for key, value in obj.items():
+            if key != "args":
+                leaves.update(numeric_leaves(value, f"{prefix}.{key}" if prefix else str(key)))
+        return leaves
+    return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before", help="Results JSON of the baseline run")
+    parser.add_argument("after", help="Results JSON of the run to compare")
+    parser.add_argument("--threshold", type=float, default=0.0, help="Only show changes above this percentage")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before.get("benchmark") != after.get("benchmark"):
+        print(f"⚠️ Comparing different benchmarks: {before.get('benchmark')} vs {after.get('benchmark')}")
+
+    old, new = numeric_leaves(before["results"]), numeric_leaves(after["results"])
+    print(f"{'metric':<50} {'before':>14} {'after':>14} {'change':>9}")
+    for key in sorted(old.keys() & new.keys()):
+        change = (new[key] - old[key]) / abs(old[key]) * 100 if old[key] else 0.0
+        if abs(change) >= args.threshold:
+            print(f"{key:<50} {old[key]:>14,.2f} {new[key]:>14,.2f} {change:>+8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Load test of the encode service (`utils.encode_service`): sends synthetic clips from a number
+of concurrent keep-alive connections and reports p50/p99 latency, requests/s and audio-s/s
+per concurrency level, with the mean batch size the service formed.
+
+Without `--url` or `--unix`, a service with the tiny random model (`random:snac_24khz`) is
+started on a free local port for the test. Clips are distinct unless `--duplicates` is set, so
+the service cache only helps when asked to.
+
+    python -m benchmarks.load_test_service --concurrency 1,4,16 --requests 128 --durations uniform:1,4
+    python -m benchmarks.load_test_service --url http://127.0.0.1:8765 --concurrency 8,32
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+import soundfile as sf
+import yaml
+
+from benchmarks.common import save_results
+from benchmarks.synthetic_dataset import clip_durations, synthetic_clip
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 client connection"""
+
+    def __init__(self, url: Optional[str], unix: Optional[str] = None):
+        self.url = urlsplit(url) if url else None
+        self.unix = unix
+        self.reader = self.writer = None
+
+    async def open(self):
+        if self.unix:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.unix)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(self.url.hostname, self.url.port)
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      content_type: str = "application/octet-stream") -> Tuple[int, Dict[str, Any]]:
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: {content_type}\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return status, json.loads(await self.reader.readexactly(int(headers["content-length"])))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def make_bodies(args, seed: int) -> List[Tuple[bytes, str, float]]:
+    """Request bodies with their content type and audio seconds"""
+    rng = np.random.default_rng(seed)
+    distinct = max(1, int(round(args.requests * (1 - args.duplicates))))
+    bodies = []
+    for seconds in clip_durations(args.durations, distinct, rng):
+        clip = synthetic_clip(int(seconds * args.sample_rate), args.sample_rate, rng)
+        if args.format == "wav":
+            buf = io.BytesIO()
+            sf.write(buf, clip, args.sample_rate, format="WAV", subtype="PCM_16")
+            bodies.append((buf.getvalue(), "audio/wav", float(seconds)))
+        else:
+            bodies.append((clip.tobytes(), "application/octet-stream", float(seconds)))
+    return [bodies[i % distinct] for i in range(args.requests)]
+
+
+async def run_level(args, concurrency: int, bodies: List[Tuple[bytes, str, float]]) -> Dict[str, Any]:
+    """Sends every body once from `concurrency` connections"""
+    path = f"/encode?sample_rate={args.sample_rate}"
+    latencies: List[float] = []
+    errors = 0
+    audio_seconds = 0.0
+    next_body = iter(range(len(bodies)))
+
+    async def client():
+        nonlocal errors, audio_seconds
+        conn = Connection(args.url, args.unix)
+        await conn.open()
+        try:
+            for i in next_body:
+                body, content_type, seconds = bodies[i]
+                start = time.perf_counter()
+                status, _ = await conn.request("POST", path, body, content_type)
+                latencies.append(time.perf_counter() - start)
+                if status == 200:
+                    audio_seconds += seconds
+                else:
+                    errors += 1
+        finally:
+            conn.close()
+
+    stats = Connection(args.url, args.unix)
+    await stats.open()
+    _, before = await stats.request("GET", "/stats")
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    _, after = await stats.request("GET", "/stats")
+    stats.close()
+
+    batches = after["batches"] - before["batches"]
+    ordered = np.sort(latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(1000 * float(np.percentile(ordered, 50)), 1),
+        "p99_ms": round(1000 * float(np.percentile(ordered, 99)), 1),
+        "requests_per_s": round(len(latencies) / elapsed, 2),
+        "audio_seconds_per_s": round(audio_seconds / elapsed, 2),
+        "mean_batch_size": round((after["batched_requests"] - before["batched_requests"]) / batches, 2) if batches else 0.0,
+        "cache_hits": after["cache_hits"] - before["cache_hits"],
+    }
+
+
+def start_service(args, work_dir: str) -> subprocess.Popen:
+    """Starts a local encode service on a free port and waits until it answers"""
+    config = {
+        "base_settings": {"audio_codec": args.model_id, "OUT_DIR": os.path.join(work_dir, "out"), "num_readers": 1,
+                          "qsize": 1, "gzip_level": 1, "buffer_size": 1 << 20, "lines_per_file": 1000},
+        "save_settings": {"local": None, "hf_upload": None},
+        "hf_datasets": [],
+    }
+    config_path = os.path.join(work_dir, "config.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    args.url = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen([sys.executable, "-m", "utils.encode_service", "--config", config_path,
+                             "--port", str(port), "--device", args.device, "--threads", str(args.threads),
+                             "--max-batch-size", str(args.max_batch_size), "--max-wait-ms", str(args.max_wait_ms),
+                             "--cache-mb", str(args.cache_mb)])
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"❌ Encode service exited with code {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("❌ Encode service did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Service to test (default: start a local one)")
+    parser.add_argument("--unix", default=None, help="Unix socket of the service to test")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrent connection counts")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per concurrency level")
+    parser.add_argument("--durations", default="uniform:1,4", help="Clip duration distribution")
+    parser.add_argument("--sample-rate", type=int, default=24000, help="Sample rate of the sent audio")
+    parser.add_argument("--format", default="pcm", choices=["pcm", "wav"], help="Raw float32 PCM or 16-bit wav bodies")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Fraction of requests repeating an earlier clip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model-id", default="random:snac_24khz", help="Model of the local service")
+    parser.add_argument("--device", default="cpu", help="Device of the local service")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads of the local service")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="Batch size of the local service")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Batching deadline of the local service")
+    parser.add_argument("--cache-mb", type=float, default=256.0, help="Cache of the local service")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    proc = None
+    work_dir = tempfile.mkdtemp(prefix="snac-bench-service-")
+    try:
+        if not args.url and not args.unix:
+            proc = start_service(args, work_dir)
+        results = {"args": vars(args), "levels": {}}
+        for i, concurrency in enumerate(levels):
+            # Fresh clips per level, so earlier levels do not warm the cache for later ones
+            level = asyncio.run(run_level(args, concurrency, make_bodies(args, args.seed + i)))
+            results["levels"][str(concurrency)] = level
+            print(f"⏱️ concurrency {concurrency}: p50 {level['p50_ms']:,.1f} ms, p99 {level['p99_ms']:,.1f} ms, "
+                  f"{level['requests_per_s']:,.1f} req/s, {level['audio_seconds_per_s']:,.1f} audio-s/s, "
+                  f"batch {level['mean_batch_size']:.1f}, {level['errors']} error(s)")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    save_results("service", results)
+
+
+if __name__ == "__main__":
+    main()
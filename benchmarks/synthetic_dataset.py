@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Synthetic local audio datasets for benchmarks: an audiofolder directory (audio files plus
+metadata.csv) with a configurable clip duration distribution, sample rate, channel count,
+file format and speaker column, and the `hf_datasets` config entry to encode it with.
+
+Durations are given as
+- `fixed:S`: every clip S seconds
+- `uniform:MIN,MAX`: uniformly distributed between MIN and MAX seconds
+- `lognormal:MEDIAN,SIGMA[,MAX]`: log-normal around MEDIAN seconds (speech corpora look like
+  this), capped at MAX seconds (default 60)
+
+Clips are harmonic tones with a random pitch plus a little noise, generated from `--seed`.
+
+    python -m benchmarks.synthetic_dataset /tmp/synth --items 1000 --durations lognormal:4,0.6 \
+        --sample-rate 44100 --speakers 20 --constant lang=en
+"""
+
+import argparse
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import soundfile as sf
+import yaml
+
+# Shortest clip generated, whatever the distribution
+MIN_CLIP_SECONDS = 0.1
+
+
+def clip_durations(spec: str, num_items: int, rng: np.random.Generator) -> np.ndarray:
+    """Draws clip durations in seconds from a "kind:params" spec (see the module docstring)"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed" and len(values) == 1:
+        seconds = np.full(num_items, values[0])
+    elif kind == "uniform" and len(values) == 2:
+        seconds = rng.uniform(values[0], values[1], num_items)
+    elif kind == "lognormal" and len(values) in (2, 3):
+        cap = values[2] if len(values) == 3 else 60.0
+        seconds = np.minimum(cap, np.exp(rng.normal(np.log(values[0]), values[1], num_items)))
+    else:
+        raise ValueError(f"Invalid duration spec {spec!r}, expected fixed:S, uniform:MIN,MAX "
+                         f"or lognormal:MEDIAN,SIGMA[,MAX]")
+    return np.maximum(seconds, MIN_CLIP_SECONDS)
+
+
+def synthetic_clip(num_samples: int, sample_rate: int, rng: np.random.Generator) -> np.ndarray:
+    """A few harmonics of a random pitch with noise, as float32 in [-1, 1]"""
+    t = np.arange(num_samples) / sample_rate
+    f0 = rng.uniform(90.0, 300.0)
+    wave = sum(np.sin(2 * np.pi * f0 * k * t + rng.uniform(0, 2 * np.pi)) / k for k in (1, 2, 3))
+    wave = 0.2 * wave * (1.0 + 0.5 * np.sin(2 * np.pi * rng.uniform(2.0, 6.0) * t))
+    return (wave + 0.01 * rng.standard_normal(num_samples)).astype(np.float32)
+
+
+def write_dataset(out_dir: str, num_items: int, durations: str = "uniform:1,10", sample_rate: int = 24000,
+                  channels: int = 1, fmt: str = "wav", speakers: int = 0, seed: int = 0) -> Dict[str, float]:
+    """
+    Writes an audiofolder dataset with `text` (and `speaker` if speakers > 0) columns.
+    Returns the number of items and their total duration in seconds
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    seconds = clip_durations(durations, num_items, rng)
+    with open(os.path.join(out_dir, "metadata.csv"), "w") as f:
+        f.write("file_name,text" + (",speaker" if speakers else "") + "\n")
+        for i, duration in enumerate(seconds):
+            clip = synthetic_clip(int(duration * sample_rate), sample_rate, rng)
+            frames = np.repeat(clip[:, None], channels, axis=1) if channels > 1 else clip
+            name = f"clip_{i:06d}.{fmt}"
+            sf.write(os.path.join(out_dir, name), frames, sample_rate)
+            f.write(f"{name},synthetic clip {i}" + (f",spk{i % speakers:03d}" if speakers else "") + "\n")
+    return {"items": num_items, "audio_seconds": float(seconds.sum())}
+
+
+def dataset_config(data_dir: str, speakers: int = 0, constants: Optional[Dict[str, str]] = None) -> dict:
+    """The hf_datasets config entry of a dataset written by write_dataset"""
+    return {
+        "name": "audiofolder",
+        "sub_name": None,
+        "data_dir": data_dir,
+        "split": "train",
+        "text_column_name": "text",
+        "audio_column_name": "audio",
+        "speaker_column_name": "speaker" if speakers else None,
+        "add_constant": [{"key": k, "value": v} for k, v in (constants or {}).items()] or None,
+    }
+
+
+def parse_constants(values: List[str]) -> Dict[str, str]:
+    """Turns KEY=VALUE arguments into a dict"""
+    constants = {}
+    for value in values or []:
+        key, sep, val = value.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid constant {value!r}, expected KEY=VALUE")
+        constants[key] = val
+    return constants
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", help="Directory to write the dataset to")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--durations", default="uniform:1,10", help="Clip duration distribution")
+    parser.add_argument("--sample-rate", type=int, default=24000)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--format", default="wav", choices=["wav", "flac"])
+    parser.add_argument("--speakers", type=int, default=0, help="Number of distinct speakers (0 = no speaker column)")
+    parser.add_argument("--constant", action="append", default=None, help="KEY=VALUE constant column (repeatable)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stats = write_dataset(args.out_dir, args.items, args.durations, args.sample_rate, args.channels,
+                          args.format, args.speakers, args.seed)
+    print(f"✅ Wrote {stats['items']:,} clips ({stats['audio_seconds'] / 3600:.2f} h) to {args.out_dir}")
+    entry = dataset_config(os.path.abspath(args.out_dir), args.speakers, parse_constants(args.constant))
+    print(yaml.safe_dump({"hf_datasets": [entry]}, sort_keys=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,36 @@ SNAC Codec Audio Processing Pipeline
 This script processes HuggingFace audio datasets using SNAC codec model.
 It uses a multi-GPU, multi-process architecture to efficiently encode audio data.
 
-Configuration is read from config.yaml.
+Configuration is read from config.yaml. For a multi-node run, start one process per node
+with the same config and a shared OUT_DIR:
+
+    python main.py --num-nodes 2 --node-rank 0
+    python main.py --num-nodes 2 --node-rank 1
 """
 
+import argparse
+
 from utils.logging_config import setup_logging
-from utils.pipeline_manager import PipelineManager
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SNAC Codec Audio Processing Pipeline")
+    parser.add_argument("--config", default="config.yaml", help="Pipeline configuration file")
+    parser.add_argument("--num-nodes", type=int, default=None, help="Number of nodes sharing the run (overrides num_nodes)")
+    parser.add_argument("--node-rank", type=int, default=None, help="Rank of this node, 0 assembles the dataset (overrides node_rank)")
+    parser.add_argument("--ledger-dir", default=None, help="Shared work ledger directory (overrides ledger_dir)")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    overrides = {
+        key: value for key, value in
+        (("num_nodes", args.num_nodes), ("node_rank", args.node_rank), ("ledger_dir", args.ledger_dir))
+        if value is not None
+    }
     setup_logging()
-    pipeline = PipelineManager(config_path="config.yaml")
+    # Spawned readers and workers re-import this script, so the pipeline (and torch) is only imported here
+    from utils.pipeline_manager import PipelineManager
+    pipeline = PipelineManager(config_path=args.config, overrides=overrides)
     pipeline.run()
@@ -0,0 +1,43 @@
+"""Codes from the out-of-memory chunked fallback are not cached under the single-shot key"""
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from utils.audio_worker import AudioWorker
+from utils.encode_cache import EncodeCache
+from utils.metrics import Metrics
+
+
+class ChunkedModel:
+    """Stands in for SNACCoder: encodes anything, recording the chunking it was set to"""
+
+    def __init__(self):
+        self.chunking = []
+
+    def set_chunking(self, seconds, overlap, max_padded_samples):
+        self.chunking.append(seconds)
+
+    def __call__(self, wave):
+        return {"snac_layer_1": np.arange(4), "num_layers": 1, "token_lengths": [4]}
+
+
+def test_oom_fallback_codes_are_not_cached(tmp_path):
+    cache = EncodeCache(str(tmp_path / "cache.sqlite"), 1 << 20, "model|24000|0")
+    written = []
+    worker = SimpleNamespace(sample_rate=24000, chunk_seconds=0.0, chunk_overlap_seconds=0.1, max_padded_samples=0,
+                             metrics=Metrics(), cache=cache, _free_memory=lambda: None,
+                             _build_record=lambda item, codes: codes,
+                             _write_record=lambda rec, item: written.append(rec))
+    worker._cache_codes = lambda item, codes, encode_s: AudioWorker._cache_codes(worker, item, codes, encode_s)
+
+    wave = np.zeros(24000 * 8, dtype=np.float32)
+    key = cache.key(wave)
+    item = {"wave": wave, "_cache_key": key, "_prefix": "ds", "_row": 0}
+    model = ChunkedModel()
+    AudioWorker._encode_smaller(worker, model, item, RuntimeError("CUDA out of memory"))
+    cache.flush()
+
+    assert len(written) == 1 and model.chunking == [4.0, 0.0]
+    assert "_cache_key" not in item
+    assert cache.get(key) is None
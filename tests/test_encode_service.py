@@ -0,0 +1,117 @@
+"""The encode service batches concurrent requests, answers repeats from its cache, shares identical requests in flight and rejects malformed requests with 400"""
+
+import asyncio
+import json
+
+import numpy as np
+
+from utils.encode_service import EncodeServer, MicroBatcher
+
+SAMPLE_RATE = 24000
+
+
+class CountingCoder:
+    """Stands in for SNACCoder: codes derived from the waveform, with every encode_batch call recorded"""
+
+    num_layers = 1
+
+    def __init__(self):
+        self.batches = []
+
+    def cache_namespace(self) -> str:
+        return "counting"
+
+    def padded_length(self, n: int) -> int:
+        return n
+
+    def encode_batch(self, waves):
+        self.batches.append(len(waves))
+        return [{"snac_layer_1": np.asarray([int(w[0] * 1000), w.shape[0]]), "num_layers": 1, "token_lengths": [2]}
+                for w in waves]
+
+
+def wave(value: float, n: int = 480) -> np.ndarray:
+    return np.full(n, value, dtype=np.float32)
+
+
+async def with_batcher(coder, fn, **kwargs):
+    batcher = MicroBatcher(coder, **kwargs)
+    batcher.start()
+    try:
+        return await fn(batcher)
+    finally:
+        await batcher.stop()
+
+
+def test_concurrent_requests_share_a_batch():
+    coder = CountingCoder()
+
+    async def run(batcher):
+        return await asyncio.gather(*(batcher.encode(wave(i / 100)) for i in range(8))), batcher.stats
+
+    results, stats = asyncio.run(with_batcher(coder, run, max_batch_size=16, max_wait_ms=200))
+    assert coder.batches == [8]
+    assert stats["batches"] == 1 and stats["batched_requests"] == 8
+    assert [int(codes["snac_layer_1"][0]) for codes, cached in results] == [i * 10 for i in range(8)]
+    assert not any(cached for _, cached in results)
+
+
+def test_batches_are_capped_by_size():
+    coder = CountingCoder()
+
+    async def run(batcher):
+        await asyncio.gather(*(batcher.encode(wave(i / 100)) for i in range(10)))
+
+    asyncio.run(with_batcher(coder, run, max_batch_size=4, max_wait_ms=200))
+    assert coder.batches == [4, 4, 2]
+
+
+def test_cache_hits_and_inflight_sharing():
+    coder = CountingCoder()
+
+    async def run(batcher):
+        # Identical requests in flight share one encode; a later repeat comes from the cache
+        shared = await asyncio.gather(*(batcher.encode(wave(0.5)) for _ in range(3)))
+        repeat = await batcher.encode(wave(0.5))
+        return shared, repeat, batcher.stats
+
+    shared, (codes, cached), stats = asyncio.run(with_batcher(coder, run, max_wait_ms=20))
+    assert coder.batches == [1]
+    assert stats["shared"] == 2 and stats["cache_hits"] == 1
+    assert cached and not any(c for _, c in shared)
+    assert all(np.array_equal(c["snac_layer_1"], codes["snac_layer_1"]) for c, _ in shared)
+
+
+async def request(port: int, raw: bytes):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = json.loads(await reader.readexactly(int(headers["content-length"])))
+    writer.close()
+    return status, body
+
+
+def test_http_encode_and_bad_content_length():
+    async def run(batcher):
+        server = EncodeServer(batcher, SAMPLE_RATE)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            pcm = wave(0.25).tobytes()
+            ok = await request(port, b"POST /encode HTTP/1.1\r\nContent-Type: application/octet-stream\r\n"
+                                     b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(pcm) + pcm)
+            bad = await request(port, b"POST /encode HTTP/1.1\r\nContent-Length: ten\r\n\r\n")
+            negative = await request(port, b"POST /encode HTTP/1.1\r\nContent-Length: -5\r\n\r\n")
+        return ok, bad, negative
+
+    (status, body), bad, negative = asyncio.run(with_batcher(CountingCoder(), run, max_wait_ms=1))
+    assert status == 200 and body["snac_layer_1"] == [250, 480] and body["cached"] is False
+    assert bad[0] == 400 and negative[0] == 400
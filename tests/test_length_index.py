@@ -0,0 +1,36 @@
+"""A dataset index holds the shards of its own dataset only, and empty shards are backfilled"""
+
+import numpy as np
+
+from utils.length_index import backfill_shard_index, load_index, write_dataset_index
+from utils.resume_manifest import ResumeManifest
+from utils.shard_writer import JsonlGzShardWriter
+
+
+def write_shard(out_dir, name, rows):
+    path = str(out_dir / name)
+    writer = JsonlGzShardWriter(path, 3)
+    for row in rows:
+        writer.write({"text": f"row {row}", "snac_layer_1": np.arange(2), "snac_layer_2": np.arange(4),
+                      "snac_layer_3": np.arange(8), "token_lengths": [2, 4, 8], "num_layers": 3})
+    writer.close()
+    ResumeManifest(str(out_dir)).write(path, rows)
+    return path
+
+
+def test_index_skips_other_datasets(tmp_path):
+    write_shard(tmp_path, "libritts-worker00-00000.jsonl.gz", range(5))
+    write_shard(tmp_path, "libritts-r-worker00-00000.jsonl.gz", range(100, 120))
+
+    assert write_dataset_index(str(tmp_path), "libritts") == 5
+    index = load_index(str(tmp_path / "libritts.index.npz"))
+    assert index["shards"].tolist() == ["libritts-worker00-00000.jsonl.gz"]
+    assert index["row"].tolist() == list(range(5))
+    assert write_dataset_index(str(tmp_path), "libritts-r") == 20
+
+
+def test_backfill_empty_shard(tmp_path):
+    path = write_shard(tmp_path, "ds-worker00-00000.jsonl.gz", [])
+    assert backfill_shard_index(path) == 0
+    write_shard(tmp_path, "ds-worker00-00001.jsonl.gz", range(3))
+    assert write_dataset_index(str(tmp_path), "ds") == 3
@@ -0,0 +1,96 @@
+"""Nodes started as local processes against one ledger encode every row exactly once, also when a node stalls past its leases"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+import yaml
+
+from benchmarks.synthetic_dataset import dataset_config, write_dataset
+from utils.work_ledger import REVOKED_SUFFIX
+
+ITEMS = 200
+LEASE_SECONDS = 3.0
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_config(tmp_path) -> str:
+    write_dataset(str(tmp_path / "data"), ITEMS, "uniform:0.5,1.5", seed=0)
+    base = {"audio_codec": "random:snac_24khz", "num_readers": 1, "qsize": 64, "OUT_DIR": str(tmp_path / "out"),
+            "gzip_level": 1, "buffer_size": 1 << 20, "lines_per_file": 10, "load_dataset_num_proc": 1,
+            "gpu_workers": 0, "cpu_workers": 1, "task_rows": 20, "lease_seconds": LEASE_SECONDS}
+    config = {"base_settings": base, "save_settings": {"local": str(tmp_path / "final"), "hf_upload": None},
+              "hf_datasets": [dataset_config(str(tmp_path / "data"))]}
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+    return str(config_path)
+
+
+def start_nodes(tmp_path, config_path: str, num_nodes: int):
+    nodes = []
+    for rank in range(num_nodes):
+        log = open(tmp_path / f"node{rank}.log", "w")
+        proc = subprocess.Popen([sys.executable, "main.py", "--config", config_path, "--num-nodes", str(num_nodes),
+                                 "--node-rank", str(rank), "--ledger-dir", str(tmp_path / "ledger")],
+                                cwd=ROOT, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        nodes.append((proc, log))
+    return nodes
+
+
+def wait_nodes(nodes):
+    try:
+        for proc, _ in nodes:
+            assert proc.wait(timeout=600) == 0
+    finally:
+        for proc, log in nodes:
+            if proc.poll() is None:
+                os.killpg(proc.pid, signal.SIGKILL)
+            log.close()
+
+
+def has_shards(out_dir, rank: int) -> bool:
+    """Whether a node has started writing shards (finished or not)"""
+    return out_dir.is_dir() and any(f"-node{rank:02d}-" in name for name in os.listdir(out_dir))
+
+
+def revoked(ledger_dir) -> bool:
+    """Whether a node took over a unit whose holder stopped renewing its lease"""
+    return any(name.endswith(REVOKED_SUFFIX) for _, _, names in os.walk(ledger_dir) for name in names)
+
+
+def assert_encoded_once(tmp_path):
+    from datasets import load_from_disk
+    final = load_from_disk(str(tmp_path / "final"))
+    assert sorted(final["text"]) == sorted(f"synthetic clip {i}" for i in range(ITEMS))
+
+
+def test_nodes_encode_every_row_once(tmp_path):
+    config_path = write_config(tmp_path)
+    wait_nodes(start_nodes(tmp_path, config_path, 3))
+    assert_encoded_once(tmp_path)
+    assert all(has_shards(tmp_path / "out", rank) for rank in range(3))
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGSTOP"), reason="stalls a node with SIGSTOP")
+def test_stalled_node_rows_are_not_duplicated(tmp_path):
+    config_path = write_config(tmp_path)
+    nodes = start_nodes(tmp_path, config_path, 2)
+    stalled = nodes[1][0]
+    try:
+        # Stall node 1 with its whole process group once it is writing shards, until node 0 takes a unit over
+        deadline = time.monotonic() + 300
+        while not has_shards(tmp_path / "out", 1):
+            assert stalled.poll() is None and time.monotonic() < deadline, "node 1 never wrote a shard"
+            time.sleep(0.05)
+        os.killpg(stalled.pid, signal.SIGSTOP)
+        while not revoked(tmp_path / "ledger"):
+            assert time.monotonic() < deadline, "node 0 never took over a unit of node 1"
+            time.sleep(0.1)
+        os.killpg(stalled.pid, signal.SIGCONT)
+    finally:
+        wait_nodes(nodes)
+    assert "taken over" in (tmp_path / "node1.log").read_text()
+    assert_encoded_once(tmp_path)
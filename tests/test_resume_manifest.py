@@ -0,0 +1,32 @@
+"""Shards are matched to their dataset by exact name, so one prefix never takes the rows of another"""
+
+from utils.resume_manifest import ResumeManifest
+
+
+def write_shard(out_dir, name, rows):
+    path = out_dir / name
+    path.write_bytes(b"")
+    ResumeManifest(str(out_dir)).write(str(path), rows)
+
+
+def test_prefix_does_not_match_longer_prefix(tmp_path):
+    write_shard(tmp_path, "libritts-worker00-00000.jsonl.gz", range(0, 10))
+    write_shard(tmp_path, "libritts-r-worker00-00000.jsonl.gz", range(10, 50))
+    write_shard(tmp_path, "libritts-node01-worker01-00002.parquet", range(60, 70))
+    manifest = ResumeManifest(str(tmp_path))
+
+    assert manifest.completed_ranges("libritts") == [(0, 10), (60, 70)]
+    assert manifest.completed_ranges("libritts-r") == [(10, 50)]
+    assert manifest.next_file_index("libritts", "node01-worker01") == 3
+    assert manifest.next_file_index("libritts-r", "worker00") == 1
+
+
+def test_cleanup_keeps_other_datasets(tmp_path):
+    (tmp_path / "libritts-worker00-00001.jsonl.gz.tmp").write_bytes(b"")
+    (tmp_path / "libritts-r-worker00-00001.jsonl.gz.tmp").write_bytes(b"")
+    (tmp_path / "libritts-worker00-00002.jsonl.gz.rows.json").write_text("{}")
+    (tmp_path / "libritts-node01-worker00-00000.jsonl.gz.tmp").write_bytes(b"")
+
+    assert ResumeManifest(str(tmp_path)).cleanup("libritts", "node01") == 1
+    assert ResumeManifest(str(tmp_path)).cleanup("libritts") == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["libritts-r-worker00-00001.jsonl.gz.tmp"]
@@ -0,0 +1,40 @@
+"""Control messages sent to one worker reach only that worker, and only after the items queued before them"""
+
+import queue
+
+import pytest
+
+from utils.sample_queue import BudgetedQueue
+
+
+@pytest.mark.parametrize("slow_lane_seconds", [0.0, 5.0])
+def test_send_waits_for_queued_items(slow_lane_seconds):
+    q = BudgetedQueue(16, slow_lane_seconds=slow_lane_seconds, consumers=2)
+    q.put({"row": 0}, 4, 1.0)
+    q.put({"row": 1}, 4, 10.0)
+    q.send(1, "end")
+
+    # Held back while items queued before it are left, and never handed to another consumer
+    with pytest.raises(queue.Empty):
+        q.control[1].get(timeout=0.2)
+    rows = {q.get(timeout=5, consumer=0)["row"]}
+    q.deliver()
+    with pytest.raises(queue.Empty):
+        q.control[1].get(timeout=0.2)
+    rows.add(q.get(timeout=5, consumer=0)["row"])
+    assert rows == {0, 1}
+
+    q.deliver()
+    assert q.get(timeout=5, consumer=1) == "end"
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.2, consumer=0)
+
+
+def test_reset_consumer_gives_a_new_lane():
+    q = BudgetedQueue(16, consumers=1)
+    q.send(0, "stale")
+    q.reset_consumer(0)
+    q.send(0, "end")
+    assert q.get(timeout=5, consumer=0) == "end"
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.2, consumer=0)
@@ -0,0 +1,84 @@
+"""A shard that fails to reach the disk in full is never finalized or recorded as done, and nothing is written after it"""
+
+import errno
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from utils.audio_worker import DatasetShards, StorageError, WriterThread
+from utils.metrics import Metrics
+from utils.resume_manifest import MANIFEST_SUFFIX, TMP_SUFFIX, ResumeManifest
+from utils.shard_writer import JsonlGzShardWriter, iter_shard_records
+
+
+def record(row: int) -> dict:
+    return {"text": f"row {row}", "snac_layer_1": np.arange(row % 7 + 1), "token_lengths": [row % 7 + 1],
+            "num_layers": 1}
+
+
+def fail_writes(writer: JsonlGzShardWriter):
+    """Makes every further write to the file fail as on a full disk"""
+    def write(b):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    writer.raw.write = write
+
+
+@pytest.mark.parametrize("compress_threads", [1, 2])
+def test_close_writes_every_record(tmp_path, compress_threads):
+    path = str(tmp_path / "ds-worker00-00000.jsonl.gz")
+    writer = JsonlGzShardWriter(path, 1, compress_threads=compress_threads, metrics=Metrics())
+    for row in range(100):
+        writer.write(record(row))
+    writer.close()
+    assert [rec["text"] for rec in iter_shard_records(path)] == [f"row {row}" for row in range(100)]
+
+
+@pytest.mark.parametrize("compress_threads", [1, 2])
+def test_close_raises_write_errors(tmp_path, compress_threads):
+    writer = JsonlGzShardWriter(str(tmp_path / "ds-worker00-00000.jsonl.gz"), 1, buffer_size=1 << 16,
+                                compress_threads=compress_threads, metrics=Metrics())
+    for row in range(100):
+        writer.write(record(row))
+    fail_writes(writer)
+    with pytest.raises(OSError):
+        writer.close()
+
+
+def test_finalize_keeps_failed_shard_unfinished(tmp_path):
+    worker = SimpleNamespace(out_dir=str(tmp_path), shard_tag="worker00", writer_cls=JsonlGzShardWriter,
+                             num_layers=1, gzip_level=1, buffer_size=1 << 16, row_group_size=0, lines_per_file=1000,
+                             compress_threads=1, compact_tokens=False, length_index=False, metrics=Metrics(),
+                             manifest=ResumeManifest(str(tmp_path)), reporter=SimpleNamespace(send=print))
+    shards = DatasetShards(worker, "ds", 0)
+    for row in range(100):
+        shards.write(record(row), row)
+    fail_writes(shards.writer)
+    with pytest.raises(StorageError):
+        shards.finalize()
+    shards.finalize()
+
+    assert os.listdir(tmp_path) == ["ds-worker00-00000.jsonl.gz" + TMP_SUFFIX]
+    assert not os.path.exists(tmp_path / ("ds-worker00-00000.jsonl.gz" + MANIFEST_SUFFIX))
+    assert ResumeManifest(str(tmp_path)).completed_ranges("ds") == []
+
+
+def test_writer_thread_stops_after_failed_step():
+    ran = []
+    thread = WriterThread(4)
+    thread.start()
+
+    def fail():
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    thread.submit(fail)
+    thread.submit(ran.append, 1)
+    deadline = time.monotonic() + 10
+    while thread.error is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(StorageError):
+        thread.submit(ran.append, 2)
+    thread.stop()
+    assert ran == [] and isinstance(thread.error, OSError)
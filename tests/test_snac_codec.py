@@ -0,0 +1,73 @@
+"""Batched SNAC encoding must give exactly the codes of encoding every waveform on its own; chunked encoding the same token counts and, within the documented tolerance, the same codes"""
+
+import numpy as np
+import pytest
+import torch
+
+from utils.snac_codec import SNACCoder
+
+# snac_24khz has no attention window; snac_32khz pads to hop_length * lcm(vq_strides[0], attn_window_size)
+MODELS = ["random:snac_24khz", "random:snac_32khz"]
+CHUNK_SECONDS = 5.0
+
+
+@pytest.fixture(scope="module", params=MODELS)
+def coder(request):
+    torch.set_num_threads(1)
+    return SNACCoder("cpu", request.param)
+
+
+def mixed_lengths(pad_to: int):
+    """Lengths just below, at and above padding boundaries, several sharing a padded length"""
+    return [1, pad_to - 1, pad_to, pad_to + 1, 2 * pad_to - 7, 2 * pad_to, 3 * pad_to + 100, 5, pad_to // 2]
+
+
+def test_padding_quantum(coder):
+    model = coder.snac_model
+    assert coder.pad_to == model.hop_length * np.lcm(model.vq_strides[0], model.attn_window_size or 1)
+    for n in mixed_lengths(coder.pad_to):
+        assert coder.padded_length(n) == model.preprocess(torch.zeros(1, 1, n)).shape[-1]
+
+
+def test_encode_batch_matches_single(coder):
+    rng = np.random.default_rng(0)
+    waves = [(0.1 * rng.standard_normal(n)).astype(np.float32) for n in mixed_lengths(coder.pad_to)]
+
+    batched = coder.encode_batch(waves)
+    assert len(batched) == len(waves)
+    for wave, got in zip(waves, batched):
+        want = coder(wave)
+        assert got["num_layers"] == want["num_layers"] == coder.num_layers
+        assert list(got["token_lengths"]) == list(want["token_lengths"])
+        assert list(got["token_lengths"]) == coder.token_lengths_for(coder.padded_length(wave.shape[-1]))
+        for i in range(1, coder.num_layers + 1):
+            key = f"snac_layer_{i}"
+            np.testing.assert_array_equal(np.asarray(got[key]).reshape(-1), np.asarray(want[key]).reshape(-1))
+
+
+@pytest.mark.parametrize("overlap_seconds, max_differing", [(1.0, 0.0), (0.25, 0.001)])
+def test_encode_chunked_matches_single(coder, overlap_seconds, max_differing):
+    # README: with 5 s chunks, exact with the default 1 s of overlap and under 0.1% of the
+    # finest-layer tokens differing at 0.25 s
+    rng = np.random.default_rng(1)
+    try:
+        coder.set_chunking(CHUNK_SECONDS, overlap_seconds)
+        chunk = coder.chunk_samples
+        for n in [chunk + 1, 2 * chunk + coder.pad_to - 3, 3 * chunk + coder.pad_to + 5]:
+            wave = (0.1 * rng.standard_normal(n)).astype(np.float32)
+            got = coder.encode_chunked(wave)
+            coder.set_chunking(0.0, 0.0)
+            want = coder(wave)
+            coder.set_chunking(CHUNK_SECONDS, overlap_seconds)
+
+            lengths = coder.token_lengths_for(coder.padded_length(n))
+            assert list(got["token_lengths"]) == list(want["token_lengths"]) == lengths
+            for i in range(1, coder.num_layers + 1):
+                layer = np.asarray(got[f"snac_layer_{i}"]).reshape(-1)
+                assert layer.shape[0] == lengths[i - 1]
+            finest = coder.num_layers
+            differing = np.mean(np.asarray(got[f"snac_layer_{finest}"]).reshape(-1)
+                                != np.asarray(want[f"snac_layer_{finest}"]).reshape(-1))
+            assert differing <= max_differing
+    finally:
+        coder.set_chunking(0.0, 0.0)
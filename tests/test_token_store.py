@@ -0,0 +1,17 @@
+"""find_shards picks the shards of a dataset by exact name, not every file sharing its prefix"""
+
+import os
+
+from utils.token_store import find_shards
+
+
+def test_find_shards_skips_longer_prefix(tmp_path):
+    names = ["libritts-worker00-00000.jsonl.gz", "libritts-node01-worker00-00001.parquet",
+             "libritts-r-worker00-00000.jsonl.gz", "libritts-worker00-00002.jsonl.gz.tmp"]
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+
+    assert [os.path.basename(p) for p in find_shards(str(tmp_path), "libritts")] == sorted(names[:2])
+    assert [os.path.basename(p) for p in find_shards(str(tmp_path), "libritts-r")] == names[2:3]
+    assert len(find_shards(str(tmp_path))) == 3
+    assert find_shards(str(tmp_path / "missing"), "libritts") == []
@@ -0,0 +1,65 @@
+"""A worker killed mid-run is restarted and every row still ends up in the final dataset, with or without shm"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+import yaml
+
+from benchmarks.synthetic_dataset import dataset_config, write_dataset
+
+ITEMS = 200
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def holder_of(out_dir: str, tag: str):
+    """Pid of a process with a shard file of the given tag open in out_dir"""
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            for fd in os.listdir(f"/proc/{pid}/fd"):
+                path = os.readlink(f"/proc/{pid}/fd/{fd}")
+                if os.path.dirname(path) == out_dir and f"-{tag}-" in os.path.basename(path):
+                    return int(pid)
+        except OSError:
+            continue
+    return None
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="finds the worker through /proc")
+@pytest.mark.parametrize("shm", [False, True])
+def test_killed_worker_loses_no_rows(tmp_path, shm):
+    write_dataset(str(tmp_path / "data"), ITEMS, "uniform:0.5,1.5", seed=0)
+    out_dir = tmp_path / "out"
+    base = {"audio_codec": "random:snac_24khz", "num_readers": 1, "qsize": 64, "OUT_DIR": str(out_dir),
+            "gzip_level": 1, "buffer_size": 1 << 20, "lines_per_file": 50, "load_dataset_num_proc": 1, "gpu_workers": 0,
+            "cpu_workers": 2, "shm_transport": shm, "shm_slab_bytes": 600000}
+    config = {"base_settings": base, "save_settings": {"local": str(tmp_path / "final"), "hf_upload": None},
+              "hf_datasets": [dataset_config(str(tmp_path / "data"))]}
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+
+    log = open(tmp_path / "run.log", "w")
+    proc = subprocess.Popen([sys.executable, "main.py", "--config", str(config_path)], cwd=ROOT,
+                            stdout=log, stderr=subprocess.STDOUT)
+    try:
+        # Kill worker 0 while it is writing its first shard
+        deadline = time.monotonic() + 300
+        victim = None
+        while victim is None and proc.poll() is None and time.monotonic() < deadline:
+            victim = holder_of(str(out_dir), "worker00")
+            time.sleep(0.05)
+        assert victim is not None, "worker 0 never opened a shard"
+        os.kill(victim, signal.SIGKILL)
+        assert proc.wait(timeout=600) == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        log.close()
+    assert "Worker 0 exited" in (tmp_path / "run.log").read_text()
+
+    from datasets import load_from_disk
+    final = load_from_disk(str(tmp_path / "final"))
+    assert sorted(final["text"]) == sorted(f"synthetic clip {i}" for i in range(ITEMS))
@@ -1,26 +1,62 @@
 """
 Utils package for SNAC Codec Audio Processing Pipeline
+
+Exports are imported on first access, so processes that only need some modules (readers
+do not need torch or the codec) do not pay for importing all of them.
 """
 
-from .snac_codec import SNACCoder
-from .config_manager import ConfigManager, DatasetConfig, BaseSettings, SaveSettings
-from .dataset_processor import DatasetProcessor
-from .audio_worker import AudioWorker, worker_process
-from .reader_worker import ReaderWorker, reader_worker_process
-from .pipeline_manager import PipelineManager
-from .logging_config import setup_logging
-
-__all__ = [
-    'SNACCoder',
-    'ConfigManager',
-    'DatasetConfig',
-    'BaseSettings',
-    'SaveSettings',
-    'DatasetProcessor',
-    'AudioWorker',
-    'worker_process',
-    'ReaderWorker',
-    'reader_worker_process',
-    'PipelineManager',
-    'setup_logging',
-]
+import importlib
+
+_EXPORTS = {
+    'SNACCoder': 'snac_codec',
+    'SNACDecoder': 'snac_codec',
+    'MicroBatcher': 'encode_service',
+    'ConfigManager': 'config_manager',
+    'DatasetConfig': 'config_manager',
+    'BaseSettings': 'config_manager',
+    'SaveSettings': 'config_manager',
+    'FilterSettings': 'config_manager',
+    'DatasetProcessor': 'dataset_processor',
+    'AudioFilter': 'audio_filters',
+    'AudioDecoder': 'audio_decode',
+    'AudioWorker': 'audio_worker',
+    'worker_process': 'audio_worker',
+    'ReaderWorker': 'reader_worker',
+    'reader_worker_process': 'reader_worker',
+    'ReaderPool': 'scheduler',
+    'ReaderAutoscaler': 'scheduler',
+    'RunScheduler': 'run_scheduler',
+    'PipelineManager': 'pipeline_manager',
+    'SharedWaveTransport': 'shm_transport',
+    'BudgetedQueue': 'sample_queue',
+    'ResumeManifest': 'resume_manifest',
+    'ShardWriter': 'shard_writer',
+    'get_shard_writer': 'shard_writer',
+    'Metrics': 'metrics',
+    'MetricsReporter': 'metrics',
+    'MetricsAggregator': 'metrics',
+    'EncodeCache': 'encode_cache',
+    'TokenStore': 'token_store',
+    'TokenStoreWriter': 'token_store',
+    'load_index': 'length_index',
+    'ShardAssembler': 'assembly',
+    'WorkLedger': 'work_ledger',
+    'DeadLetterLog': 'supervision',
+    'WorkerSupervisor': 'supervision',
+    'setup_logging': 'logging_config',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,195 @@
+"""
+Incremental final assembly.
+
+Every finished shard is converted into an Arrow stream file under `OUT_DIR/_arrow/` by a
+process pool, as soon as the worker that wrote it reports it closed. Final assembly then
+only memory-maps the converted files and concatenates them, instead of parsing every shard
+again after the last dataset is done. A state file remembers the size and modification time
+each shard had when it was converted, so shards that did not change since an earlier run or
+assembly are not converted again.
+"""
+
+import json
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+from datasets import Dataset, concatenate_datasets
+
+from utils.shard_writer import SHARD_EXTENSIONS, ArrowShardWriter, iter_shard_records
+
+ARROW_DIR = "_arrow"
+STATE_FILE = "state.json"
+CONVERT_BATCH_ROWS = 10000
+
+
+def convert_shard(shard_path: str, arrow_path: str, num_layers: int, compact_tokens: bool = False) -> int:
+    """Converts one shard of any format into an Arrow stream file. Returns the number of rows"""
+    tmp = arrow_path + ".tmp"
+    writer = ArrowShardWriter(tmp, num_layers, row_group_size=CONVERT_BATCH_ROWS, compact_tokens=compact_tokens)
+    rows = 0
+    try:
+        for rec in iter_shard_records(shard_path):
+            writer.write(rec)
+            rows += 1
+    finally:
+        writer.close()
+    if rows:
+        os.replace(tmp, arrow_path)
+    return rows
+
+
+def _shard_signature(path: str) -> Dict[str, int]:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class ShardAssembler:
+    """Converts finished shards to Arrow in the background and assembles the final dataset from them"""
+
+    def __init__(self, out_dir: str, num_layers: int, workers: int = 4, compact_tokens: bool = False):
+        """
+        Args:
+            out_dir: Shard directory (OUT_DIR)
+            num_layers: Number of SNAC layers in the records
+            workers: Conversion processes (0 = convert everything during final assembly, in this process)
+            compact_tokens: Store token columns as int16/int32 instead of int64
+        """
+        self.out_dir = out_dir
+        self.arrow_dir = os.path.join(out_dir, ARROW_DIR)
+        self.num_layers = num_layers
+        self.workers = workers
+        self.compact_tokens = compact_tokens
+        self.lock = threading.Lock()
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.pending: Dict[str, Future] = {}
+        self.state: Dict[str, Dict[str, int]] = {}
+        self.converted = 0
+        self.skipped = 0
+
+        os.makedirs(self.arrow_dir, exist_ok=True)
+        state_path = os.path.join(self.arrow_dir, STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def _arrow_path(self, name: str) -> str:
+        return os.path.join(self.arrow_dir, name + ".arrow")
+
+    def _up_to_date(self, name: str) -> bool:
+        """Whether a shard was converted before and has not changed since"""
+        entry = self.state.get(name)
+        if entry is None:
+            return False
+        try:
+            signature = _shard_signature(os.path.join(self.out_dir, name))
+        except FileNotFoundError:
+            return False
+        if entry["size"] != signature["size"] or entry["mtime_ns"] != signature["mtime_ns"]:
+            return False
+        if entry.get("compact_tokens", True) != self.compact_tokens:
+            return False
+        return entry["rows"] == 0 or os.path.exists(self._arrow_path(name))
+
+    def _save_state(self):
+        path = os.path.join(self.arrow_dir, STATE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def _done(self, name: str, signature: Dict[str, int], future: Future):
+        with self.lock:
+            self.pending.pop(name, None)
+            if not future.cancelled() and future.exception() is None:
+                self.state[name] = {**signature, "rows": future.result(), "compact_tokens": self.compact_tokens}
+                self.converted += 1
+                self._save_state()
+
+    def submit(self, shard_path: str):
+        """Converts a finished shard in the background unless it is unchanged since its last conversion"""
+        name = os.path.basename(shard_path)
+        with self.lock:
+            if name in self.pending or self._up_to_date(name):
+                return
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"))
+            signature = _shard_signature(shard_path)
+            future = self.pool.submit(convert_shard, shard_path, self._arrow_path(name), self.num_layers,
+                                      self.compact_tokens)
+            self.pending[name] = future
+        future.add_done_callback(lambda f: self._done(name, signature, f))
+
+    def on_shard(self, source: str, payload: dict):
+        """report_q handler for shards finalized by workers"""
+        if self.workers > 0:
+            self.submit(payload["path"])
+
+    def sync(self) -> List[str]:
+        """
+        Converts every finished shard that is new or changed, waits for all conversions and
+        drops converted files of shards that no longer exist. Returns the shard names in order.
+        """
+        names = sorted(f for f in os.listdir(self.out_dir) if f.endswith(SHARD_EXTENSIONS))
+        for name in names:
+            path = os.path.join(self.out_dir, name)
+            if self.workers > 0:
+                self.submit(path)
+            elif not self._up_to_date(name):
+                signature = _shard_signature(path)
+                rows = convert_shard(path, self._arrow_path(name), self.num_layers, self.compact_tokens)
+                self.state[name] = {**signature, "rows": rows, "compact_tokens": self.compact_tokens}
+                self.converted += 1
+            else:
+                self.skipped += 1
+
+        while True:
+            with self.lock:
+                pending = list(self.pending.items())
+            if not pending:
+                break
+            for name, future in pending:
+                try:
+                    future.result()
+                except Exception as e:
+                    raise RuntimeError(f"❌ Converting shard {name} to Arrow failed: {e}") from e
+
+        if self.workers > 0:
+            self.skipped = len(names) - self.converted
+        with self.lock:
+            for name in set(self.state) - set(names):
+                del self.state[name]
+                if os.path.exists(self._arrow_path(name)):
+                    os.remove(self._arrow_path(name))
+            self._save_state()
+        return names
+
+    def assemble(self) -> Dataset:
+        """Concatenates the converted shards into one memory-mapped dataset"""
+        names = self.sync()
+        parts = [Dataset.from_file(self._arrow_path(name)) for name in names if self.state[name]["rows"]]
+        if not parts:
+            raise RuntimeError("❌ No encoded samples to assemble")
+
+        schemas = [part.data.schema for part in parts]
+        if any(schema != schemas[0] for schema in schemas[1:]):
+            # Datasets with different constant columns: add the missing ones as nulls. The
+            # tables stay memory-mapped; the column changes are replayed when they are loaded
+            unified = pa.unify_schemas([s.remove_metadata() for s in schemas], promote_options="default")
+            aligned = []
+            for part in parts:
+                table = part.data
+                for field in unified:
+                    if field.name not in table.column_names:
+                        table = table.append_column(field, pa.nulls(len(table), field.type))
+                aligned.append(Dataset(table.select(unified.names).cast(unified)))
+            parts = aligned
+        return concatenate_datasets(parts)
+
+    def close(self):
+        """Stops the conversion processes"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
@@ -0,0 +1,234 @@
+"""
+Pre-encode audio filtering and deduplication, run by the readers.
+
+Every prepared item passes `AudioFilter` before it is queued, so clips that are not worth
+encoding never cost encoder time. In order:
+
+1. Trimming: leading and trailing frames (`trim_frame_ms`) quieter than `trim_silence_db`
+   dBFS are cut, keeping `trim_margin_ms` of margin. A clip that is silent throughout is dropped
+   as "silent".
+2. Duration bounds: clips shorter than `min_seconds` or longer than `max_seconds` (after
+   trimming) are dropped as "too_short" / "too_long".
+3. Silence: clips whose RMS level is below `silence_db` dBFS are dropped as "silent".
+4. Clipping: clips with more than `max_clipped_fraction` of their samples at or above
+   `clip_level` are dropped as "clipped".
+5. Deduplication: with `dedup: exact` a clip is dropped as "duplicate" if a clip with the same
+   samples was read before in this run; with `dedup: perceptual` if one with a fingerprint
+   (band-energy gradients over time, unaffected by gain) within `dedup_bit_error_rate` of it
+   was, so copies with low-level noise or mild filtering are caught too. Hashes and
+   fingerprints live in a multiprocessing manager shared by all readers, so duplicates are
+   found across readers and datasets.
+
+All checks are vectorized numpy over the waveform at the codec sample rate. Dropped rows are
+reported to the manager as "filtered" messages: they count per reason in the run report and
+as done when the manager reconciles datasets after worker crashes.
+"""
+
+import hashlib
+import threading
+from multiprocessing.managers import SyncManager
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from utils.config_manager import FilterSettings
+from utils.resume_manifest import Range, encode_rows
+
+FILTER_REASONS = ("too_short", "too_long", "silent", "clipped", "duplicate")
+DEDUP_MODES = ("off", "exact", "perceptual")
+
+# Perceptual fingerprint: time segments × frequency bands of the band-energy gradient grid
+FINGERPRINT_SEGMENTS = 16
+FINGERPRINT_BANDS = 9
+FINGERPRINT_MIN_HZ = 100.0
+FINGERPRINT_MAX_HZ = 4000.0
+# Clip durations are part of the fingerprint, rounded to this many seconds
+FINGERPRINT_SECONDS = 0.1
+FINGERPRINT_BITS = (FINGERPRINT_SEGMENTS - 1) * (FINGERPRINT_BANDS - 1)
+# Near-duplicate lookups bucket fingerprints on each of this many equal bit slices
+FINGERPRINT_SLICES = 12
+
+
+def level_db(wave: np.ndarray, axis: Optional[int] = None) -> np.ndarray:
+    """RMS level in dBFS (of the whole waveform, or along an axis)"""
+    power = np.mean(np.square(wave, dtype=np.float64), axis=axis)
+    return 10.0 * np.log10(np.maximum(power, 1e-20))
+
+
+def trim_bounds(wave: np.ndarray, sample_rate: int, threshold_db: float,
+                frame_ms: float = 10.0, margin_ms: float = 100.0) -> Optional[tuple]:
+    """[start, end) of a waveform without its leading and trailing silence, None if all of it is silent"""
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    num_frames = -(-wave.shape[0] // frame)
+    frames = np.zeros(num_frames * frame, dtype=np.float32)
+    frames[:wave.shape[0]] = wave
+    loud = np.flatnonzero(level_db(frames.reshape(num_frames, frame), axis=1) > threshold_db)
+    if loud.size == 0:
+        return None
+    margin = int(sample_rate * margin_ms / 1000)
+    return max(0, loud[0] * frame - margin), min(wave.shape[0], (loud[-1] + 1) * frame + margin)
+
+
+def fingerprint(wave: np.ndarray, sample_rate: int) -> bytes:
+    """
+    Perceptual fingerprint of a clip: the signs of band-energy differences across neighbouring
+    bands and segments (as in Haitsma & Kalker's audio fingerprints), plus the rounded duration
+    """
+    seconds = round(wave.shape[0] / sample_rate / FINGERPRINT_SECONDS)
+    segment = wave.shape[0] // FINGERPRINT_SEGMENTS
+    if segment < 64:
+        return b"s" + hashlib.blake2b(np.ascontiguousarray(wave).tobytes(), digest_size=16).digest()
+    spectra = np.abs(np.fft.rfft(wave[:segment * FINGERPRINT_SEGMENTS].reshape(FINGERPRINT_SEGMENTS, segment),
+                                 axis=1)) ** 2
+    top = min(FINGERPRINT_MAX_HZ, sample_rate / 2)
+    edges = np.geomspace(FINGERPRINT_MIN_HZ, top, FINGERPRINT_BANDS + 1) * segment / sample_rate
+    edges = np.minimum(edges.astype(np.int64), spectra.shape[1] - 1)
+    energy = np.add.reduceat(spectra, edges[:-1], axis=1)
+    gradient = np.diff(np.diff(energy, axis=1), axis=0) > 0
+    return b"p" + seconds.to_bytes(4, "little") + np.packbits(gradient).tobytes()
+
+
+def _fingerprint_bits(key: bytes) -> Tuple[int, np.ndarray]:
+    """Rounded duration and packed gradient bits of a perceptual fingerprint"""
+    return int.from_bytes(key[1:5], "little"), np.frombuffer(key, dtype=np.uint8, offset=5)
+
+
+class FingerprintIndex:
+    """
+    Perceptual fingerprints of the clips read so far, for near-duplicate lookups.
+
+    Every fingerprint is filed under each of its FINGERPRINT_SLICES bit slices (locality-
+    sensitive hashing): a clip within the bit error threshold of an earlier one almost always
+    shares a slice with it, so only the fingerprints in the buckets of its slices, at the same
+    or a neighbouring duration, are compared bit by bit. Served by the dedup manager process,
+    so a claim is one atomic call from a reader.
+    """
+
+    def __init__(self, max_bit_error_rate: float):
+        self.max_errors = int(max_bit_error_rate * FINGERPRINT_BITS)
+        self.lock = threading.Lock()
+        self.exact: Dict[bytes, str] = {}
+        self.fingerprints: List[Tuple[np.ndarray, str]] = []
+        self.buckets: Dict[Tuple[int, int, int], List[int]] = {}
+
+    @staticmethod
+    def _slices(packed: np.ndarray) -> List[int]:
+        bits = np.unpackbits(packed)[:FINGERPRINT_BITS].reshape(FINGERPRINT_SLICES, -1)
+        return [int(v) for v in bits.dot(1 << np.arange(bits.shape[1], dtype=np.int64))]
+
+    def claim(self, key: bytes, owner: str) -> str:
+        """Files a clip under owner ("prefix:row"). Returns the owner of the first clip it duplicates, or owner itself"""
+        if not key.startswith(b"p"):
+            # Clips too short to fingerprint are hashed and only match exactly
+            with self.lock:
+                return self.exact.setdefault(key, owner)
+        seconds, packed = _fingerprint_bits(key)
+        slices = self._slices(packed)
+        with self.lock:
+            checked = set()
+            for duration in (seconds - 1, seconds, seconds + 1):
+                for i, value in enumerate(slices):
+                    for idx in self.buckets.get((duration, i, value), ()):
+                        if idx in checked:
+                            continue
+                        checked.add(idx)
+                        other, other_owner = self.fingerprints[idx]
+                        if int(np.unpackbits(other ^ packed).sum()) <= self.max_errors:
+                            return other_owner
+            idx = len(self.fingerprints)
+            self.fingerprints.append((packed.copy(), owner))
+            for i, value in enumerate(slices):
+                self.buckets.setdefault((seconds, i, value), []).append(idx)
+        return owner
+
+
+class DedupManager(SyncManager):
+    """Manager process holding the dedup state all readers share"""
+
+
+DedupManager.register("FingerprintIndex", FingerprintIndex, exposed=("claim",))
+
+
+class AudioFilter:
+    """Decides for each prepared item whether it is encoded, trimming its silence on the way"""
+
+    def __init__(self, settings: FilterSettings, sample_rate: int, seen=None):
+        """
+        Args:
+            settings: Filter settings (filter_settings in config.yaml)
+            sample_rate: Sample rate of the prepared waveforms
+            seen: Store shared by all readers, required for dedup: a DedupManager dict mapping
+                clip hashes to the first "prefix:row" that had them (exact), or a
+                FingerprintIndex proxy (perceptual)
+        """
+        if settings.dedup not in DEDUP_MODES:
+            raise ValueError(f"❌ Unknown dedup mode {settings.dedup!r}, expected one of {', '.join(DEDUP_MODES)}")
+        if settings.dedup != "off" and seen is None:
+            raise ValueError("❌ dedup needs a shared hash store")
+        self.settings = settings
+        self.sample_rate = sample_rate
+        self.seen = seen
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any filter is on"""
+        s = self.settings
+        return bool(s.min_seconds or s.max_seconds or s.silence_db is not None or s.trim_silence_db is not None
+                    or s.max_clipped_fraction or s.dedup != "off")
+
+    def trim(self, wave: np.ndarray) -> Optional[np.ndarray]:
+        """A waveform without leading and trailing silence (unchanged if trimming is off, None if all silent)"""
+        if self.settings.trim_silence_db is None:
+            return wave
+        bounds = trim_bounds(wave, self.sample_rate, self.settings.trim_silence_db,
+                             self.settings.trim_frame_ms, self.settings.trim_margin_ms)
+        return None if bounds is None else wave[bounds[0]:bounds[1]]
+
+    def __call__(self, item: Dict[str, Any], prefix: str, row: Optional[int]) -> Optional[str]:
+        """Checks an item, trimming item["wave"] in place. Returns the reason to drop it, or None to keep it"""
+        s = self.settings
+        wave = self.trim(np.asarray(item["wave"]).reshape(-1))
+        if wave is None:
+            return "silent"
+        item["wave"] = wave
+        seconds = wave.shape[0] / self.sample_rate
+        if s.min_seconds and seconds < s.min_seconds:
+            return "too_short"
+        if s.max_seconds and seconds > s.max_seconds:
+            return "too_long"
+        if s.silence_db is not None and level_db(wave) < s.silence_db:
+            return "silent"
+        if s.max_clipped_fraction and np.count_nonzero(np.abs(wave) >= s.clip_level) > s.max_clipped_fraction * wave.shape[0]:
+            return "clipped"
+        if s.dedup != "off":
+            owner = f"{prefix}:{row}"
+            # Both lookups run atomically in the manager, so of two readers racing on the same
+            # clip exactly one keeps it; a row read again after a crash finds itself and stays
+            if s.dedup == "exact":
+                key = b"e" + hashlib.blake2b(np.ascontiguousarray(wave).tobytes(), digest_size=16).digest()
+                first = self.seen.setdefault(key, owner)
+            else:
+                first = self.seen.claim(fingerprint(wave.astype(np.float32, copy=False), self.sample_rate), owner)
+            if first != owner:
+                return "duplicate"
+        return None
+
+
+class FilterLog:
+    """Remembers the filtered rows of every dataset (manager side)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows: Dict[str, Set[int]] = {}
+
+    def on_filtered(self, source: str, payload: Dict[str, Any]):
+        """report_q handler for "filtered" messages"""
+        with self.lock:
+            if payload.get("row") is not None:
+                self.rows.setdefault(payload["prefix"], set()).add(int(payload["row"]))
+
+    def filtered_ranges(self, prefix: str) -> List[Range]:
+        """The filtered rows of a dataset as merged [start, end) ranges"""
+        with self.lock:
+            rows = sorted(self.rows.get(prefix, ()))
+        return [tuple(r) for r in encode_rows(rows)]
@@ -1,81 +1,283 @@
 import torch
 import multiprocessing as mp
 import os
-import gzip
-import io
+import queue
+import threading
 import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
 from tqdm.auto import tqdm
-from utils.snac_codec import SNACCoder
+from utils.snac_codec import MODEL_CACHE_DIR, SNACCoder, resolve_device
+from utils.shm_transport import RingReader, unpack_item, release_item
+from utils.sample_queue import BudgetedQueue
+from utils.resume_manifest import ResumeManifest, TMP_SUFFIX, fsync_path
+from utils.shard_writer import get_shard_writer
+from utils.length_index import ShardIndexBuilder
+from utils.config_manager import BaseSettings
+from utils.metrics import Metrics, MetricsReporter
+from utils.encode_cache import EncodeCache
 from utils.logging_config import setup_logging
+from utils.supervision import is_oom
 
-try:
-    import orjson
-    USE_ORJSON = True
-except Exception:
-    import json
-    USE_ORJSON = False
+# Chunk lengths (each half the last) tried on an item that runs out of memory on its own
+OOM_HALVINGS = 4
+MIN_CHUNK_SECONDS = 1.0
+
+
+class StorageError(RuntimeError):
+    """A shard could not be written to disk; the worker stops and its rows are read again"""
+
+
+class DatasetEnd(NamedTuple):
+    """
+    Control message: no more items of this dataset will be queued (in this round; a dataset
+    can be read in several rounds). One is sent to each worker's own control lane, addressed
+    to its rank
+    """
+    prefix: str
+    round: int = 0
+    rank: int = 0
+
+
+class DatasetShards:
+    """Rotating shard files of one dataset written by one worker"""
+
+    def __init__(self, worker: "AudioWorker", prefix: str, file_idx: int):
+        self.worker = worker
+        self.prefix = prefix
+        self.file_idx = file_idx
+        self.lines_in_file = 0
+        self.files_written = 0
+        self.path = None
+        self.writer = None
+        self.shard_rows: List[int] = []
+        self.index: Optional[ShardIndexBuilder] = None
+
+    def open(self):
+        """Opens a new file for writing (under a temporary name until it is finalized)"""
+        w = self.worker
+        self.path = os.path.join(
+            w.out_dir,
+            f"{self.prefix}-{w.shard_tag}-{self.file_idx:05d}{w.writer_cls.extension}"
+        )
+        self.shard_rows = []
+        self.lines_in_file = 0
+        self.index = ShardIndexBuilder(w.num_layers) if w.length_index else None
+        self.writer = w.writer_cls(
+            self.path + TMP_SUFFIX,
+            w.num_layers,
+            gzip_level=w.gzip_level,
+            buffer_size=w.buffer_size,
+            row_group_size=w.row_group_size or w.lines_per_file,
+            compress_threads=w.compress_threads,
+            compact_tokens=w.compact_tokens,
+            metrics=w.metrics,
+        )
+
+    def finalize(self):
+        """
+        Closes the current file, records its rows and atomically moves it into place. A file
+        that fails to close keeps its temporary name and is not recorded
+        """
+        with self.worker.metrics.time("finalize"):
+            if self.writer is not None:
+                writer, self.writer = self.writer, None
+                try:
+                    writer.close()
+                except Exception as e:
+                    # Left under its temporary name, so it is never taken for a finished shard
+                    path, self.path = self.path, None
+                    raise StorageError(f"❌ Closing shard {os.path.basename(path)} failed: {e}") from e
+            if self.path is None:
+                return
+            tmp = self.path + TMP_SUFFIX
+            if self.lines_in_file == 0:
+                os.remove(tmp)
+                self.path = None
+                return
+            # The manifest says the rows are on disk, so the shard must be before it is written
+            fsync_path(tmp)
+            if self.index is not None:
+                self.index.write(self.path, self.shard_rows)
+            self.worker.manifest.write(self.path, self.shard_rows)
+            os.replace(tmp, self.path)
+            self.worker.reporter.send("shard", {"path": self.path, "rows": self.lines_in_file})
+            self.path = None
+        self.files_written += 1
+        self.file_idx += 1
+
+    def write(self, rec, row: int):
+        """Writes a record and rotates the output file when it is full"""
+        if self.writer is None:
+            self.open()
+        self.writer.write(rec)
+        if self.index is not None:
+            self.index.add(rec)
+        self.shard_rows.append(row)
+        self.lines_in_file += 1
+
+        if self.lines_in_file >= self.worker.lines_per_file:
+            self.finalize()
+
+
+class WriterThread(threading.Thread):
+    """
+    Runs storage steps (serialization, compression, rotation) off the encode thread
+
+    Steps are handed over through a bounded queue and run in order. The encode thread
+    only blocks when the queue is full, i.e. when storage is slower than encoding. After
+    a step fails, the remaining steps are dropped and submit raises StorageError.
+    """
+
+    def __init__(self, queue_size: int, metrics: Optional[Metrics] = None):
+        super().__init__(daemon=True)
+        self.q = queue.Queue(maxsize=queue_size)
+        self.metrics = metrics
+        self.busy_s = 0.0
+        self.blocked_s = 0.0
+        self.error: Optional[Exception] = None
+
+    def submit(self, fn, *args):
+        """Queues a storage step (called from the encode thread)"""
+        if self.error is not None:
+            raise StorageError(f"❌ Writing shards failed: {self.error}") from self.error
+        start = time.perf_counter()
+        self.q.put((fn, args))
+        blocked = time.perf_counter() - start
+        self.blocked_s += blocked
+        if self.metrics is not None:
+            self.metrics.observe("writer_blocked", blocked)
+
+    def stop(self):
+        """Runs the remaining steps (unless one failed) and waits for the thread to exit"""
+        self.q.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            step = self.q.get()
+            if step is None:
+                break
+            if self.error is not None:
+                # Later steps would write into shards an earlier step left broken
+                continue
+            fn, args = step
+            start = time.perf_counter()
+            try:
+                fn(*args)
+            except Exception as e:
+                self.error = e
+            self.busy_s += time.perf_counter() - start
 
 
 class AudioWorker:
-    """Manages GPU worker processes for audio encoding"""
+    """Manages GPU and CPU worker processes for audio encoding"""
 
     SENTINEL = None
 
-    def __init__(self, rank: int, in_q: mp.Queue, out_dir: str, dataset_prefix: str,
-                 gzip_level: int, buffer_size: int, lines_per_file: int, num_readers: int,
-                 model_id: str, num_layers: int):
+    def __init__(self, rank: int, in_q: BudgetedQueue, settings: BaseSettings, num_layers: int,
+                 device: str = "cuda:0", ring_reader: Optional[RingReader] = None,
+                 report_q: Optional[mp.Queue] = None, generation: int = 0):
         self.rank = rank
         self.in_q = in_q
-        self.out_dir = out_dir
-        self.dataset_prefix = dataset_prefix
-        self.gzip_level = gzip_level
-        self.buffer_size = buffer_size
-        self.lines_per_file = lines_per_file
-        self.num_readers = num_readers
-        self.model_id = model_id
+        source = f"worker-{rank}" if generation == 0 else f"worker-{rank}.{generation}"
+        self.reporter = MetricsReporter(report_q, source, settings.metrics_interval)
+        self.metrics = self.reporter.metrics
+        self.device = resolve_device(device)
+        self.label = f"{self.device.type.replace('cuda', 'gpu').upper()}-{self.device.index or 0}"
+        if self.device.type == "cpu":
+            self.num_threads = settings.cpu_threads_per_worker
+        else:
+            self.num_threads = settings.gpu_threads_per_worker
+        self.out_dir = settings.OUT_DIR
+        self.gzip_level = settings.gzip_level
+        self.buffer_size = settings.buffer_size
+        self.lines_per_file = settings.lines_per_file
+        self.num_readers = max(settings.num_readers, settings.max_readers)
+        self.model_id = settings.audio_codec
+        self.model_cache_dir = settings.model_cache_dir or os.path.join(settings.OUT_DIR, MODEL_CACHE_DIR)
         self.num_layers = num_layers
+        self.max_batch_size = settings.max_batch_size
+        self.max_padded_samples = settings.max_padded_samples
+        self.max_wait_ms = settings.max_wait_ms
+        self.chunk_seconds = settings.chunk_seconds
+        self.chunk_overlap_seconds = settings.chunk_overlap_seconds
+        self.precision = settings.precision
+        self.compile_model = settings.compile_model
+        self.compile_mode = settings.compile_mode
+        self.cudnn_benchmark = settings.cudnn_benchmark
+        self.tf32 = settings.tf32
+        self.check_items = settings.precision_check_items
+        self.ring_reader = ring_reader
+        self.resume = settings.resume
+        # A restarted worker continues the shard numbering of the worker it replaces
+        self.restarted = generation > 0
+        self.item_retries = settings.item_retries
+        # Nodes of a multi-node run write into the same OUT_DIR, so their shard names carry the node rank
+        self.distributed = settings.num_nodes > 1
+        self.shard_tag = f"worker{rank:02d}"
+        if self.distributed:
+            self.shard_tag = f"node{settings.node_rank:02d}-{self.shard_tag}"
+        self.manifest = ResumeManifest(self.out_dir)
+        self.writer_cls = get_shard_writer(settings.shard_format)
+        self.row_group_size = settings.row_group_size
+        self.compress_threads = settings.compress_threads
+        self.compact_tokens = settings.compact_tokens
+        self.length_index = settings.length_index
+        self.writer_queue_size = settings.writer_queue_size
+        self.writer_thread: Optional[WriterThread] = None
+        self.store_s = 0.0
+        self.encode_cache_path = settings.encode_cache_path
+        self.encode_cache_bytes = settings.encode_cache_bytes
+        self.cache: Optional[EncodeCache] = None
+        self.shards: Dict[str, DatasetShards] = {}
+        self.next_file_idx: Dict[str, int] = {}
+        self.ended: Set[Tuple[str, int]] = set()
+        self.in_dataset = False
 
-    def _open_rotated_file(self, idx: int):
-        """Opens a new file for writing"""
-        path = os.path.join(
-            self.out_dir,
-            f"{self.dataset_prefix}-worker{self.rank:02d}-{idx:05d}.jsonl.gz"
-        )
-        raw = open(path, "wb", buffering=0)
-        buf = io.BufferedWriter(raw, buffer_size=self.buffer_size)
-        gz = gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=self.gzip_level, mtime=0)
-        txt = io.TextIOWrapper(gz, encoding="utf-8", newline="\n")
-        return path, raw, buf, gz, txt
-
-    def _close_file(self, raw, buf, gz, txt):
-        """Safely closes file"""
-        for f, name in [(txt, "txt"), (gz, "gz"), (buf, "buf"), (raw, "raw")]:
-            try:
-                if f:
-                    if hasattr(f, 'flush'):
-                        f.flush()
-                    if hasattr(f, 'detach') and name == "txt":
-                        f.detach()
-                    elif hasattr(f, 'close'):
-                        f.close()
-            except Exception:
-                pass
-
-    def _dump_line(self, obj, gz, txt):
-        """Writes line to file"""
-        if USE_ORJSON:
-            b = orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
-            gz.write(b)
-            gz.write(b"\n")
-        else:
-            for i in range(1, self.num_layers + 1):
-                k = f"snac_layer_{i}"
-                if k in obj and hasattr(obj[k], "tolist"):
-                    obj[k] = obj[k].tolist()
-            if "token_lengths" in obj and hasattr(obj["token_lengths"], "tolist"):
-                obj["token_lengths"] = obj["token_lengths"].tolist()
-            txt.write(json.dumps(obj, ensure_ascii=False))
-            txt.write("\n")
+    def _shards_for(self, prefix: str) -> DatasetShards:
+        """Returns the open shards of a dataset, continuing the file numbering if it was closed before"""
+        shards = self.shards.get(prefix)
+        if shards is None:
+            file_idx = self.next_file_idx.get(prefix)
+            if file_idx is None:
+                # A restarted node continues its numbering, as its earlier shards count as done
+                resume = self.resume or self.distributed or self.restarted
+                file_idx = self.manifest.next_file_index(prefix, self.shard_tag) if resume else 0
+            shards = self.shards[prefix] = DatasetShards(self, prefix, file_idx)
+        return shards
+
+    def _submit(self, fn, *args):
+        """Runs a storage step on the writer thread, or inline if there is none"""
+        if self.writer_thread is not None:
+            self.writer_thread.submit(fn, *args)
+            return
+        start = time.perf_counter()
+        fn(*args)
+        self.store_s += time.perf_counter() - start
+
+    def _take_dataset_end(self, end: DatasetEnd) -> bool:
+        """Whether this worker should handle a DatasetEnd; a second copy of a round it already handled is dropped"""
+        if (end.prefix, end.round) in self.ended:
+            return False
+        self.ended.add((end.prefix, end.round))
+        return True
+
+    def _close_dataset(self, end: DatasetEnd):
+        """Finalizes the shards of a dataset once all of its items have been queued"""
+        self._submit(self._end_dataset, end)
+
+    def _end_dataset(self, end: DatasetEnd):
+        """Finalizes a dataset's shards and tells the manager its rows are stored"""
+        self._finalize_dataset(end.prefix)
+        self.reporter.send("dataset_end", {"prefix": end.prefix, "round": end.round, "rank": self.rank})
+
+    def _finalize_dataset(self, prefix: str):
+        """Closes the current shard of a dataset and remembers where its numbering continues"""
+        shards = self.shards.pop(prefix, None)
+        if shards is not None:
+            shards.finalize()
+            self.next_file_idx[prefix] = shards.file_idx
+            self.files_written += shards.files_written
 
     @staticmethod
     def _flatten(x):
@@ -88,93 +290,415 @@ class AudioWorker:
         except Exception:
             return x
 
-    def run(self):
-        """Worker process for audio processing"""
-        setup_logging()
-        tqdm.set_lock(mp.RLock())
+    def _build_record(self, item, codes):
+        """Builds the output record for an encoded item"""
+        rec = {"text": item["text"]}
 
-        gpu_emoji = ["🟢", "🔵", "🟣", "🟡", "🔴", "⚫", "⚪", "🟠"][self.rank % 8]
+        for i in range(1, self.num_layers + 1):
+            layer_key = f"snac_layer_{i}"
+            rec[layer_key] = self._flatten(codes[layer_key])
 
-        pbar = tqdm(
-            desc=f"{gpu_emoji} GPU-{self.rank}",
-            position=self.num_readers + self.rank + 1,
-            leave=True,
-            unit="items",
-            bar_format='{desc}: {n_fmt} | {rate_fmt} | File {postfix}',
-            dynamic_ncols=True,
-            mininterval=0.5
-        )
+        rec["num_layers"] = codes["num_layers"]
+        rec["token_lengths"] = codes["token_lengths"]
+
+        if "speaker" in item:
+            rec["speaker"] = item["speaker"]
+
+        for key in item:
+            if key not in ["text", "wave", "speaker"] and not key.startswith("_"):
+                rec[key] = item[key]
+
+        return rec
+
+    def _write_record(self, rec, item):
+        """Hands a record over to be written into its dataset's current shard"""
+        self._submit(self._store_record, rec, item["_prefix"], item["_row"])
+        self.n += 1
+        self.metrics.inc("items")
+        self.metrics.inc("audio_seconds", item["wave"].shape[-1] / self.sample_rate)
+        self.pbar.update(1)
+
+    def _store_record(self, rec, prefix: str, row: int):
+        """Writes a record into its dataset's current shard"""
+        try:
+            shards = self._shards_for(prefix)
+            shards.write(rec, row)
+            self.pbar.set_postfix_str(f"{shards.prefix} {shards.file_idx:05d}", refresh=False)
+        except StorageError:
+            raise
+        except Exception as e:
+            self.reporter.dead_letter(e, "write", prefix, row)
+            self.pbar.set_description(f"{self.gpu_emoji} {self.label} ERROR: {str(e)[:30]}")
+
+    def _show_error(self, e: Exception, item: Optional[dict] = None, **context):
+        """Shows an error on the progress bar (until the next one) and reports it to the manager"""
+        if item is not None:
+            context.update(prefix=item.get("_prefix"), row=item.get("_row"))
+        self.reporter.error(e, **context)
+        self.pbar.set_description(f"{self.gpu_emoji} {self.label} ERROR: {str(e)[:30]}")
+
+    def _dead_letter(self, e: Exception, item: dict, stage: str, attempts: int = 1):
+        """
+        Gives up on an item: it goes to the dead-letter log instead of a shard. A storage
+        failure is not the item's fault and is raised instead, stopping the worker
+        """
+        if isinstance(e, StorageError):
+            raise e
+        self.reporter.dead_letter(e, stage, item.get("_prefix"), item.get("_row"), attempts)
+        self.pbar.set_description(f"{self.gpu_emoji} {self.label} ERROR: {str(e)[:30]}")
+
+    def _cached_codes(self, item: dict) -> Optional[dict]:
+        """Returns an item's codes from the encode cache, remembering its key for a later put on a miss"""
+        if self.cache is None:
+            return None
+        try:
+            with self.metrics.time("cache_get"):
+                key = item["_cache_key"] = self.cache.key(item["wave"])
+                hit = self.cache.get(key)
+        except Exception as e:
+            self._disable_cache(e, item)
+            return None
+        if hit is None:
+            self.metrics.inc("cache_misses")
+            return None
+        codes, encode_s = hit
+        self.metrics.inc("cache_hits")
+        self.metrics.inc("cache_saved_s", encode_s)
+        return codes
 
-        torch.set_num_threads(1)
+    def _cache_codes(self, item: dict, codes: dict, encode_s: float):
+        """Stores freshly encoded codes in the encode cache"""
+        key = item.pop("_cache_key", None)
+        if self.cache is not None and key is not None:
+            try:
+                with self.metrics.time("cache_put"):
+                    self.cache.put(key, codes, encode_s)
+            except Exception as e:
+                self._disable_cache(e, item)
 
+    def _disable_cache(self, e: Exception, item: Optional[dict] = None):
+        """Reports a cache failure and encodes without the cache for the rest of the run"""
+        cache, self.cache = self.cache, None
+        self._show_error(e, item, stage="cache")
         try:
-            pbar.set_description(f"{gpu_emoji} GPU-{self.rank} Loading...")
-            model = SNACCoder(self.rank, model_id=self.model_id)
-            pbar.set_description(f"{gpu_emoji} GPU-{self.rank} Ready")
+            cache.conn.close()
+        except Exception:
+            pass
 
-            file_idx = 0
-            lines_in_file = 0
-            path, raw, buf, gz, txt = self._open_rotated_file(file_idx)
-            pbar.set_postfix_str(f"{file_idx:05d}")
+    def _encode_items(self, model: SNACCoder, items: List[dict]):
+        """Encodes a batch of items and writes their records, falling back to one-by-one on failure"""
+        try:
+            self._encode_batch(model, items)
+        finally:
+            for item in items:
+                release_item(item, self.ring_reader)
+
+    def _encode_batch(self, model: SNACCoder, items: List[dict], attempt: int = 1):
+        """
+        Encodes and writes a batch of items. A batch that fails is encoded again in halves
+        if it ran out of memory, one by one otherwise; a single item is retried up to
+        item_retries times (in ever smaller chunks after running out of memory) and is then
+        dead-lettered
+        """
+        try:
+            start = time.perf_counter()
+            batch_codes = model.encode_batch([item["wave"] for item in items])
+            encode_s = (time.perf_counter() - start) / len(items)
+        except Exception as e:
+            oom = is_oom(e)
+            if oom:
+                self.metrics.inc("oom_errors")
+                self._free_memory()
+            if len(items) > 1:
+                if oom:
+                    half = len(items) // 2
+                    self._encode_batch(model, items[:half])
+                    self._encode_batch(model, items[half:])
+                else:
+                    for item in items:
+                        self._encode_batch(model, [item])
+                return
+            if oom:
+                self._encode_smaller(model, items[0], e)
+            elif attempt <= self.item_retries:
+                self.metrics.inc("item_retries")
+                self._encode_batch(model, items, attempt + 1)
+            else:
+                self._dead_letter(e, items[0], "encode", attempt)
+            return
 
-            n = 0
+        self.metrics.inc("batches")
+        if self.check_items > 0:
+            self._check_agreement(model, items[:self.check_items], batch_codes)
+        for item, codes in zip(items, batch_codes):
+            try:
+                self._cache_codes(item, codes, encode_s)
+                self._write_record(self._build_record(item, codes), item)
+            except Exception as e:
+                self._dead_letter(e, item, "record")
 
-            while True:
-                item = self.in_q.get()
-                if item is self.SENTINEL:
-                    break
+    def _free_memory(self):
+        """Returns cached blocks to the device after running out of memory"""
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
 
+    def _encode_smaller(self, model: SNACCoder, item: dict, error: Exception):
+        """
+        Encodes an item that ran out of memory on its own in chunks, halving the chunk length
+        while it still does not fit, before dead-lettering it
+        """
+        seconds = item["wave"].shape[-1] / self.sample_rate
+        chunk_seconds = min(self.chunk_seconds or seconds, seconds) / 2
+        attempts = 1
+        codes = None
+        try:
+            while codes is None and attempts <= OOM_HALVINGS and chunk_seconds >= MIN_CHUNK_SECONDS:
+                attempts += 1
+                self.metrics.inc("item_retries")
+                model.set_chunking(chunk_seconds, min(self.chunk_overlap_seconds, chunk_seconds),
+                                   self.max_padded_samples)
                 try:
                     codes = model(item["wave"])
+                except Exception as e:
+                    error = e
+                    if not is_oom(e):
+                        break
+                    self._free_memory()
+                    chunk_seconds /= 2
+        finally:
+            model.set_chunking(self.chunk_seconds, self.chunk_overlap_seconds, self.max_padded_samples)
+        if codes is None:
+            self._dead_letter(error, item, "encode", attempts)
+            return
+        # Codes of a shorter chunking differ from the ones the cache namespace stands for
+        item.pop("_cache_key", None)
+        try:
+            self._write_record(self._build_record(item, codes), item)
+        except Exception as e:
+            self._dead_letter(e, item, "record")
 
-                    rec = {"text": item["text"]}
-                    
-                    for i in range(1, self.num_layers + 1):
-                        layer_key = f"snac_layer_{i}"
-                        rec[layer_key] = self._flatten(codes[layer_key])
-                    
-                    rec["num_layers"] = codes["num_layers"]
-                    rec["token_lengths"] = codes["token_lengths"]
+    def _check_agreement(self, model: SNACCoder, items: List[dict], batch_codes: List[dict]):
+        """Counts the tokens of the first precision_check_items items that differ from float32 eager codes"""
+        self.check_items -= len(items)
+        try:
+            with self.metrics.time("precision_check"):
+                counts = model.token_agreement([item["wave"] for item in items], batch_codes[:len(items)])
+        except Exception as e:
+            self.check_items = 0
+            self._show_error(e, items[0], stage="precision_check")
+            return
+        for layer, (mismatched, total) in enumerate(counts, start=1):
+            self.metrics.inc(f"check_mismatch_layer_{layer}", mismatched)
+            self.metrics.inc(f"check_tokens_layer_{layer}", total)
 
-                    if "speaker" in item:
-                        rec["speaker"] = item["speaker"]
+    def _next_item(self, timeout: Optional[float]):
+        """
+        Takes the next queue message, or False on timeout. Waiting for samples is timed as
+        queue_wait; waits that end in a DatasetEnd or the sentinel, and timeouts between
+        datasets, are idle_wait, so the end of a dataset or run does not look like starvation
+        """
+        start = time.perf_counter()
+        try:
+            item = self.in_q.get(timeout=timeout, consumer=self.rank)
+        except queue.Empty:
+            item = False
+        if isinstance(item, dict):
+            self.in_dataset = True
+        elif item is not False:
+            self.in_dataset = False
+        self.metrics.observe("queue_wait" if self.in_dataset else "idle_wait", time.perf_counter() - start)
+        return item
 
-                    for key in item:
-                        if key not in ["text", "wave", "speaker"]:
-                            rec[key] = item[key]
+    def _run_single(self, model: SNACCoder):
+        """Encodes items one at a time as they arrive"""
+        while True:
+            self._report_metrics()
+            item = self._next_item(self.reporter.interval or None)
+            if item is False:
+                continue
+            if item is self.SENTINEL:
+                break
+            if isinstance(item, DatasetEnd):
+                if self._take_dataset_end(item):
+                    self._close_dataset(item)
+                continue
 
-                    self._dump_line(rec, gz, txt)
-                    n += 1
-                    lines_in_file += 1
+            unpack_item(item, self.ring_reader)
+            codes = self._cached_codes(item)
+            if codes is None:
+                # encode_batch gives the same codes as encoding the item on its own
+                self._encode_items(model, [item])
+                continue
+            try:
+                self._write_record(self._build_record(item, codes), item)
+            except Exception as e:
+                self._dead_letter(e, item, "record")
+            finally:
+                release_item(item, self.ring_reader)
 
-                    pbar.update(1)
+    def _run_batched(self, model: SNACCoder):
+        """
+        Gathers items into buckets of equal padded length and encodes a bucket once it
+        reaches max_batch_size, would exceed max_padded_samples, or has waited max_wait_ms.
+        """
+        buckets: Dict[int, List[dict]] = {}
+        deadlines: Dict[int, float] = {}
+        max_wait = self.max_wait_ms / 1000.0
 
-                    if lines_in_file >= self.lines_per_file:
-                        self._close_file(raw, buf, gz, txt)
-                        file_idx += 1
-                        path, raw, buf, gz, txt = self._open_rotated_file(file_idx)
-                        lines_in_file = 0
-                        pbar.set_postfix_str(f"{file_idx:05d}")
+        def flush(key):
+            deadlines.pop(key, None)
+            self._encode_items(model, buckets.pop(key))
 
-                except Exception as e:
-                    pbar.set_description(f"{gpu_emoji} GPU-{self.rank} ERROR: {str(e)[:30]}")
-                    time.sleep(1)
-                    pbar.set_description(f"{gpu_emoji} GPU-{self.rank}")
+        while True:
+            self._report_metrics()
+            timeout = None
+            if deadlines:
+                timeout = max(0.0, min(deadlines.values()) - time.monotonic())
+
+            item = self._next_item(timeout)
+
+            if item is self.SENTINEL:
+                break
+
+            if isinstance(item, DatasetEnd):
+                if self._take_dataset_end(item):
+                    for key in list(buckets):
+                        flush(key)
+                    self._close_dataset(item)
+                continue
+
+            if item is not False:
+                unpack_item(item, self.ring_reader)
+                codes = self._cached_codes(item)
+                if codes is not None:
+                    try:
+                        self._write_record(self._build_record(item, codes), item)
+                    except Exception as e:
+                        self._dead_letter(e, item, "record")
+                    finally:
+                        release_item(item, self.ring_reader)
                     continue
+                if model.needs_chunking(item["wave"].shape[-1]):
+                    self._encode_items(model, [item])
+                    continue
+                key = model.padded_length(item["wave"].shape[-1])
+                bucket = buckets.setdefault(key, [])
+                if not bucket:
+                    deadlines[key] = time.monotonic() + max_wait
+                bucket.append(item)
+
+                if (len(bucket) >= self.max_batch_size
+                        or key * (len(bucket) + 1) > self.max_padded_samples):
+                    flush(key)
+
+            now = time.monotonic()
+            for key in [k for k, deadline in deadlines.items() if deadline <= now]:
+                flush(key)
+
+        for key in list(buckets):
+            flush(key)
+
+    def run(self):
+        """Worker process for audio processing"""
+        setup_logging()
+        tqdm.set_lock(mp.RLock())
+
+        self.gpu_emoji = ["🟢", "🔵", "🟣", "🟡", "🔴", "⚫", "⚪", "🟠"][self.rank % 8]
+        gpu_emoji = self.gpu_emoji
+
+        self.pbar = pbar = tqdm(
+            desc=f"{gpu_emoji} {self.label}",
+            position=self.num_readers + self.rank + 1,
+            leave=True,
+            unit="items",
+            bar_format='{desc}: {n_fmt} | {rate_fmt} | File {postfix}',
+            dynamic_ncols=True,
+            mininterval=0.5
+        )
+
+        torch.set_num_threads(self.num_threads)
+
+        self.files_written = 0
+        self.n = 0
+
+        if self.writer_queue_size > 0:
+            self.writer_thread = WriterThread(self.writer_queue_size, self.metrics)
+            self.writer_thread.start()
+
+        try:
+            pbar.set_description(f"{gpu_emoji} {self.label} Loading...")
+            model = SNACCoder(self.device, model_id=self.model_id, cache_dir=self.model_cache_dir)
+            model.set_chunking(self.chunk_seconds, self.chunk_overlap_seconds, self.max_padded_samples)
+            model.set_inference_mode(self.precision, self.compile_model, self.compile_mode,
+                                     self.cudnn_benchmark, self.tf32)
+            if not model.fast_mode:
+                self.check_items = 0
+            model.metrics = self.metrics
+            self.sample_rate = model.snac_model.sampling_rate
+            if self.encode_cache_path:
+                self.cache = EncodeCache(self.encode_cache_path, self.encode_cache_bytes, model.cache_namespace())
+            pbar.set_description(f"{gpu_emoji} {self.label} Ready")
+
+            if self.max_batch_size > 1:
+                self._run_batched(model)
+            else:
+                self._run_single(model)
 
         except Exception as e:
-            pbar.set_description(f"{gpu_emoji} GPU-{self.rank} CRASHED: {e}")
+            pbar.set_description(f"{gpu_emoji} {self.label} CRASHED: {e}")
+            self.reporter.error(e, stage="worker")
         finally:
-            self._close_file(raw, buf, gz, txt)
-            total_files = file_idx + (1 if lines_in_file > 0 else 0)
-            pbar.set_description(f"{gpu_emoji} GPU-{self.rank} DONE ({n:,} items, {total_files} files)")
+            try:
+                if self.writer_thread is None or self.writer_thread.error is None:
+                    self._submit(self._finalize_all)
+            except Exception as e:
+                self._show_error(e, stage="write")
+            if self.writer_thread is not None:
+                self.writer_thread.stop()
+                if self.writer_thread.error is not None:
+                    self._show_error(self.writer_thread.error, stage="write")
+            if self.ring_reader is not None:
+                self.ring_reader.close()
+            if self.cache is not None:
+                try:
+                    self.cache.close()
+                except Exception as e:
+                    self._show_error(e, stage="cache")
+            self._report_metrics(force=True)
+            pbar.set_description(f"{gpu_emoji} {self.label} DONE ({self.n:,} items, {self.files_written} files, "
+                                 f"{self._storage_summary()})")
             pbar.close()
 
+    def _report_metrics(self, force: bool = False):
+        """Sends a metrics snapshot to the manager (at most once per report interval unless forced)"""
+        if self.writer_thread is not None:
+            self.metrics.set("writer_queue_depth", self.writer_thread.q.qsize())
+            self.metrics.set("write_off_thread_s", self.writer_thread.busy_s)
+        else:
+            self.metrics.set("write_inline_s", self.store_s)
+        self.metrics.set("files_written", self.files_written)
+        if force:
+            self.reporter.report()
+        else:
+            self.reporter.maybe_report()
+
+    def _finalize_all(self):
+        """Closes the current shards of all datasets"""
+        for prefix in list(self.shards):
+            self._finalize_dataset(prefix)
+
+    def _storage_summary(self) -> str:
+        """Describes how much storage time was kept off the encode thread"""
+        if self.writer_thread is None:
+            return f"write {self.store_s:.1f}s inline"
+        recovered = max(0.0, self.writer_thread.busy_s - self.writer_thread.blocked_s)
+        return (f"write {self.writer_thread.busy_s:.1f}s off-thread, "
+                f"blocked {self.writer_thread.blocked_s:.1f}s, recovered {recovered:.1f}s")
+
 
-def worker_process(rank: int, in_q: mp.Queue, out_dir: str, dataset_prefix: str,
-                   gzip_level: int, buffer_size: int, lines_per_file: int, num_readers: int,
-                   model_id: str, num_layers: int):
+def worker_process(rank: int, in_q: BudgetedQueue, settings: BaseSettings, num_layers: int,
+                   device: str = "cuda:0", ring_reader: Optional[RingReader] = None,
+                   report_q: Optional[mp.Queue] = None, generation: int = 0):
     """Entry point for worker process"""
-    worker = AudioWorker(rank, in_q, out_dir, dataset_prefix, gzip_level, buffer_size,
-                        lines_per_file, num_readers, model_id, num_layers)
+    worker = AudioWorker(rank, in_q, settings, num_layers, device, ring_reader, report_q, generation)
     worker.run()
@@ -1,7 +1,11 @@
+import os
 import yaml
 from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 
+# Builders that load local files from data_dir (for Hub datasets data_dir only picks a subset)
+LOCAL_LOADERS = ("audiofolder", "json", "csv", "parquet", "arrow", "text", "webdataset")
+
 
 @dataclass
 class DatasetConfig:
@@ -13,10 +17,16 @@ class DatasetConfig:
     add_constant: Optional[List[Dict[str, str]]]
     split: str = "train"
     sub_name: Optional[str] = None
+    data_dir: Optional[str] = None
+    prefix: Optional[str] = None
 
     @property
     def dataset_prefix(self) -> str:
-        """Extract dataset prefix from name (part after /)"""
+        """The prefix if set, else the data_dir name of a local loader, else the part of name after /"""
+        if self.prefix:
+            return self.prefix
+        if self.data_dir and (self.name in LOCAL_LOADERS or os.path.isdir(self.name)):
+            return os.path.basename(os.path.normpath(self.data_dir))
         return self.name.split('/')[-1]
 
     def get_constant_columns(self) -> Dict[str, str]:
@@ -37,6 +47,54 @@ class BaseSettings:
     buffer_size: int
     lines_per_file: int
     load_dataset_num_proc: int = 5
+    max_batch_size: int = 1
+    max_padded_samples: int = 1920000
+    max_wait_ms: int = 100
+    shm_transport: bool = False
+    shm_slab_bytes: int = 268435456
+    resume: bool = False
+    shard_format: str = "jsonl.gz"
+    row_group_size: int = 0
+    compact_tokens: bool = False
+    streaming: bool = False
+    gpu_workers: int = -1
+    gpu_threads_per_worker: int = 1
+    cpu_workers: int = 0
+    cpu_threads_per_worker: int = 1
+    chunk_seconds: float = 0.0
+    chunk_overlap_seconds: float = 1.0
+    writer_queue_size: int = 1024
+    compress_threads: int = 1
+    metrics_interval: float = 10.0
+    task_rows: int = 1000
+    max_readers: int = 0
+    min_readers: int = 1
+    autoscale_interval: float = 5.0
+    encode_cache_path: str = ""
+    encode_cache_bytes: int = 10737418240
+    assembly_workers: int = 4
+    fast_decode: bool = False
+    decode_threads: int = 2
+    pcm_cache_dir: str = ""
+    num_nodes: int = 1
+    node_rank: int = 0
+    ledger_dir: str = ""
+    lease_seconds: float = 120.0
+    queue_max_bytes: int = 0
+    queue_max_seconds: float = 0.0
+    slow_lane_seconds: float = 0.0
+    sort_window: int = 0
+    precision: str = "fp32"
+    compile_model: bool = False
+    compile_mode: str = "default"
+    cudnn_benchmark: bool = False
+    tf32: bool = False
+    precision_check_items: int = 0
+    model_cache_dir: str = ""
+    item_retries: int = 1
+    max_worker_restarts: int = 3
+    dead_letter_path: str = ""
+    length_index: bool = False
 
 
 @dataclass
@@ -44,17 +102,36 @@ class SaveSettings:
     """Settings for saving/uploading datasets"""
     local: Optional[str]
     hf_upload: Optional[str]
+    token_store: Optional[str] = None
+
+
+@dataclass
+class FilterSettings:
+    """Pre-encode audio filter settings (every filter is off by default)"""
+    min_seconds: float = 0.0
+    max_seconds: float = 0.0
+    silence_db: Optional[float] = None
+    trim_silence_db: Optional[float] = None
+    trim_frame_ms: float = 10.0
+    trim_margin_ms: float = 100.0
+    max_clipped_fraction: float = 0.0
+    clip_level: float = 0.999
+    dedup: str = "off"
+    dedup_bit_error_rate: float = 0.2
 
 
 class ConfigManager:
     """Manages configuration loading and validation"""
 
-    def __init__(self, config_path: str = "config.yaml"):
+    def __init__(self, config_path: str = "config.yaml", overrides: Optional[Dict[str, Any]] = None):
         with open(config_path, 'r') as f:
             self.config = yaml.safe_load(f)
+        # Base settings given on the command line take precedence over the config file
+        self.config['base_settings'].update(overrides or {})
 
         self.base_settings = BaseSettings(**self.config['base_settings'])
         self.save_settings = SaveSettings(**self.config['save_settings'])
+        self.filter_settings = FilterSettings(**(self.config.get('filter_settings') or {}))
         self.datasets = [DatasetConfig(**ds) for ds in self.config['hf_datasets']]
         
         self.sample_rate = self._get_sample_rate()
@@ -121,6 +198,10 @@ class ConfigManager:
         """Get save/upload settings"""
         return self.save_settings
 
+    def get_filter_settings(self) -> FilterSettings:
+        """Get pre-encode audio filter settings"""
+        return self.filter_settings
+
     def get_sample_rate(self) -> int:
         """Get sample rate for audio processing"""
         return self.sample_rate
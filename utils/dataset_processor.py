@@ -1,6 +1,10 @@
+from bisect import bisect_right
 from datasets import load_dataset, Audio, disable_progress_bars
-from typing import Dict, Any
+from datasets.distributed import split_dataset_by_node
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from utils.audio_decode import AudioDecoder
 from utils.config_manager import DatasetConfig
+from utils.resume_manifest import subtract_ranges
 
 disable_progress_bars()
 
@@ -8,85 +12,57 @@ disable_progress_bars()
 class DatasetProcessor:
     """Handles loading and preprocessing of HuggingFace datasets"""
 
-    def __init__(self, dataset_config: DatasetConfig, sample_rate: int):
+    def __init__(self, dataset_config: DatasetConfig, sample_rate: int, streaming: bool = False,
+                 fast_decode: bool = False, decode_threads: int = 1, pcm_cache_dir: str = ""):
         self.config = dataset_config
         self.sample_rate = sample_rate
+        self.streaming = streaming
+        self.fast_decode = fast_decode
+        self.decode_threads = decode_threads
+        self.pcm_cache_dir = pcm_cache_dir
         self.dataset = None
+        self.row_offset = 0
+        self.row_stride = 1
+        self.skip_ranges: List[Tuple[int, int]] = []
 
     def load_dataset(self, num_proc: int = 5) -> None:
-        """Load dataset from HuggingFace"""
+        """Load dataset from HuggingFace (or stream it when streaming is enabled)"""
         dataset_desc = f"{self.config.name}"
         if self.config.sub_name:
             dataset_desc += f" ({self.config.sub_name})"
+        if self.config.data_dir:
+            dataset_desc += f" <{self.config.data_dir}>"
         dataset_desc += f" [{self.config.split}]"
 
-        print(f"📦 Loading dataset: {dataset_desc}")
+        # With fast_decode the readers decode and resample the raw audio themselves (AudioDecoder)
+        audio = Audio(decode=False) if self.fast_decode else Audio(self.sample_rate)
 
-        self.dataset = load_dataset(
-            self.config.name,
-            self.config.sub_name,
-            num_proc=num_proc,
-            split=self.config.split,
-            verification_mode='no_checks',
-            trust_remote_code=True
-        ).cast_column(self.config.audio_column_name, Audio(self.sample_rate))
+        if self.streaming:
+            print(f"🌊 Streaming dataset: {dataset_desc}")
 
-        print(f"  ✅ Loaded {len(self.dataset)} samples from {dataset_desc}")
+            self.dataset = load_dataset(
+                self.config.name,
+                self.config.sub_name,
+                data_dir=self.config.data_dir,
+                split=self.config.split,
+                streaming=True,
+                trust_remote_code=True
+            ).cast_column(self.config.audio_column_name, audio)
 
-    def get_dataset(self):
-        """Get the loaded dataset"""
-        if self.dataset is None:
-            raise ValueError("Dataset not loaded. Call load_dataset() first.")
-        return self.dataset
-
-    def prepare_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Prepare a single item for processing.
-        Extracts text, audio, speaker (if specified), and adds constant fields.
-        """
-        prepared = {
-            "text": item[self.config.text_column_name],
-            "wave": item[self.config.audio_column_name]["array"],
-        }
-
-        if self.config.speaker_column_name:
-            prepared["speaker"] = item[self.config.speaker_column_name]
-
-        constant_cols = self.config.get_constant_columns()
-        prepared.update(constant_cols)
-
-        return preparedfrom datasets import load_dataset, Audio, disable_progress_bars
-from typing import Dict, Any
-from utils.config_manager import DatasetConfig
-
-disable_progress_bars()
-
-
-class DatasetProcessor:
-    """Handles loading and preprocessing of HuggingFace datasets"""
-
-    def __init__(self, dataset_config: DatasetConfig, sample_rate: int):
-        self.config = dataset_config
-        self.sample_rate = sample_rate
-        self.dataset = None
-
-    def load_dataset(self, num_proc: int = 5) -> None:
-        """Load dataset from HuggingFace"""
-        dataset_desc = f"{self.config.name}"
-        if self.config.sub_name:
-            dataset_desc += f" ({self.config.sub_name})"
-        dataset_desc += f" [{self.config.split}]"
+            print(f"  ✅ Streaming {dataset_desc} from {self.dataset.num_shards} source shard(s)")
+            return
 
         print(f"📦 Loading dataset: {dataset_desc}")
 
         self.dataset = load_dataset(
             self.config.name,
             self.config.sub_name,
+            data_dir=self.config.data_dir,
             num_proc=num_proc,
             split=self.config.split,
             verification_mode='no_checks',
             trust_remote_code=True
-        ).cast_column(self.config.audio_column_name, Audio(self.sample_rate))
+        ).cast_column(self.config.audio_column_name, audio)
 
         print(f"  ✅ Loaded {len(self.dataset)} samples from {dataset_desc}")
 
@@ -96,6 +72,70 @@ class DatasetProcessor:
             raise ValueError("Dataset not loaded. Call load_dataset() first.")
         return self.dataset
 
+    def task_ranges(self, rows_per_task: int,
+                    skip_ranges: Optional[List[Tuple[int, int]]] = None) -> List[Tuple[int, int]]:
+        """Split the rows not covered by skip_ranges into [start, end) tasks of at most rows_per_task rows"""
+        tasks = []
+        for start, end in subtract_ranges(0, len(self.get_dataset()), skip_ranges or []):
+            for task_start in range(start, end, rows_per_task):
+                tasks.append((task_start, min(task_start + rows_per_task, end)))
+        return tasks
+
+    def for_reader(self, reader_id: int, num_readers: int,
+                   skip_ranges: Optional[List[Tuple[int, int]]] = None) -> "DatasetProcessor":
+        """
+        Create a processor that streams one reader's share of the dataset.
+        Source shards are dealt round-robin across readers; if there are fewer shards
+        than readers, examples are dealt round-robin instead.
+        """
+        ds = self.get_dataset()
+        if ds.num_shards >= num_readers:
+            part = ds.shard(num_shards=num_readers, index=reader_id, contiguous=False)
+        else:
+            part = split_dataset_by_node(ds, rank=reader_id, world_size=num_readers)
+
+        processor = DatasetProcessor(self.config, self.sample_rate, streaming=True,
+                                     fast_decode=self.fast_decode, decode_threads=self.decode_threads,
+                                     pcm_cache_dir=self.pcm_cache_dir)
+        processor.dataset = part
+        processor.row_offset = reader_id
+        processor.row_stride = num_readers
+        processor.skip_ranges = skip_ranges or []
+        return processor
+
+    def iter_rows(self, row_ranges: Optional[List[Tuple[int, int]]] = None,
+                  return_errors: bool = False) -> Iterator[Tuple[int, Any]]:
+        """
+        Iterate over (row index, example) pairs for the given [start, end) ranges
+        (the whole dataset if None). Streamed rows are numbered
+        `position * row_stride + row_offset`, which is stable for a fixed number of readers.
+        With fast_decode and return_errors, an example that fails to decode is yielded as its exception.
+        """
+        rows = self._iter_raw_rows(row_ranges)
+        if not self.fast_decode:
+            return rows
+        decoder = AudioDecoder(self.sample_rate, threads=self.decode_threads, cache_dir=self.pcm_cache_dir)
+        return decoder.decode_rows(rows, self.config.audio_column_name, return_errors)
+
+    def _iter_raw_rows(self, row_ranges: Optional[List[Tuple[int, int]]]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        ds = self.get_dataset()
+
+        if self.streaming:
+            starts = [start for start, _ in self.skip_ranges]
+            for position, ex in enumerate(ds):
+                row = position * self.row_stride + self.row_offset
+                i = bisect_right(starts, row) - 1
+                if i >= 0 and row < self.skip_ranges[i][1]:
+                    continue
+                yield row, ex
+            return
+
+        if row_ranges is None:
+            row_ranges = [(0, len(ds))]
+        for start, end in row_ranges:
+            for offset, ex in enumerate(ds.select(range(start, end))):
+                yield start + offset, ex
+
     def prepare_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
         """
         Prepare a single item for processing.
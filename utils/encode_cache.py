@@ -0,0 +1,160 @@
+"""
+Persistent content-hash cache of SNAC codes.
+
+Waveforms are keyed by a BLAKE2b hash of their float32 samples together with everything
+that changes the codes (codec model id, sample rate and chunking), so re-running the
+pipeline over overlapping datasets, merged corpora or duplicated clips skips the encoder
+for audio it has seen before. Entries live in a single SQLite file in WAL mode, which all
+workers share; the file is kept under a size limit by evicting the least recently used
+entries.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Pending inserts and last-used updates are written in one transaction every this many operations
+FLUSH_EVERY = 64
+# Eviction removes entries until the cache is this fraction of its size limit
+EVICT_TO = 0.9
+
+
+def _pack_codes(codes: dict) -> Tuple[bytes, int]:
+    """Packs the layer codes of an encoded item as uint32 layer lengths followed by uint16 tokens"""
+    layers = [np.asarray(codes[f"snac_layer_{i}"]).reshape(-1) for i in range(1, codes["num_layers"] + 1)]
+    lengths = np.array([layer.shape[0] for layer in layers], dtype="<u4")
+    data = lengths.tobytes() + np.concatenate(layers).astype("<u2").tobytes()
+    return data, len(layers)
+
+
+def _unpack_codes(data: bytes, num_layers: int) -> dict:
+    """Inverse of _pack_codes, returning the dict format of SNACCoder"""
+    lengths = np.frombuffer(data, dtype="<u4", count=num_layers)
+    tokens = np.frombuffer(data, dtype="<u2", offset=4 * num_layers).astype(np.int64)
+    codes = {}
+    start = 0
+    for i, n in enumerate(lengths, start=1):
+        codes[f"snac_layer_{i}"] = tokens[start:start + n]
+        start += int(n)
+    codes["num_layers"] = num_layers
+    codes["token_lengths"] = [int(n) for n in lengths]
+    return codes
+
+
+class EncodeCache:
+    """SQLite store of SNAC codes keyed by waveform content, shared by all workers"""
+
+    def __init__(self, path: str, max_bytes: int, namespace: str):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+            max_bytes: Size limit of the stored codes; least recently used entries are evicted beyond it
+            namespace: Everything besides the waveform that determines the codes, mixed into every key
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.namespace = namespace.encode()
+        self.pending: List[Tuple[bytes, bytes, int, int, float, float]] = []
+        self.touched: Dict[bytes, float] = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS codes ("
+            "key BLOB PRIMARY KEY, data BLOB NOT NULL, num_layers INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, encode_s REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS codes_last_used ON codes (last_used)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.execute(
+            "INSERT OR IGNORE INTO meta VALUES ('total_bytes', (SELECT COALESCE(SUM(size), 0) FROM codes))"
+        )
+        self.conn.execute("COMMIT")
+
+    def key(self, wave: np.ndarray) -> bytes:
+        """Content key of a waveform"""
+        h = hashlib.blake2b(self.namespace, digest_size=16)
+        h.update(np.ascontiguousarray(wave, dtype=np.float32).reshape(-1).data)
+        return h.digest()
+
+    def get(self, key: bytes) -> Optional[Tuple[dict, float]]:
+        """Returns the cached codes and the time it took to encode them, or None"""
+        row = self.conn.execute("SELECT data, num_layers, encode_s FROM codes WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            for pending in self.pending:
+                if pending[0] == key:
+                    row = (pending[1], pending[2], pending[4])
+                    break
+            else:
+                return None
+        self.touched[key] = time.time()
+        if len(self.touched) >= FLUSH_EVERY:
+            self.flush()
+        return _unpack_codes(row[0], row[1]), row[2]
+
+    def put(self, key: bytes, codes: dict, encode_s: float):
+        """Stores the codes of a waveform (written with the next flush)"""
+        data, num_layers = _pack_codes(codes)
+        self.pending.append((key, data, num_layers, len(data), encode_s, time.time()))
+        if len(self.pending) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        """Writes pending entries and last-used times, evicting old entries if over the size limit"""
+        if not self.pending and not self.touched:
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            added = 0
+            for key, data, num_layers, size, encode_s, last_used in self.pending:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO codes VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, data, num_layers, size, encode_s, last_used),
+                )
+                added += size if cursor.rowcount > 0 else 0
+            self.conn.executemany("UPDATE codes SET last_used = ? WHERE key = ?",
+                                  [(t, key) for key, t in self.touched.items()])
+            self.conn.execute("UPDATE meta SET value = value + ? WHERE name = 'total_bytes'", (added,))
+            total = self.conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+            evicted = self._evict(total) if total > self.max_bytes else 0
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.pending.clear()
+        self.touched.clear()
+        if evicted:
+            self.conn.execute("PRAGMA incremental_vacuum")
+
+    def _evict(self, total: int) -> int:
+        """Deletes least recently used entries until the cache is below EVICT_TO of its limit"""
+        target = int(self.max_bytes * EVICT_TO)
+        freed = 0
+        while total - freed > target:
+            rows = self.conn.execute("SELECT key, size FROM codes ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            batch = []
+            for key, size in rows:
+                batch.append((key,))
+                freed += size
+                if total - freed <= target:
+                    break
+            self.conn.executemany("DELETE FROM codes WHERE key = ?", batch)
+        self.conn.execute("UPDATE meta SET value = value - ? WHERE name = 'total_bytes'", (freed,))
+        return freed
+
+    def close(self):
+        """Flushes pending writes and closes the database"""
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
@@ -0,0 +1,441 @@
+"""
+Encode service: a long-running local HTTP server that tokenizes audio on demand with `SNACCoder`.
+
+    python -m utils.encode_service --config config.yaml --port 8765
+    python -m utils.encode_service --config config.yaml --unix /tmp/snac.sock
+
+Endpoints:
+- `POST /encode`: the body is an audio file (wav, flac, ogg, anything libsndfile reads) or,
+  with `Content-Type: application/octet-stream`, raw PCM described by the query parameters
+  `sample_rate` (default: the codec's), `dtype` (`float32` or `int16`) and `channels` (default 1).
+  Audio is downmixed and resampled to the codec sample rate. Returns the codes in the record
+  format of the shards (`snac_layer_N`, `num_layers`, `token_lengths`) plus `cached`.
+- `GET /health`: model, sample rate and device
+- `GET /stats`: requests, batches, mean batch size, cache hits and latencies
+
+Concurrent requests are encoded together: the first waiting request starts a batch, which
+takes every request that arrives within `--max-wait-ms` (or while the previous batch is still
+running), up to `--max-batch-size` requests and `max_padded_samples` samples. The batch is
+encoded with `SNACCoder.encode_batch`, so the codes are identical to encoding each request on
+its own. Codes are kept in an in-memory LRU cache keyed by a hash of the resampled waveform
+(the key of the encode cache), and identical requests in flight share one encode.
+
+The server is plain asyncio (HTTP/1.1 with keep-alive, no chunked request bodies), so it needs
+no web framework. Model, model cache, chunking and inference mode come from `base_settings`.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import statistics
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from utils.audio_decode import AudioDecoder, resample
+from utils.config_manager import ConfigManager
+
+try:
+    import orjson
+    USE_ORJSON = True
+except Exception:
+    USE_ORJSON = False
+
+PCM_DTYPES = {"float32": np.float32, "int16": np.int16}
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+# Latencies kept for the percentiles in /stats
+LATENCY_WINDOW = 10000
+
+
+def _dumps(obj: Dict[str, Any]) -> bytes:
+    if USE_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=lambda x: x.tolist()).encode("utf-8")
+
+
+def codes_nbytes(codes: dict) -> int:
+    """Memory held by the token arrays of encoded audio"""
+    return sum(np.asarray(codes[f"snac_layer_{i}"]).nbytes for i in range(1, codes["num_layers"] + 1))
+
+
+class HTTPError(Exception):
+    """A request that is answered with an error status"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class LRUCache:
+    """Codes of recently encoded waveforms, bounded by the bytes of their tokens"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[bytes, dict]" = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key: bytes) -> Optional[dict]:
+        codes = self.entries.get(key)
+        if codes is not None:
+            self.entries.move_to_end(key)
+        return codes
+
+    def put(self, key: bytes, codes: dict):
+        size = codes_nbytes(codes)
+        if size > self.max_bytes or key in self.entries:
+            return
+        self.entries[key] = codes
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= codes_nbytes(evicted)
+
+
+class _Request:
+    """A waveform waiting to be encoded"""
+    __slots__ = ("wave", "key", "future", "arrived", "samples")
+
+    def __init__(self, wave: np.ndarray, key: bytes, future: asyncio.Future, arrived: float, samples: int):
+        self.wave = wave
+        self.key = key
+        self.future = future
+        self.arrived = arrived
+        self.samples = samples
+
+
+class MicroBatcher:
+    """Gathers concurrent encode requests into batches and runs them on one model thread"""
+
+    def __init__(self, coder, max_batch_size: int = 16, max_wait_ms: float = 5.0,
+                 max_batch_samples: int = 0, cache_bytes: int = 256 << 20):
+        """
+        Args:
+            coder: SNACCoder to encode with
+            max_batch_size: Requests encoded per batch
+            max_wait_ms: Longest time a request waits for others to join its batch
+            max_batch_samples: Upper bound on the padded samples of a batch (0 = no bound)
+            cache_bytes: Size of the LRU cache of codes (0 = no cache)
+        """
+        self.coder = coder
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_samples = max_batch_samples
+        self.cache = LRUCache(cache_bytes) if cache_bytes > 0 else None
+        self.namespace = coder.cache_namespace().encode()
+        self.queue: "asyncio.Queue[_Request]" = asyncio.Queue()
+        self.carry: Optional[_Request] = None
+        self.inflight: Dict[bytes, asyncio.Future] = {}
+        # One thread owns the model, so batches run one at a time while the event loop keeps accepting
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snac-encode")
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"requests": 0, "cache_hits": 0, "shared": 0, "batches": 0, "batched_requests": 0,
+                      "encode_s": 0.0, "errors": 0}
+
+    def key(self, wave: np.ndarray) -> bytes:
+        """Content key of a waveform (as EncodeCache.key)"""
+        h = hashlib.blake2b(self.namespace, digest_size=16)
+        h.update(np.ascontiguousarray(wave, dtype=np.float32).reshape(-1).data)
+        return h.digest()
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def encode(self, wave: np.ndarray) -> Tuple[dict, bool]:
+        """Codes of a mono float32 waveform at the codec sample rate, and whether they were cached"""
+        self.stats["requests"] += 1
+        key = self.key(wave)
+        if self.cache is not None:
+            codes = self.cache.get(key)
+            if codes is not None:
+                self.stats["cache_hits"] += 1
+                return codes, True
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats["shared"] += 1
+            return await asyncio.shield(future), False
+        loop = asyncio.get_running_loop()
+        future = self.inflight[key] = loop.create_future()
+        samples = self.coder.padded_length(wave.shape[-1])
+        await self.queue.put(_Request(wave, key, future, loop.time(), samples))
+        try:
+            return await asyncio.shield(future), False
+        finally:
+            self.inflight.pop(key, None)
+
+    async def _next_batch(self) -> List[_Request]:
+        """Waits for a request and gathers the ones that join it before its deadline"""
+        loop = asyncio.get_running_loop()
+        first, self.carry = self.carry, None
+        if first is None:
+            first = await self.queue.get()
+        batch, samples = [first], first.samples
+        deadline = first.arrived + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    req = await asyncio.wait_for(self.queue.get(), timeout)
+                else:
+                    req = self.queue.get_nowait()
+            except asyncio.TimeoutError:
+                break
+            if self.max_batch_samples and samples + req.samples > self.max_batch_samples:
+                self.carry = req
+                break
+            batch.append(req)
+            samples += req.samples
+        return batch
+
+    def _encode(self, waves: List[np.ndarray]) -> List[Any]:
+        """Encodes a batch on the model thread; if it fails, each wave on its own so one bad request fails alone"""
+        try:
+            return self.coder.encode_batch(waves)
+        except Exception:
+            results = []
+            for wave in waves:
+                try:
+                    results.append(self.coder.encode_batch([wave])[0])
+                except Exception as e:
+                    results.append(e)
+            return results
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            start = time.perf_counter()
+            results = await loop.run_in_executor(self.executor, self._encode, [req.wave for req in batch])
+            self.stats["encode_s"] += time.perf_counter() - start
+            self.stats["batches"] += 1
+            self.stats["batched_requests"] += len(batch)
+            for req, codes in zip(batch, results):
+                if isinstance(codes, Exception):
+                    self.stats["errors"] += 1
+                    req.future.set_exception(codes)
+                    continue
+                if self.cache is not None:
+                    self.cache.put(req.key, codes)
+                req.future.set_result(codes)
+
+
+class EncodeServer:
+    """HTTP front end of a MicroBatcher"""
+
+    def __init__(self, batcher: MicroBatcher, sample_rate: int, max_request_bytes: int = 64 << 20,
+                 info: Optional[Dict[str, Any]] = None):
+        self.batcher = batcher
+        self.sample_rate = sample_rate
+        self.max_request_bytes = max_request_bytes
+        self.info = info or {}
+        self.decoder = AudioDecoder(sample_rate)
+        self.latencies: List[float] = []
+
+    def read_audio(self, body: bytes, content_type: str, query: Dict[str, List[str]]) -> np.ndarray:
+        """Mono float32 waveform at the codec sample rate from a request body"""
+        if content_type.split(";")[0].strip() != "application/octet-stream":
+            try:
+                return self.decoder.decode({"bytes": body})
+            except Exception as e:
+                raise HTTPError(400, f"cannot decode audio: {e}")
+        param = lambda name, default: query.get(name, [default])[0]
+        dtype = PCM_DTYPES.get(param("dtype", "float32"))
+        if dtype is None:
+            raise HTTPError(400, f"dtype must be one of {', '.join(PCM_DTYPES)}")
+        try:
+            sample_rate, channels = int(param("sample_rate", self.sample_rate)), int(param("channels", 1))
+        except ValueError:
+            raise HTTPError(400, "sample_rate and channels must be integers")
+        if sample_rate <= 0 or channels <= 0 or len(body) % (np.dtype(dtype).itemsize * channels):
+            raise HTTPError(400, "body is not a whole number of PCM frames")
+        frames = np.frombuffer(body, dtype=dtype).reshape(-1, channels)
+        wave = frames.astype(np.float32)
+        if dtype == np.int16:
+            wave /= 32768.0
+        wave = wave[:, 0] if channels == 1 else wave.mean(axis=1, dtype=np.float32)
+        return resample(np.ascontiguousarray(wave), sample_rate, self.sample_rate)
+
+    async def encode(self, body: bytes, content_type: str, query: Dict[str, List[str]]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        # Decoding and resampling release the GIL, so they run next to the model thread
+        wave = await loop.run_in_executor(None, self.read_audio, body, content_type, query)
+        if wave.shape[0] == 0:
+            raise HTTPError(400, "empty audio")
+        codes, cached = await self.batcher.encode(wave)
+        return {**codes, "cached": cached, "audio_seconds": wave.shape[0] / self.sample_rate}
+
+    def stats(self) -> Dict[str, Any]:
+        s = dict(self.batcher.stats)
+        s["mean_batch_size"] = s["batched_requests"] / s["batches"] if s["batches"] else 0.0
+        if self.batcher.cache is not None:
+            s["cache_entries"], s["cache_bytes"] = len(self.batcher.cache.entries), self.batcher.cache.bytes
+        if self.latencies:
+            ordered = sorted(self.latencies)
+            s["latency_p50_ms"] = 1000 * statistics.median(ordered)
+            s["latency_p99_ms"] = 1000 * ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+        return s
+
+    async def _route(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, Any]]:
+        url = urlsplit(target)
+        if url.path == "/encode":
+            if method != "POST":
+                raise HTTPError(405, "use POST")
+            start = time.perf_counter()
+            result = await self.encode(body, headers.get("content-type", ""), parse_qs(url.query))
+            self.latencies.append(time.perf_counter() - start)
+            del self.latencies[:-LATENCY_WINDOW]
+            return 200, result
+        if url.path == "/health" and method == "GET":
+            return 200, {"status": "ok", "sample_rate": self.sample_rate, **self.info}
+        if url.path == "/stats" and method == "GET":
+            return 200, self.stats()
+        raise HTTPError(404, f"no route {method} {url.path}")
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """Reads one request; returns (method, target, headers, body), or None at the end of the connection"""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", ""):
+            raise HTTPError(411, "chunked request bodies are not supported, send Content-Length")
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Content-Length must be an integer")
+        if length < 0:
+            raise HTTPError(400, "Content-Length must not be negative")
+        if length > self.max_request_bytes:
+            raise HTTPError(413, f"request body over {self.max_request_bytes} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serves the requests of one connection (keep-alive)"""
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    status, payload = await self._route(method, target, headers, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": repr(e)}
+                data = _dumps(payload)
+                writer.write(f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def load_coder(config: ConfigManager, device: str, threads: int):
+    """SNACCoder with the model, chunking and inference mode of a config (weights memory-mapped from the model cache)"""
+    import torch
+    from utils.snac_codec import MODEL_CACHE_DIR, SNACCoder, cache_model
+
+    base = config.get_base_settings()
+    torch.set_num_threads(threads)
+    cache_dir = base.model_cache_dir or os.path.join(base.OUT_DIR, MODEL_CACHE_DIR)
+    cache_model(base.audio_codec, cache_dir)
+    coder = SNACCoder(device, model_id=base.audio_codec, cache_dir=cache_dir)
+    coder.set_chunking(base.chunk_seconds, base.chunk_overlap_seconds, base.max_padded_samples)
+    coder.set_inference_mode(base.precision, base.compile_model, base.compile_mode, base.cudnn_benchmark, base.tf32)
+    return coder
+
+
+async def serve(config: ConfigManager, host: str = "127.0.0.1", port: int = 8765, unix: Optional[str] = None,
+                device: str = "cpu", threads: int = 1, cache_mb: float = 256.0, max_request_mb: float = 64.0,
+                max_batch_size: int = 16, max_wait_ms: float = 5.0, ready=None):
+    """Runs the encode service until cancelled. ready (a threading.Event or similar) is set once it accepts requests"""
+    base = config.get_base_settings()
+    coder = load_coder(config, device, threads)
+    batcher = MicroBatcher(coder, max_batch_size, max_wait_ms, base.max_padded_samples, int(cache_mb * (1 << 20)))
+    server = EncodeServer(batcher, coder.snac_model.sampling_rate, int(max_request_mb * (1 << 20)),
+                          {"model": base.audio_codec, "device": str(coder.device), "num_layers": coder.num_layers})
+    batcher.start()
+    if unix:
+        listener = await asyncio.start_unix_server(server.handle, path=unix)
+        where = unix
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        where = "http://{}:{}".format(*listener.sockets[0].getsockname()[:2])
+    print(f"🎧 Encode service ({base.audio_codec} on {coder.device}, batches of up to {batcher.max_batch_size}, "
+          f"{batcher.max_wait * 1000:.0f} ms wait) listening on {where}")
+    if ready is not None:
+        ready.set()
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await batcher.stop()
+        if unix and os.path.exists(unix):
+            os.remove(unix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve SNAC encoding over HTTP with request micro-batching")
+    parser.add_argument("--config", default="config.yaml", help="Pipeline configuration file (model and batching settings)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--device", default=None, help="cpu or cuda:N (default: cuda:0 if available)")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="Requests encoded per batch")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Longest time a request waits for a batch to fill")
+    parser.add_argument("--cache-mb", type=float, default=256.0, help="LRU cache of codes (0 = no cache)")
+    parser.add_argument("--max-request-mb", type=float, default=64.0, help="Largest request body accepted")
+    args = parser.parse_args()
+
+    from utils.logging_config import setup_logging
+    setup_logging()
+    device = args.device
+    if device is None:
+        import torch
+        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    try:
+        asyncio.run(serve(ConfigManager(args.config), args.host, args.port, args.unix, device, args.threads,
+                          args.cache_mb, args.max_request_mb, args.max_batch_size, args.max_wait_ms))
+    except KeyboardInterrupt:
+        print("\n👋 Encode service stopped")
+
+
+if __name__ == "__main__":
+    main()
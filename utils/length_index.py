@@ -0,0 +1,280 @@
+"""
+Token-length index of encoded datasets, for length bucketing and sequence packing in training.
+
+While a worker writes a shard, it collects the token count of every SNAC layer, the text length
+and the speaker of each line, and writes them next to the shard as `<shard>.index.npz` before
+the shard is renamed into place (like its rows manifest). Once a dataset is encoded, the
+sidecars of its shards are merged into `OUT_DIR/<prefix>.index.npz`:
+
+- `shards`:        shard file names
+- `shard`:         int32, index into `shards` of every sample
+- `line`:          int32, line (row) of the sample in its shard
+- `row`:           int64, source row of the sample in its dataset
+- `token_lengths`: int32 (num_samples, num_layers), tokens per SNAC layer
+- `text_lengths`:  int32, characters of the text
+- `speaker`:       int32, index into `speaker_names` (-1 = no speaker)
+- `speaker_names`: distinct speakers
+
+Samples are in shard name order and then line order, the order of the assembled dataset.
+Shards without a sidecar (written by older runs) are read once and get one.
+
+Length-sorted and packed manifests are made from the indexes alone, without reading shards:
+
+    python -m utils.length_index OUT_DIR build [--prefix PREFIX]
+    python -m utils.length_index OUT_DIR sort sorted.npz [--key total]
+    python -m utils.length_index OUT_DIR pack packed.jsonl --max-tokens 4096 [--key layer_1]
+"""
+
+import argparse
+import bisect
+import glob
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.resume_manifest import INDEX_SUFFIX, MANIFEST_SUFFIX, TMP_SUFFIX, ResumeManifest, decode_rows
+from utils.shard_writer import SHARD_EXTENSIONS, iter_shard_records, match_shards
+
+LENGTH_DTYPE = np.int32
+
+
+def _save_npz(path: str, arrays: Dict[str, np.ndarray]) -> None:
+    """Writes arrays to an .npz file atomically (np.savez would append .npz to a .tmp name)"""
+    tmp = path + TMP_SUFFIX
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def _speaker_codes(speakers: List[Optional[str]]) -> Dict[str, np.ndarray]:
+    """Speaker column as codes into the distinct names (-1 = no speaker)"""
+    names = sorted({s for s in speakers if s is not None})
+    lookup = {name: code for code, name in enumerate(names)}
+    codes = np.asarray([-1 if s is None else lookup[s] for s in speakers], dtype=LENGTH_DTYPE)
+    return {"speaker": codes, "speaker_names": np.asarray(names, dtype=str)}
+
+
+class ShardIndexBuilder:
+    """Collects the index entries of the lines of one shard while it is written"""
+
+    def __init__(self, num_layers: int):
+        self.num_layers = num_layers
+        self.token_lengths: List[List[int]] = []
+        self.text_lengths: List[int] = []
+        self.speakers: List[Optional[str]] = []
+
+    def add(self, rec: Dict[str, Any]) -> None:
+        """Adds the entry of the next line (the record the shard writer takes)"""
+        lengths = rec.get("token_lengths")
+        if lengths is None:
+            lengths = [len(rec[f"snac_layer_{i}"]) for i in range(1, self.num_layers + 1)]
+        self.token_lengths.append([int(n) for n in lengths])
+        self.text_lengths.append(len(rec.get("text") or ""))
+        speaker = rec.get("speaker")
+        self.speakers.append(None if speaker is None else str(speaker))
+
+    def write(self, shard_path: str, rows: List[int]) -> None:
+        """Writes the sidecar of a shard (call before the shard is renamed into place)"""
+        _save_npz(shard_path + INDEX_SUFFIX, {
+            "row": np.asarray(rows, dtype=np.int64),
+            "token_lengths": np.asarray(self.token_lengths, dtype=LENGTH_DTYPE).reshape(len(self.token_lengths),
+                                                                                        self.num_layers),
+            "text_lengths": np.asarray(self.text_lengths, dtype=LENGTH_DTYPE),
+            **_speaker_codes(self.speakers),
+        })
+
+
+def backfill_shard_index(shard_path: str) -> int:
+    """Writes the sidecar of a finished shard by reading it. Returns the number of lines"""
+    builder = None
+    for rec in iter_shard_records(shard_path):
+        if builder is None:
+            builder = ShardIndexBuilder(int(rec["num_layers"]))
+        builder.add(rec)
+    if builder is None:
+        builder = ShardIndexBuilder(0)
+    if os.path.exists(shard_path + MANIFEST_SUFFIX):
+        rows = list(decode_rows(ResumeManifest.read(shard_path)))
+    else:
+        rows = [-1] * len(builder.text_lengths)
+    builder.write(shard_path, rows)
+    return len(rows)
+
+
+def load_index(path: str) -> Dict[str, np.ndarray]:
+    """Loads an index (a shard sidecar or a merged dataset index) into memory"""
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def dataset_index_path(out_dir: str, prefix: str) -> str:
+    return os.path.join(out_dir, prefix + INDEX_SUFFIX)
+
+
+def find_dataset_indexes(out_dir: str) -> List[str]:
+    """Merged dataset indexes in OUT_DIR (without the shard sidecars), in name order"""
+    return sorted(p for p in glob.glob(os.path.join(out_dir, "*" + INDEX_SUFFIX))
+                  if not p[:-len(INDEX_SUFFIX)].endswith(SHARD_EXTENSIONS))
+
+
+def merge_indexes(parts: List[Dict[str, np.ndarray]], shard_names: List[str]) -> Dict[str, np.ndarray]:
+    """Concatenates shard sidecars (named by shard_names) or, without names, dataset indexes into one index"""
+    if shard_names:
+        parts = [{**part, "shards": np.asarray([name], dtype=str),
+                  "shard": np.zeros(len(part["row"]), dtype=LENGTH_DTYPE),
+                  "line": np.arange(len(part["row"]), dtype=LENGTH_DTYPE)}
+                 for part, name in zip(parts, shard_names)]
+    parts = [part for part in parts if len(part["row"])]
+    num_layers = {part["token_lengths"].shape[1] for part in parts}
+    if len(num_layers) > 1:
+        raise ValueError("❌ Indexes with different numbers of SNAC layers cannot be merged")
+    shards: List[str] = []
+    speakers: Dict[str, int] = {}
+    shard_ids, speaker_ids = [], []
+    for part in parts:
+        shard_ids.append(part["shard"] + len(shards))
+        shards.extend(part["shards"].tolist())
+        # The extra last entry maps "no speaker" (-1) to itself
+        remap = [speakers.setdefault(name, len(speakers)) for name in part["speaker_names"].tolist()] + [-1]
+        speaker_ids.append(np.asarray(remap, dtype=LENGTH_DTYPE)[part["speaker"]])
+
+    def cat(arrays, dtype, shape=(0,)):
+        return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(shape, dtype=dtype)
+
+    return {
+        "shards": np.asarray(shards, dtype=str),
+        "shard": cat(shard_ids, LENGTH_DTYPE),
+        "line": cat([part["line"] for part in parts], LENGTH_DTYPE),
+        "row": cat([part["row"] for part in parts], np.int64),
+        "token_lengths": cat([part["token_lengths"] for part in parts], LENGTH_DTYPE, (0, max(num_layers, default=0))),
+        "text_lengths": cat([part["text_lengths"] for part in parts], LENGTH_DTYPE),
+        "speaker": cat(speaker_ids, LENGTH_DTYPE),
+        "speaker_names": np.asarray(list(speakers), dtype=str),
+    }
+
+
+def write_dataset_index(out_dir: str, prefix: str) -> int:
+    """
+    Merges the shard sidecars of a dataset into OUT_DIR/<prefix>.index.npz, backfilling the
+    ones that are missing. Returns the number of samples
+    """
+    shards = match_shards(os.listdir(out_dir), prefix)
+    for name in shards:
+        path = os.path.join(out_dir, name)
+        if not os.path.exists(path + INDEX_SUFFIX):
+            backfill_shard_index(path)
+    index = merge_indexes([load_index(os.path.join(out_dir, name + INDEX_SUFFIX)) for name in shards], shards)
+    _save_npz(dataset_index_path(out_dir, prefix), index)
+    return len(index["row"])
+
+
+def sample_lengths(index: Dict[str, np.ndarray], key: str = "total") -> np.ndarray:
+    """Length of every sample by key: total (tokens of all layers), layer_N or text"""
+    if key == "total":
+        return index["token_lengths"].sum(axis=1, dtype=np.int64)
+    if key == "text":
+        return index["text_lengths"].astype(np.int64)
+    layer = int(key[len("layer_"):]) if key.startswith("layer_") and key[len("layer_"):].isdigit() else 0
+    if not 1 <= layer <= index["token_lengths"].shape[1]:
+        raise ValueError(f"❌ Unknown length key {key!r}, expected total, text or layer_1..layer_"
+                         f"{index['token_lengths'].shape[1]}")
+    return index["token_lengths"][:, layer - 1].astype(np.int64)
+
+
+def pack_samples(lengths: np.ndarray, max_tokens: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Packs samples into sequences of at most max_tokens, best fit decreasing: longest samples
+    first, each into the fullest sequence it still fits in. Samples longer than max_tokens get
+    a sequence of their own. Returns the sample indices in sequence order and the offsets of
+    the sequences into them
+    """
+    packs: List[List[int]] = []
+    # Sequences with room left, as sorted (free tokens, sequence) pairs
+    free: List[Tuple[int, int]] = []
+    for idx in np.argsort(-lengths, kind="stable").tolist():
+        length = int(lengths[idx])
+        pos = bisect.bisect_left(free, (length, -1))
+        if pos < len(free):
+            space, pack = free.pop(pos)
+            packs[pack].append(idx)
+            if space > length:
+                bisect.insort(free, (space - length, pack))
+            continue
+        packs.append([idx])
+        if length < max_tokens:
+            bisect.insort(free, (max_tokens - length, len(packs) - 1))
+    samples = np.fromiter((idx for pack in packs for idx in pack), dtype=np.int64, count=len(lengths))
+    return samples, np.cumsum([0] + [len(pack) for pack in packs], dtype=np.int64)
+
+
+def write_manifest(path: str, index: Dict[str, np.ndarray], lengths: np.ndarray,
+                   samples: np.ndarray, offsets: np.ndarray) -> None:
+    """
+    Writes a manifest of sequences of samples, as .npz (`shards`, and `shard`, `line` and
+    `length` of the samples in manifest order with the `offsets` of the sequences into them) or
+    .jsonl (one sequence per line: its samples as [shard, line] pairs and its total length)
+    """
+    if not path.endswith(".jsonl"):
+        _save_npz(path, {"shards": index["shards"], "shard": index["shard"][samples],
+                         "line": index["line"][samples], "length": lengths[samples], "offsets": offsets})
+        return
+    shards = index["shards"].tolist()
+    tmp = path + TMP_SUFFIX
+    with open(tmp, "w") as f:
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            seq = samples[start:end]
+            pairs = [[shards[s], int(line)] for s, line in zip(index["shard"][seq], index["line"][seq])]
+            f.write(json.dumps({"samples": pairs, "length": int(lengths[seq].sum())}) + "\n")
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build token-length indexes and length-sorted or packed manifests")
+    parser.add_argument("out_dir", help="Directory with finished shards (OUT_DIR)")
+    parser.add_argument("--prefix", action="append", default=None,
+                        help="Dataset prefix (repeatable; default: every dataset index in OUT_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="Merge (and backfill) the shard sidecars of datasets")
+    for name, help_text in (("sort", "Write a length-sorted manifest"), ("pack", "Write a packed-sequence manifest")):
+        cmd = commands.add_parser(name, help=help_text)
+        cmd.add_argument("dest", help="Manifest to write (.npz or .jsonl)")
+        cmd.add_argument("--key", default="total", help="Length to sort or pack by: total, layer_N or text")
+        if name == "sort":
+            cmd.add_argument("--descending", action="store_true")
+        else:
+            cmd.add_argument("--max-tokens", type=int, required=True, help="Length budget of a packed sequence")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if not args.prefix:
+            parser.error("build needs --prefix")
+        for prefix in args.prefix:
+            n = write_dataset_index(args.out_dir, prefix)
+            print(f"✅ Indexed {n:,} samples of {prefix}: {dataset_index_path(args.out_dir, prefix)}")
+        return
+
+    paths = [dataset_index_path(args.out_dir, p) for p in args.prefix] if args.prefix else find_dataset_indexes(args.out_dir)
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing or not paths:
+        parser.error(f"no dataset index {', '.join(missing) or 'in ' + args.out_dir}; run the build command first")
+    index = merge_indexes([load_index(p) for p in paths], [])
+    lengths = sample_lengths(index, args.key)
+    if args.command == "sort":
+        # Stable, so samples of equal length keep the dataset order
+        samples = np.argsort(-lengths if args.descending else lengths, kind="stable")
+        offsets = np.arange(len(samples) + 1, dtype=np.int64)
+    else:
+        samples, offsets = pack_samples(lengths, args.max_tokens)
+    write_manifest(args.dest, index, lengths, samples, offsets)
+    print(f"✅ {len(samples):,} samples of {len(paths)} dataset(s) in {len(offsets) - 1:,} sequence(s) "
+          f"written to {args.dest}")
+    if args.command == "pack":
+        fill = lengths.sum() / max((len(offsets) - 1) * args.max_tokens, 1)
+        print(f"📦 Sequences are {fill:.1%} full, {int((lengths > args.max_tokens).sum()):,} sample(s) "
+              f"longer than {args.max_tokens:,} tokens")
+
+
+if __name__ == "__main__":
+    main()
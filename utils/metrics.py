@@ -0,0 +1,476 @@
+"""
+Pipeline metrics: per-stage latency histograms, counters and gauges.
+
+Every reader and worker process records into its own `Metrics` registry and sends
+cumulative snapshots to the manager over a side-channel queue (`report_q`), together
+with item errors. Messages on that queue are `(kind, source, payload)` tuples, so
+other subsystems can use the same channel.
+
+The manager's `MetricsAggregator` keeps the latest snapshot of every source, samples
+queue depths, periodically exports `metrics.json` and `metrics.prom` (Prometheus text
+format) to the output directory, and writes `run_report.json` when the run ends.
+"""
+
+import json
+import math
+import multiprocessing as mp
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional, Tuple
+
+# Latency bucket upper bounds in seconds: 10 µs doubling up to ~22 min
+BUCKET_BOUNDS = [1e-5 * 2 ** k for k in range(28)]
+
+MAX_REPORTED_ERRORS = 200
+
+
+class Histogram:
+    """Fixed-bucket latency histogram that can be merged across processes"""
+
+    def __init__(self, counts: Optional[List[int]] = None, total: float = 0.0,
+                 count: int = 0, max_value: float = 0.0):
+        self.counts = counts or [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = total
+        self.count = count
+        self.max_value = max_value
+
+    def observe(self, value: float):
+        idx = 0 if value <= BUCKET_BOUNDS[0] else min(len(BUCKET_BOUNDS), math.ceil(math.log2(value / BUCKET_BOUNDS[0])))
+        self.counts[idx] += 1
+        self.total += value
+        self.count += 1
+        self.max_value = max(self.max_value, value)
+
+    def merge(self, other: "Histogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.count += other.count
+        self.max_value = max(self.max_value, other.max_value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bucket bound below which a fraction q of the observations fall"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(BUCKET_BOUNDS[idx], self.max_value) if idx < len(BUCKET_BOUNDS) else self.max_value
+        return self.max_value
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "total_s": round(self.total, 4),
+            "mean_s": round(self.total / self.count, 6) if self.count else 0.0,
+            "p50_s": round(self.quantile(0.5), 6),
+            "p90_s": round(self.quantile(0.9), 6),
+            "p99_s": round(self.quantile(0.99), 6),
+            "max_s": round(self.max_value, 6),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"counts": self.counts, "total": self.total, "count": self.count, "max": self.max_value}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Histogram":
+        return cls(list(d["counts"]), d["total"], d["count"], d["max"])
+
+
+class Metrics:
+    """Thread-safe registry of stage histograms, counters and gauges of one process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.started = time.time()
+
+    def observe(self, stage: str, seconds: float):
+        """Records the duration of one execution of a stage"""
+        with self.lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = Histogram()
+            hist.observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        """Times the enclosed block as one execution of a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Cumulative, picklable copy of all metrics"""
+        with self.lock:
+            return {
+                "started": self.started,
+                "uptime_s": time.time() - self.started,
+                "histograms": {k: h.to_dict() for k, h in self.histograms.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+
+def timed(metrics: Optional[Metrics], stage: str):
+    """Times a block if metrics are enabled (for components that may run without them)"""
+    return metrics.time(stage) if metrics is not None else nullcontext()
+
+
+class MetricsReporter:
+    """Sends a process's metrics snapshots and item errors to the manager"""
+
+    def __init__(self, report_q: Optional[mp.Queue], source: str, interval: float = 10.0):
+        self.report_q = report_q
+        self.source = source
+        self.interval = interval
+        self.metrics = Metrics()
+        self.last_report = time.monotonic()
+
+    def maybe_report(self):
+        """Sends a snapshot if the report interval has passed"""
+        if self.report_q is not None and self.interval > 0 and time.monotonic() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        """Sends a snapshot now"""
+        self.last_report = time.monotonic()
+        if self.report_q is not None:
+            self.report_q.put(("metrics", self.source, self.metrics.snapshot()))
+
+    def send(self, kind: str, payload: Dict[str, Any]):
+        """Sends a message of another kind over the report channel"""
+        if self.report_q is not None:
+            self.report_q.put((kind, self.source, payload))
+
+    def error(self, e: Exception, **context):
+        """Counts an item error and sends it with its traceback to the manager"""
+        self.metrics.inc("errors")
+        if self.report_q is not None:
+            self.report_q.put(("error", self.source, {
+                "time": time.time(),
+                "error": f"{type(e).__name__}: {e}",
+                "traceback": "".join(traceback.format_exception(type(e), e, e.__traceback__)),
+                **context,
+            }))
+
+    def dead_letter(self, e: Exception, stage: str, prefix: Optional[str], row: Optional[int],
+                    attempts: int = 1, **context):
+        """Reports an item that was given up on: counted as an error and written to the dead-letter log"""
+        self.error(e, stage=stage, prefix=prefix, row=row)
+        self.metrics.inc("dead_letters")
+        self.send("dead_letter", {
+            "time": time.time(),
+            "prefix": prefix,
+            "row": row,
+            "stage": stage,
+            "attempts": attempts,
+            "error": f"{type(e).__name__}: {e}",
+            **context,
+        })
+
+
+def _atomic_write(path: str, text: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _prom_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+class MetricsAggregator(threading.Thread):
+    """Collects snapshots and errors from report_q in the manager and exports them"""
+
+    # Bottleneck verdict thresholds on the mean sample queue fill and the workers' busy fraction
+    FULL_QUEUE = 0.5
+    EMPTY_QUEUE = 0.1
+    BUSY_WORKERS = 0.8
+
+    def __init__(self, report_q: mp.Queue, out_dir: str, interval: float = 10.0,
+                 queues: Optional[Dict[str, mp.Queue]] = None):
+        super().__init__(daemon=True)
+        self.report_q = report_q
+        self.out_dir = out_dir
+        self.interval = interval
+        self.queues = queues or {}
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        self.errors: List[Dict[str, Any]] = []
+        self.error_count = 0
+        self.handlers = {"metrics": self._on_metrics, "error": self._on_error}
+        self.queue_depth = {name: {"depth": 0, "sum": 0, "samples": 0, "max": 0} for name in self.queues}
+        self.started = time.time()
+
+    def add_handler(self, kind: str, handler):
+        """Routes report_q messages of another kind to a handler(source, payload)"""
+        self.handlers[kind] = handler
+
+    def _on_metrics(self, source: str, payload: Dict[str, Any]):
+        self.sources[source] = payload
+
+    def _on_error(self, source: str, payload: Dict[str, Any]):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"source": source, **payload})
+
+    def _sample_queues(self):
+        for name, q in self.queues.items():
+            try:
+                depth = q.qsize()
+            except (NotImplementedError, OSError):
+                continue
+            stats = self.queue_depth[name]
+            stats["depth"] = depth
+            stats["sum"] += depth
+            stats["samples"] += 1
+            stats["max"] = max(stats["max"], depth)
+            if hasattr(q, "fill"):
+                stats["fill"] = q.fill()
+                stats["fill_sum"] = stats.get("fill_sum", 0.0) + stats["fill"]["fraction"]
+                stats["fill_samples"] = stats.get("fill_samples", 0) + 1
+
+    def run(self):
+        next_export = time.monotonic() + self.interval if self.interval > 0 else math.inf
+        next_sample = time.monotonic()
+        while True:
+            try:
+                msg = self.report_q.get(timeout=1.0)
+                if msg is None:
+                    break
+                self._handle(msg)
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if now >= next_sample:
+                self._sample_queues()
+                next_sample = now + 1.0
+            if now >= next_export:
+                self.export()
+                next_export = now + self.interval
+        self._drain()
+
+    def _handle(self, msg):
+        kind, source, payload = msg
+        handler = self.handlers.get(kind)
+        if handler is not None:
+            handler(source, payload)
+
+    def _drain(self):
+        while True:
+            try:
+                msg = self.report_q.get_nowait()
+            except queue.Empty:
+                return
+            if msg is not None:
+                self._handle(msg)
+
+    def stop(self) -> Dict[str, Any]:
+        """Stops collecting, exports the final metrics and writes the run report"""
+        self.report_q.put(None)
+        self.join(timeout=30)
+        self._drain()
+        self.export()
+        report = self.run_report()
+        _atomic_write(os.path.join(self.out_dir, "run_report.json"), json.dumps(report, indent=2))
+        return report
+
+    def _merged(self, role: Optional[str] = None) -> Dict[str, Any]:
+        """Merges the snapshots of all sources (or of one role, e.g. "reader")"""
+        histograms: Dict[str, Histogram] = {}
+        counters: Dict[str, float] = {}
+        for source, snap in self.sources.items():
+            if role is not None and not source.startswith(role):
+                continue
+            for name, d in snap["histograms"].items():
+                histograms.setdefault(name, Histogram()).merge(Histogram.from_dict(d))
+            for name, v in snap["counters"].items():
+                counters[name] = counters.get(name, 0) + v
+        return {"histograms": histograms, "counters": counters}
+
+    def stage_windows(self, role: str, stage: str) -> Dict[str, Tuple[float, float]]:
+        """Seconds each source of a role has spent in a stage, with its uptime at that snapshot"""
+        windows = {}
+        for source, snap in list(self.sources.items()):
+            if source.startswith(role):
+                hist = snap["histograms"].get(stage)
+                windows[source] = (hist["total"] if hist else 0.0, snap["uptime_s"])
+        return windows
+
+    def _source_summary(self, snap: Dict[str, Any]) -> Dict[str, Any]:
+        uptime = max(snap["uptime_s"], 1e-9)
+        counters = snap["counters"]
+        return {
+            "uptime_s": round(snap["uptime_s"], 2),
+            "counters": counters,
+            "gauges": snap["gauges"],
+            "items_per_s": round(counters.get("items", 0) / uptime, 3),
+            "audio_seconds_per_s": round(counters.get("audio_seconds", 0) / uptime, 3),
+            "stages": {k: Histogram.from_dict(d).summary() for k, d in snap["histograms"].items()},
+        }
+
+    def queue_fill(self, name: str = "samples") -> Optional[float]:
+        """Mean fill fraction of a queue over the run so far (None if it was never sampled)"""
+        stats = self.queue_depth.get(name, {})
+        if not stats.get("fill_samples"):
+            return None
+        return stats["fill_sum"] / stats["fill_samples"]
+
+    def worker_busy(self) -> Optional[float]:
+        """Fraction of the workers' time spent encoding, not counting idle time between datasets and runs"""
+        encode = idle = uptime = 0.0
+        for source, snap in list(self.sources.items()):
+            if not source.startswith("worker"):
+                continue
+            histograms = snap["histograms"]
+            encode += histograms["encode"]["total"] if "encode" in histograms else 0.0
+            idle += histograms["idle_wait"]["total"] if "idle_wait" in histograms else 0.0
+            uptime += snap["uptime_s"]
+        if uptime - idle <= 0:
+            return None
+        return min(1.0, encode / (uptime - idle))
+
+    def _bottleneck(self) -> str:
+        """
+        Guesses the limiting side from how full the sample queue stayed and how busy the
+        workers were: a full queue or busy workers mean the encoders cannot keep up, an
+        empty queue with idle workers means the readers cannot
+        """
+        fill = self.queue_fill()
+        busy = self.worker_busy()
+        if fill is None and busy is None:
+            return "unknown"
+        if (fill is not None and fill >= self.FULL_QUEUE) or (busy is not None and busy >= self.BUSY_WORKERS):
+            return "encoder-bound"
+        if fill is None or fill <= self.EMPTY_QUEUE:
+            return "reader-bound"
+        return "balanced"
+
+    @staticmethod
+    def _cache_summary(counters: Dict[str, float]) -> Dict[str, Any]:
+        """Hit rate and encode time saved by the encode cache"""
+        hits = int(counters.get("cache_hits", 0))
+        lookups = hits + int(counters.get("cache_misses", 0))
+        return {
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "encode_s_saved": round(counters.get("cache_saved_s", 0.0), 2),
+        }
+
+    @staticmethod
+    def _filter_summary(counters: Dict[str, float]) -> Dict[str, Any]:
+        """Items the readers' filters dropped per reason, and the silence they trimmed"""
+        return {
+            "dropped": {name[len("filtered_"):]: int(n) for name, n in sorted(counters.items())
+                        if name.startswith("filtered_")},
+            "trimmed_seconds": round(counters.get("trimmed_seconds", 0.0), 2),
+        }
+
+    @staticmethod
+    def _precision_check_summary(counters: Dict[str, float]) -> Dict[str, Any]:
+        """Per-layer rate of tokens that differ from float32 eager codes in the workers' precision check"""
+        summary = {}
+        layer = 1
+        while f"check_tokens_layer_{layer}" in counters:
+            total = int(counters[f"check_tokens_layer_{layer}"])
+            mismatched = int(counters.get(f"check_mismatch_layer_{layer}", 0))
+            summary[f"snac_layer_{layer}"] = {
+                "tokens": total,
+                "mismatched": mismatched,
+                "mismatch_rate": round(mismatched / total, 6) if total else 0.0,
+            }
+            layer += 1
+        return summary
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current aggregated view of all sources"""
+        totals = {}
+        for role in ("reader", "worker"):
+            merged = self._merged(role)
+            totals[role] = {
+                "counters": merged["counters"],
+                "stages": {k: h.summary() for k, h in merged["histograms"].items()},
+            }
+        return {
+            "time": time.time(),
+            "elapsed_s": round(time.time() - self.started, 2),
+            "bottleneck": self._bottleneck(),
+            "sample_queue_fill": round(self.queue_fill() or 0.0, 4),
+            "worker_busy": round(self.worker_busy() or 0.0, 4),
+            "queues": {
+                name: {"depth": stats["depth"],
+                       "mean_depth": round(stats["sum"] / stats["samples"], 1) if stats["samples"] else 0.0,
+                       "max_depth": stats["max"],
+                       **({"fill": stats["fill"]} if "fill" in stats else {})}
+                for name, stats in self.queue_depth.items()
+            },
+            "totals": totals,
+            "encode_cache": self._cache_summary(totals["worker"]["counters"]),
+            "precision_check": self._precision_check_summary(totals["worker"]["counters"]),
+            "filtered": self._filter_summary(totals["reader"]["counters"]),
+            "sources": {source: self._source_summary(snap) for source, snap in sorted(self.sources.items())},
+            "error_count": self.error_count,
+            "dead_letter_count": int(sum(totals[role]["counters"].get("dead_letters", 0)
+                                         for role in ("reader", "worker"))),
+        }
+
+    def prometheus(self) -> str:
+        """Renders all sources in the Prometheus text exposition format"""
+        lines = ["# TYPE snac_stage_seconds histogram"]
+        counter_lines, gauge_lines = [], []
+        for source, snap in sorted(self.sources.items()):
+            for stage, d in sorted(snap["histograms"].items()):
+                hist = Histogram.from_dict(d)
+                labels = f'source="{source}",stage="{stage}"'
+                cumulative = 0
+                for bound, n in zip(BUCKET_BOUNDS, hist.counts):
+                    cumulative += n
+                    lines.append(f'snac_stage_seconds_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'snac_stage_seconds_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"snac_stage_seconds_sum{{{labels}}} {hist.total}")
+                lines.append(f"snac_stage_seconds_count{{{labels}}} {hist.count}")
+            for name, v in sorted(snap["counters"].items()):
+                counter_lines.append(f'snac_{_prom_name(name)}_total{{source="{source}"}} {v}')
+            for name, v in sorted(snap["gauges"].items()):
+                gauge_lines.append(f'snac_{_prom_name(name)}{{source="{source}"}} {v}')
+            gauge_lines.append(f'snac_uptime_seconds{{source="{source}"}} {snap["uptime_s"]}')
+        for name, stats in sorted(self.queue_depth.items()):
+            gauge_lines.append(f'snac_queue_depth{{queue="{name}"}} {stats["depth"]}')
+            if "fill" in stats:
+                gauge_lines.append(f'snac_queue_bytes{{queue="{name}"}} {stats["fill"]["bytes"]}')
+                gauge_lines.append(f'snac_queue_audio_seconds{{queue="{name}"}} {stats["fill"]["seconds"]}')
+                gauge_lines.append(f'snac_queue_fill{{queue="{name}"}} {stats["fill"]["fraction"]}')
+        gauge_lines.append(f"snac_errors {self.error_count}")
+        return "\n".join(lines + counter_lines + gauge_lines) + "\n"
+
+    def export(self):
+        """Writes metrics.json and metrics.prom to the output directory"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        _atomic_write(os.path.join(self.out_dir, "metrics.json"), json.dumps(self.snapshot(), indent=2))
+        _atomic_write(os.path.join(self.out_dir, "metrics.prom"), self.prometheus())
+
+    def run_report(self) -> Dict[str, Any]:
+        """Final report: aggregated metrics plus the first item errors"""
+        report = self.snapshot()
+        report["errors"] = self.errors
+        return report
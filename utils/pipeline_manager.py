@@ -1,146 +1,450 @@
 import torch
 import multiprocessing as mp
 import os
-from datasets import load_dataset, concatenate_datasets
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from utils.config_manager import ConfigManager, DatasetConfig
 from utils.dataset_processor import DatasetProcessor
 from utils.audio_worker import worker_process, AudioWorker
-from utils.reader_worker import reader_worker_process
+from utils.reader_worker import reader_worker_process, ReadTask
+from utils.scheduler import ReaderAutoscaler, ReaderPool
+from utils.run_scheduler import RunScheduler
+from utils.shm_transport import SharedWaveTransport, owner_tag
+from utils.sample_queue import BudgetedQueue
+from utils.resume_manifest import INDEX_SUFFIX, ResumeManifest
+from utils.length_index import write_dataset_index
+from utils.shard_writer import get_shard_writer, match_shards
+from utils.metrics import MetricsAggregator
+from utils.snac_codec import MODEL_CACHE_DIR, PRECISIONS, cache_model
+from utils.assembly import ShardAssembler
+from utils.token_store import convert_shards, find_shards
+from utils.work_ledger import LEDGER_DIR, WorkLedger
+from utils.supervision import DEAD_LETTER_FILE, DeadLetterLog, WorkerSupervisor
+from utils.audio_filters import DEDUP_MODES, AudioFilter, DedupManager, FilterLog
 
 
 class PipelineManager:
     """Manages the entire audio processing pipeline"""
 
-    def __init__(self, config_path: str = "config.yaml"):
-        self.config_manager = ConfigManager(config_path)
+    def __init__(self, config_path: str = "config.yaml", overrides: Optional[dict] = None):
+        self.config_manager = ConfigManager(config_path, overrides)
         self.base_settings = self.config_manager.get_base_settings()
         self.save_settings = self.config_manager.get_save_settings()
+        self.filter_settings = self.config_manager.get_filter_settings()
         self.sample_rate = self.config_manager.get_sample_rate()
         self.num_layers = self.config_manager.get_num_layers()
         self.num_gpus = torch.cuda.device_count()
+        if self.base_settings.gpu_workers >= 0:
+            self.num_gpus = min(self.num_gpus, self.base_settings.gpu_workers)
+        self.devices = (
+            [f"cuda:{i}" for i in range(self.num_gpus)]
+            + [f"cpu:{i}" for i in range(self.base_settings.cpu_workers)]
+        )
 
         os.makedirs(self.base_settings.OUT_DIR, exist_ok=True)
 
+        # Multi-node runs share OUT_DIR; the nodes split the work through a lease ledger
+        self.node_rank = self.base_settings.node_rank
+        self.ledger: Optional[WorkLedger] = None
+        self.node_tag = ""
+        self.metrics_dir = self.base_settings.OUT_DIR
+        if self.base_settings.num_nodes > 1:
+            self.node_tag = f"node{self.node_rank:02d}"
+            self.metrics_dir = os.path.join(self.base_settings.OUT_DIR, self.node_tag)
+            ledger_dir = self.base_settings.ledger_dir or os.path.join(self.base_settings.OUT_DIR, LEDGER_DIR)
+            self.ledger = WorkLedger(ledger_dir, self.node_rank, self.base_settings.num_nodes,
+                                     self.base_settings.lease_seconds)
+        self.dead_letters = DeadLetterLog(self.base_settings.dead_letter_path
+                                          or os.path.join(self.metrics_dir, DEAD_LETTER_FILE))
+        self.filtered = FilterLog()
+
+        # Workers load the codec weights memory-mapped from here instead of from the Hub
+        self.model_cache_dir = self.base_settings.model_cache_dir or os.path.join(self.base_settings.OUT_DIR,
+                                                                                  MODEL_CACHE_DIR)
+
+        # Created by the node that assembles the final dataset only (see _get_assembler)
+        self.assembler: Optional[ShardAssembler] = None
+
+    def _get_assembler(self) -> ShardAssembler:
+        """The shard assembler, created on first use so that other nodes never make OUT_DIR/_arrow"""
+        if self.assembler is None:
+            self.assembler = ShardAssembler(self.base_settings.OUT_DIR, self.num_layers,
+                                            self.base_settings.assembly_workers, self.base_settings.compact_tokens)
+        return self.assembler
+
     def validate(self):
         """Validate configuration and environment"""
         print("🔍 Validating configuration...")
         self.config_manager.validate_datasets()
-
-        if self.num_gpus == 0:
-            raise RuntimeError("❌ ERROR: No CUDA devices found!")
-
-        print(f"✅ Found {self.num_gpus} GPU(s)")
+        get_shard_writer(self.base_settings.shard_format)
+
+        if not self.devices:
+            raise RuntimeError("❌ ERROR: No CUDA devices found and no CPU workers configured!")
+        if self.base_settings.precision not in PRECISIONS:
+            raise ValueError(f"❌ Unknown precision {self.base_settings.precision!r}, "
+                             f"expected one of {', '.join(PRECISIONS)}")
+        if self.filter_settings.dedup not in DEDUP_MODES:
+            raise ValueError(f"❌ Unknown dedup mode {self.filter_settings.dedup!r}, "
+                             f"expected one of {', '.join(DEDUP_MODES)}")
+        if not 0 <= self.filter_settings.dedup_bit_error_rate < 0.5:
+            raise ValueError("❌ dedup_bit_error_rate must be at least 0 and below 0.5")
+        if not 0 <= self.node_rank < self.base_settings.num_nodes:
+            raise ValueError(f"❌ node_rank {self.node_rank} is out of range for {self.base_settings.num_nodes} node(s)")
+
+        print(f"✅ Using {self.num_gpus} GPU(s) and {self.base_settings.cpu_workers} CPU worker(s)")
         print(f"✅ Sample rate: {self.sample_rate} Hz")
         print(f"✅ SNAC layers: {self.num_layers}")
 
-    def process_single_dataset(self, dataset_config: DatasetConfig):
-        """Process a single dataset through the pipeline"""
-        print(f"\n{'='*60}")
-        print(f"🎯 Processing dataset: {dataset_config.name}")
-        print(f"📝 Dataset prefix: {dataset_config.dataset_prefix}")
-        print(f"{'='*60}")
-
-        processor = DatasetProcessor(dataset_config, self.sample_rate)
+    def _plan_tasks(self, processor: DatasetProcessor, prefix: str):
+        """
+        Cut the dataset into read tasks, leaving out rows a previous run already encoded.
+        Returns the list of tasks, or None if nothing is left to do.
+        """
+        num_readers = self.base_settings.num_readers
+        manifest = ResumeManifest(self.base_settings.OUT_DIR)
+        completed = manifest.completed_ranges(prefix) if self.base_settings.resume else []
+        if self.base_settings.resume:
+            done = sum(end - start for start, end in completed)
+            print(f"⏩ Resume: {done:,} rows already encoded")
+
+        if processor.streaming:
+            # Streamed rows are numbered per partition, so the partitions stay fixed to num_readers
+            return [ReadTask(prefix, processor.for_reader(i, num_readers, completed), None)
+                    for i in range(num_readers)]
+
+        task_ranges = processor.task_ranges(max(1, self.base_settings.task_rows), completed)
+        if not task_ranges:
+            return None
+        return [ReadTask(prefix, None, [row_range]) for row_range in task_ranges]
+
+    def _plan_units(self, processor: DatasetProcessor, prefix: str):
+        """
+        Agrees on the dataset's work units with the other nodes: row ranges of task_rows rows,
+        or num_readers partitions per node of a streamed dataset
+        """
+        if processor.streaming:
+            partitions = self.base_settings.num_readers * self.base_settings.num_nodes
+            proposal = {"num_rows": None, "streaming": True, "units": list(range(partitions))}
+        else:
+            units = processor.task_ranges(max(1, self.base_settings.task_rows))
+            proposal = {"num_rows": len(processor.get_dataset()), "streaming": False, "units": units}
+        return self.ledger.plan(prefix, proposal)
+
+    def _worker_tag(self, rank: int) -> str:
+        """Shard name tag of a worker rank (as AudioWorker.shard_tag)"""
+        tag = f"worker{rank:02d}"
+        return f"{self.node_tag}-{tag}" if self.node_tag else tag
+
+    def _load_processor(self, dataset_config: DatasetConfig) -> DatasetProcessor:
+        """Load a dataset (runs on the prefetch thread while the previous dataset is encoding)"""
+        processor = DatasetProcessor(dataset_config, self.sample_rate,
+                                     streaming=self.base_settings.streaming,
+                                     fast_decode=self.base_settings.fast_decode,
+                                     decode_threads=self.base_settings.decode_threads,
+                                     pcm_cache_dir=self.base_settings.pcm_cache_dir)
         processor.load_dataset(num_proc=self.base_settings.load_dataset_num_proc)
+        return processor
 
-        mp.set_start_method("spawn", force=True)
-        q = mp.Queue(maxsize=self.base_settings.qsize)
-
+    def _print_settings(self, transport):
+        """Print the pipeline settings"""
         print(f"\n🚀 Starting processing pipeline")
         print(f"💻 CUDA available: {torch.cuda.is_available()}")
-        print(f"🔥 GPU workers: {self.num_gpus}")
-        print(f"📖 Reader workers: {self.base_settings.num_readers}")
+        if self.ledger is not None:
+            print(f"🌐 Node {self.node_rank} of {self.base_settings.num_nodes}, work ledger: {self.ledger.ledger_dir}")
+        print(f"🔥 GPU workers: {self.num_gpus} ({self.base_settings.gpu_threads_per_worker} thread(s) each)")
+        if self.base_settings.cpu_workers:
+            threads = self.base_settings.cpu_workers * self.base_settings.cpu_threads_per_worker
+            print(f"🧮 CPU workers: {self.base_settings.cpu_workers} "
+                  f"({self.base_settings.cpu_threads_per_worker} thread(s) each, {threads}/{os.cpu_count()} cores)")
+        if self.base_settings.max_readers > self.base_settings.num_readers:
+            print(f"📖 Reader workers: {self.base_settings.num_readers} "
+                  f"(autoscaled between {self.base_settings.min_readers} and {self.base_settings.max_readers})")
+        else:
+            print(f"📖 Reader workers: {self.base_settings.num_readers}")
+        if self.base_settings.fast_decode:
+            cache = f", PCM cache: {self.base_settings.pcm_cache_dir}" if self.base_settings.pcm_cache_dir else ""
+            print(f"🎧 Reader decoding: {self.base_settings.decode_threads} thread(s) per reader{cache}")
+        print(f"🧩 Rows per read task: {self.base_settings.task_rows:,}")
         print(f"⚙️  Dataset load processes: {self.base_settings.load_dataset_num_proc}")
         print(f"📁 Output directory: {self.base_settings.OUT_DIR}")
         print(f"🗂️  Lines per file: {self.base_settings.lines_per_file:,}")
+        print(f"🧾 Shard format: {self.base_settings.shard_format}")
         print(f"📦 Queue size: {self.base_settings.qsize}")
+        budget = []
+        if self.base_settings.queue_max_bytes:
+            budget.append(f"{self.base_settings.queue_max_bytes / 1024**3:.1f} GB")
+        if self.base_settings.queue_max_seconds:
+            budget.append(f"{self.base_settings.queue_max_seconds / 3600:.1f} h of audio")
+        if budget:
+            print(f"⚖️  Queue budget: {' / '.join(budget)}")
+        if self.base_settings.slow_lane_seconds:
+            print(f"🐢 Slow lane: clips over {self.base_settings.slow_lane_seconds:g} s")
+        if self.base_settings.sort_window:
+            print(f"🔀 Reader sort window: {self.base_settings.sort_window} items")
+        print(f"🧺 Max batch size: {self.base_settings.max_batch_size}")
+        if self.base_settings.encode_cache_path:
+            print(f"💾 Encode cache: {self.base_settings.encode_cache_path} "
+                  f"(up to {self.base_settings.encode_cache_bytes / 1024**3:.1f} GB)")
+        if self.base_settings.precision != "fp32" or self.base_settings.compile_model:
+            compiled = f", torch.compile ({self.base_settings.compile_mode})" if self.base_settings.compile_model else ""
+            print(f"🚀 Inference: {self.base_settings.precision}{compiled}")
+        if transport is not None:
+            print(f"🧠 Shared-memory transport: {self.base_settings.shm_slab_bytes / 1024**2:.0f} MB per reader")
+        filters = self._describe_filters()
+        if filters:
+            print(f"🎚️  Filters: {', '.join(filters)}")
         print("-" * 60)
 
-        workers = [
-            mp.Process(
-                target=worker_process,
-                args=(
-                    i,
-                    q,
-                    self.base_settings.OUT_DIR,
-                    dataset_config.dataset_prefix,
-                    self.base_settings.gzip_level,
-                    self.base_settings.buffer_size,
-                    self.base_settings.lines_per_file,
-                    self.base_settings.num_readers,
-                    self.base_settings.audio_codec,
-                    self.num_layers
+    def _describe_filters(self) -> List[str]:
+        """The pre-encode filters that are on, in words"""
+        f = self.filter_settings
+        filters = []
+        if f.trim_silence_db is not None:
+            filters.append(f"trim silence below {f.trim_silence_db:g} dB")
+        if f.min_seconds or f.max_seconds:
+            filters.append(f"{f.min_seconds:g}-{f.max_seconds or float('inf'):g} s")
+        if f.silence_db is not None:
+            filters.append(f"silent below {f.silence_db:g} dB")
+        if f.max_clipped_fraction:
+            filters.append(f"clipped over {f.max_clipped_fraction:.2%}")
+        if f.dedup != "off":
+            filters.append(f"{f.dedup} dedup")
+        return filters
+
+    def _print_summary(self, datasets: List[DatasetConfig]):
+        """Print the number and size of the shards written for each dataset"""
+        if not os.path.exists(self.base_settings.OUT_DIR):
+            return
+        out_files = os.listdir(self.base_settings.OUT_DIR)
+        for dataset_config in datasets:
+            prefix = dataset_config.dataset_prefix
+            files = match_shards(out_files, prefix)
+            if files:
+                total_size = sum(
+                    os.path.getsize(os.path.join(self.base_settings.OUT_DIR, f))
+                    for f in files
                 )
+                print(f"📊 {prefix}: {len(files)} files, size: {total_size / 1024**3:.2f} GB")
+
+    def process_datasets(self, datasets: List[DatasetConfig]):
+        """
+        Encode all datasets with one persistent pool of readers and GPU workers.
+
+        Each dataset is cut into small row range tasks on a shared task queue, and readers
+        take the next task whenever they finish one, so readers that hit slow rows do not
+        hold up the end of a dataset. With max_readers set, the reader pool is resized
+        while running to keep the sample queue fed without oversubscribing the CPU.
+
+        While dataset N is being read and encoded, dataset N+1 is loaded on a background
+        thread, so the GPUs do not sit idle between datasets. Once every task of dataset N
+        is read, each worker is sent a DatasetEnd to finalize that dataset's shards.
+
+        Workers that crash are restarted, and the rows a crash lost are read again once the
+        affected datasets are finalized (see utils.supervision).
+        """
+        mp.set_start_method("spawn", force=True)
+        dedup_manager, seen = None, None
+        if self.filter_settings.dedup != "off":
+            # Clip hashes shared by all readers, so duplicates are found across readers and datasets
+            dedup_manager = DedupManager()
+            dedup_manager.start()
+            if self.filter_settings.dedup == "exact":
+                seen = dedup_manager.dict()
+            else:
+                seen = dedup_manager.FingerprintIndex(self.filter_settings.dedup_bit_error_rate)
+        filters = AudioFilter(self.filter_settings, self.sample_rate, seen)
+        q = BudgetedQueue(self.base_settings.qsize, self.base_settings.queue_max_bytes,
+                          self.base_settings.queue_max_seconds, self.base_settings.slow_lane_seconds,
+                          consumers=len(self.devices))
+        task_q = mp.Queue()
+        done_q = mp.Queue()
+        report_q = mp.Queue()
+        num_readers = self.base_settings.num_readers
+        max_readers = max(num_readers, self.base_settings.max_readers)
+
+        manifest = ResumeManifest(self.base_settings.OUT_DIR)
+        removed = sum(manifest.cleanup(d.dataset_prefix, self.node_tag) for d in datasets)
+        if removed:
+            print(f"🧹 Removed {removed} unfinished file(s) from a previous run")
+
+        # Loaded once here, so every worker memory-maps the weights instead of loading the checkpoint
+        model_path = cache_model(self.base_settings.audio_codec, self.model_cache_dir)
+
+        transport = None
+        if self.base_settings.shm_transport:
+            transport = SharedWaveTransport(max_readers, self.base_settings.shm_slab_bytes)
+
+        self._print_settings(transport)
+        print(f"🧊 Model cache: {model_path}")
+
+        aggregator = MetricsAggregator(report_q, self.metrics_dir,
+                                       self.base_settings.metrics_interval,
+                                       queues={"samples": q, "tasks": task_q})
+        if self.node_rank == 0:
+            aggregator.add_handler("shard", self._get_assembler().on_shard)
+        aggregator.add_handler("dead_letter", self.dead_letters.on_dead_letter)
+        aggregator.add_handler("filtered", self.filtered.on_filtered)
+        if self.ledger is not None:
+            released = self.ledger.recover([d.dataset_prefix for d in datasets])
+            if released:
+                print(f"♻️  Reclaiming {released} unit(s) this node held before it stopped")
+            self.ledger.start()
+        aggregator.start()
+
+        def spawn_worker(rank: int, generation: int) -> mp.Process:
+            return mp.Process(
+                target=worker_process,
+                args=(rank, q, self.base_settings, self.num_layers, self.devices[rank],
+                      transport.reader(owner_tag(rank, generation)) if transport is not None else None,
+                      report_q, generation)
             )
-            for i in range(self.num_gpus)
-        ]
-
-        for p in workers:
-            p.start()
-
-        dataset = processor.get_dataset()
-        sharded_datasets = [
-            dataset.shard(num_shards=self.base_settings.num_readers, index=i)
-            for i in range(self.base_settings.num_readers)
-        ]
-
-        shard_processors = []
-        for i in range(self.base_settings.num_readers):
-            shard_proc = DatasetProcessor(dataset_config, self.sample_rate)
-            shard_proc.dataset = sharded_datasets[i]
-            shard_processors.append(shard_proc)
-
-        readers = [
-            mp.Process(
+
+        workers = WorkerSupervisor(len(self.devices), spawn_worker, self.base_settings.max_worker_restarts)
+        workers.start_all()
+
+        def spawn_reader(reader_id: int, control_q: mp.Queue, generation: int) -> mp.Process:
+            return mp.Process(
                 target=reader_worker_process,
-                args=(i, self.base_settings.num_readers, shard_processors[i], q)
+                args=(reader_id, task_q, control_q, q, done_q,
+                      transport.writer(reader_id) if transport is not None else None,
+                      report_q, self.base_settings.metrics_interval, generation,
+                      self.base_settings.sort_window, filters)
             )
-            for i in range(self.base_settings.num_readers)
-        ]
-
-        for pr in readers:
-            pr.start()
 
+        readers = ReaderPool(max_readers, spawn_reader)
+        for i in range(num_readers):
+            readers.start(i)
+
+        # Readers that exit unexpectedly are replaced up to the pool's lower bound
+        min_readers = num_readers
+        autoscaler = None
+        if max_readers > num_readers:
+            min_readers = min(num_readers, max(1, self.base_settings.min_readers))
+            autoscaler = ReaderAutoscaler(readers, q, self.base_settings.qsize,
+                                          self.base_settings.autoscale_interval,
+                                          min_readers, aggregator)
+
+        scheduler = RunScheduler(self.base_settings, q, task_q, done_q, readers, workers, autoscaler, min_readers,
+                                 [d.dataset_prefix for d in datasets], self._worker_tag,
+                                 self.dead_letters, self.filtered, self.ledger, transport)
+        aggregator.add_handler("dataset_end", scheduler.on_dataset_end)
+
+        loader = ThreadPoolExecutor(max_workers=1)
         try:
-            for pr in readers:
-                pr.join()
-
-            for i in range(self.num_gpus):
-                q.put(AudioWorker.SENTINEL)
-
-            for p in workers:
-                p.join()
+            pending = loader.submit(self._load_processor, datasets[0]) if datasets else None
+
+            for idx, dataset_config in enumerate(datasets, 1):
+                print(f"\n{'='*60}")
+                print(f"🎯 Processing dataset {idx}/{len(datasets)}: {dataset_config.name}")
+                print(f"📝 Dataset prefix: {dataset_config.dataset_prefix}")
+                print(f"{'='*60}")
+
+                processor = pending.result()
+                pending = loader.submit(self._load_processor, datasets[idx]) if idx < len(datasets) else None
+                scheduler.add_dataset(dataset_config.dataset_prefix, processor)
+
+                if self.ledger is not None:
+                    prefix = dataset_config.dataset_prefix
+                    plan = self._plan_units(processor, prefix)
+                    completed = ResumeManifest(self.base_settings.OUT_DIR).completed_ranges(prefix) \
+                        if self.base_settings.resume else []
+                    n, num_tasks, units = scheduler.read_leased(prefix, processor, completed)
+                    scheduler.end_dataset(prefix, units)
+                    scheduler.settle(block=False)
+                    print(f"📤 Node {self.node_rank} read {len(units):,}/{len(plan['units']):,} unit(s) "
+                          f"of {dataset_config.name} ({n:,} items in {num_tasks:,} tasks)")
+                    continue
+
+                tasks = self._plan_tasks(processor, dataset_config.dataset_prefix)
+                if tasks is None:
+                    print(f"⏭️  Dataset {dataset_config.name} is already fully encoded, skipping")
+                    continue
+
+                n = scheduler.read_tasks(dataset_config.dataset_prefix, tasks)
+                scheduler.end_dataset(dataset_config.dataset_prefix)
+                scheduler.settle(block=False)
+
+                print(f"📤 Dataset {dataset_config.name} fully read ({n:,} items in {len(tasks):,} tasks)")
+
+            if self.ledger is not None:
+                # Stay until every unit is done, taking over the units of nodes that stop heartbeating
+                print(f"\n⏳ Node {self.node_rank} waiting for the other nodes to finish their units")
+                while not all(self.ledger.is_done(prefix) for prefix in scheduler.processors):
+                    scheduler.settle(block=False)
+                    took_over = False
+                    for prefix, processor in scheduler.processors.items():
+                        if self.ledger.is_done(prefix):
+                            continue
+                        n, _, units = scheduler.read_leased(prefix, processor, [])
+                        if units:
+                            scheduler.end_dataset(prefix, units)
+                            took_over = True
+                            print(f"🔁 Took over {len(units):,} unit(s) of {prefix} ({n:,} items)")
+                    if not took_over:
+                        # Waiting also keeps the worker pool supervised
+                        scheduler.wait(min(5.0, self.base_settings.lease_seconds / 4))
+
+            # Rows lost in crashes are read again before the workers are stopped
+            scheduler.settle(block=True)
+            readers.stop()
+            workers.stop(q, AudioWorker.SENTINEL)
+            if self.base_settings.length_index and self.node_rank == 0:
+                # Every node's shards are finished once the ledger is done, so node 0 sees them all
+                indexed = sum(write_dataset_index(self.base_settings.OUT_DIR, d.dataset_prefix) for d in datasets)
+                print(f"📏 Length index of {indexed:,} samples written to "
+                      f"{os.path.join(self.base_settings.OUT_DIR, '<prefix>' + INDEX_SUFFIX)}")
 
             print("\n" + "=" * 60)
-            print(f"🎉 Dataset {dataset_config.name} processed successfully!")
-
-            if os.path.exists(self.base_settings.OUT_DIR):
-                files = [f for f in os.listdir(self.base_settings.OUT_DIR)
-                        if f.startswith(dataset_config.dataset_prefix)]
-                if files:
-                    total_size = sum(
-                        os.path.getsize(os.path.join(self.base_settings.OUT_DIR, f))
-                        for f in files
-                    )
-                    print(f"📊 Generated {len(files)} files for this dataset, "
-                          f"size: {total_size / 1024**3:.2f} GB")
-
-        except KeyboardInterrupt:
-            print("\n⚠️  Interrupted! Terminating processes...")
-
-            for pr in readers:
-                pr.terminate()
-            for p in workers:
-                p.terminate()
-
-            for pr in readers:
-                pr.join(timeout=10)
-            for p in workers:
-                p.join(timeout=10)
+            print(f"🎉 All datasets processed successfully!")
+            self._print_summary(datasets)
+            if workers.restarts:
+                print(f"💥 {workers.restarts} worker restart(s)")
+            if self.dead_letters.count:
+                print(f"🪦 {self.dead_letters.count} sample(s) dead-lettered: {self.dead_letters.path}")
+
+        except BaseException as e:
+            if isinstance(e, KeyboardInterrupt):
+                print("\n⚠️  Interrupted! Terminating processes...")
+            else:
+                print(f"\n⚠️  {e}\n⚠️  Terminating processes...")
+
+            readers.terminate()
+            workers.terminate()
 
             print("🛑 All processes terminated")
             raise
+        finally:
+            loader.shutdown(wait=False, cancel_futures=True)
+            if transport is not None:
+                transport.close()
+            if dedup_manager is not None:
+                dedup_manager.shutdown()
+            self._print_report(aggregator.stop())
+            if self.ledger is not None:
+                self.ledger.stop()
+
+    def _print_report(self, report):
+        """Print the headline numbers of the run report"""
+        workers = report["totals"]["worker"]["counters"]
+        elapsed = max(report["elapsed_s"], 1e-9)
+        audio_seconds = workers.get("audio_seconds", 0)
+        print(f"📈 Encoded {int(workers.get('items', 0)):,} items, {audio_seconds / 3600:.2f} h of audio "
+              f"({audio_seconds / elapsed:.1f} audio-s/s), run looks {report['bottleneck']}")
+        cache = report["encode_cache"]
+        if cache["lookups"]:
+            print(f"💾 Encode cache: {cache['hits']:,}/{cache['lookups']:,} hits ({cache['hit_rate']:.1%}), "
+                  f"{cache['encode_s_saved']:.1f}s of encoding saved")
+        for layer, check in report["precision_check"].items():
+            print(f"🔬 {layer}: {check['mismatch_rate']:.3%} of {check['tokens']:,} checked tokens "
+                  f"differ from fp32 eager")
+        filtered = report["filtered"]
+        if filtered["dropped"] or filtered["trimmed_seconds"]:
+            dropped = ", ".join(f"{n:,} {reason}" for reason, n in filtered["dropped"].items())
+            print(f"🎚️  Filtered {sum(filtered['dropped'].values()):,} item(s) ({dropped or 'none'}), "
+                  f"trimmed {filtered['trimmed_seconds'] / 3600:.2f} h of silence")
+        if report["error_count"]:
+            print(f"⚠️  {report['error_count']} item error(s), see run_report.json")
+        print(f"📝 Metrics: {os.path.join(self.metrics_dir, 'run_report.json')}")
 
     def assemble_and_save_final_dataset(self):
         """Assemble all processed shards into final dataset and save/upload"""
@@ -148,22 +452,20 @@ class PipelineManager:
         print("🔨 Assembling final dataset from all shards...")
         print(f"{'='*60}")
 
-        shard_files = os.path.join(self.base_settings.OUT_DIR, "*.jsonl.gz")
-        print(f"📂 Loading shards from: {shard_files}")
-
-        final_dataset = load_dataset(
-            "json",
-            data_dir=self.base_settings.OUT_DIR,
-            data_files="*.jsonl.gz",
-            split='train',
-            verification_mode='no_checks'
-        )
+        print(f"📂 Loading shards from: {self.base_settings.OUT_DIR}")
+        assembler = self._get_assembler()
+        try:
+            final_dataset = assembler.assemble()
+        finally:
+            assembler.close()
 
-        print(f"✅ Final dataset assembled: {len(final_dataset)} samples")
+        print(f"✅ Final dataset assembled: {len(final_dataset)} samples "
+              f"({assembler.converted} shard(s) converted, {assembler.skipped} unchanged)")
 
         if self.save_settings.local:
             print(f"\n💾 Saving dataset locally to: {self.save_settings.local}")
-            final_dataset.save_to_disk(self.save_settings.local)
+            num_proc = self.base_settings.assembly_workers
+            final_dataset.save_to_disk(self.save_settings.local, num_proc=num_proc if num_proc > 1 else None)
             print(f"✅ Dataset saved to disk")
 
         if self.save_settings.hf_upload:
@@ -171,6 +473,12 @@ class PipelineManager:
             final_dataset.push_to_hub(self.save_settings.hf_upload, private=True)
             print(f"✅ Dataset uploaded to HuggingFace Hub")
 
+        if self.save_settings.token_store:
+            print(f"\n🧱 Writing token store to: {self.save_settings.token_store}")
+            n = convert_shards(find_shards(self.base_settings.OUT_DIR), self.save_settings.token_store,
+                               self.num_layers)
+            print(f"✅ Token store written ({n:,} samples)")
+
         print(f"\n{'='*60}")
         print("🎊 Pipeline completed successfully!")
         print(f"{'='*60}")
@@ -182,10 +490,11 @@ class PipelineManager:
         datasets = self.config_manager.get_datasets()
         print(f"\n📋 Found {len(datasets)} dataset(s) to process")
 
-        for idx, dataset_config in enumerate(datasets, 1):
-            print(f"\n🔄 Processing dataset {idx}/{len(datasets)}")
-            self.process_single_dataset(dataset_config)
+        self.process_datasets(datasets)
 
-        self.assemble_and_save_final_dataset()
+        if self.node_rank == 0:
+            self.assemble_and_save_final_dataset()
+        else:
+            print(f"\n📦 Node {self.node_rank} is done; node 0 assembles the final dataset")
 
         print("\n👋 Pipeline finished!")
@@ -1,22 +1,212 @@
 import multiprocessing as mp
+import queue
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from tqdm.auto import tqdm
+from utils.audio_filters import AudioFilter
 from utils.dataset_processor import DatasetProcessor
+from utils.shm_transport import RingWriter, pack_item
+from utils.metrics import MetricsReporter
+from utils.sample_queue import BudgetedQueue
+from utils.work_ledger import lease_held
+
+# Exit code of a reader whose shared-memory slab still had unreleased slots; the slab
+# must not be handed to another reader
+DIRTY_SLAB_EXIT_CODE = 3
+# How often a reader checks that the node still holds the lease of the unit it reads
+LEASE_CHECK_SECONDS = 1.0
+
+
+def rows_after(ranges: List[Tuple[int, int]], row: Optional[int]) -> List[Tuple[int, int]]:
+    """The part of ascending [start, end) ranges after a row (all of them if row is None)"""
+    if row is None:
+        return list(ranges)
+    return [(max(start, row + 1), end) for start, end in ranges if end > row + 1]
+
+
+class ReadTask(NamedTuple):
+    """
+    A slice of one dataset for a reader to push into the sample queue. Row range tasks
+    leave dataset_processor empty and use the processor registered for the prefix.
+    Tasks of a leased unit carry its lease file and token, and stop once the lease is lost.
+    """
+    prefix: str
+    dataset_processor: Optional[DatasetProcessor]
+    row_ranges: Optional[List[Tuple[int, int]]]
+    lease: Optional[Tuple[str, bytes]] = None
+
+
+class RegisterDataset(NamedTuple):
+    """Control message: processor to use for row range tasks of a dataset"""
+    prefix: str
+    dataset_processor: DatasetProcessor
+
+
+class ForgetDataset(NamedTuple):
+    """Control message: a dataset is finished and its processor can be dropped"""
+    prefix: str
 
 
 class ReaderWorker:
-    """Handles reading from dataset and pushing to queue"""
+    """Handles reading from datasets and pushing to queue"""
 
-    def __init__(self, reader_id: int, total_readers: int, dataset_processor: DatasetProcessor, q: mp.Queue):
+    RETIRE = None
+
+    def __init__(self, reader_id: int, task_q: mp.Queue, control_q: mp.Queue, q: BudgetedQueue,
+                 done_q: mp.Queue, ring_writer: Optional[RingWriter] = None,
+                 report_q: Optional[mp.Queue] = None, metrics_interval: float = 10.0,
+                 generation: int = 0, sort_window: int = 0, filters: Optional[AudioFilter] = None):
         self.reader_id = reader_id
-        self.total_readers = total_readers
-        self.dataset_processor = dataset_processor
+        source = f"reader-{reader_id}" if generation == 0 else f"reader-{reader_id}.{generation}"
+        self.reporter = MetricsReporter(report_q, source, metrics_interval)
+        self.metrics = self.reporter.metrics
+        self.task_q = task_q
+        self.control_q = control_q
         self.q = q
+        self.done_q = done_q
+        self.ring_writer = ring_writer
+        self.processors: Dict[str, DatasetProcessor] = {}
+        self.retiring = False
+        self.sort_window = sort_window
+        self.filters = filters if filters is not None and filters.enabled else None
 
-    def run(self):
-        """Single reader worker that processes a portion of dataset"""
-        tqdm.set_lock(mp.RLock())
+    def _handle_control(self, msg):
+        """Applies one control message from the manager"""
+        if msg is self.RETIRE:
+            self.retiring = True
+        elif isinstance(msg, RegisterDataset):
+            self.processors[msg.prefix] = msg.dataset_processor
+        elif isinstance(msg, ForgetDataset):
+            self.processors.pop(msg.prefix, None)
+
+    def _poll_control(self):
+        """Applies all pending control messages without blocking"""
+        while True:
+            try:
+                self._handle_control(self.control_q.get_nowait())
+            except queue.Empty:
+                return
 
-        ds = self.dataset_processor.get_dataset()
+    def _processor_for(self, task: ReadTask) -> DatasetProcessor:
+        """Returns the task's processor, waiting for its registration if it has not arrived yet"""
+        if task.dataset_processor is not None:
+            return task.dataset_processor
+        while task.prefix not in self.processors:
+            self._handle_control(self.control_q.get())
+        return self.processors[task.prefix]
+
+    def _queue(self, items: List[dict], sample_rate: int):
+        """Puts prepared items into the sample queue, shortest first, charging each its bytes and audio-seconds"""
+        metrics = self.metrics
+        for item in sorted(items, key=lambda it: len(it["wave"])):
+            nbytes = item["wave"].nbytes
+            seconds = len(item["wave"]) / sample_rate
+            with metrics.time("shm_put"):
+                packed = pack_item(item, self.ring_writer)
+            with metrics.time("queue_put"):
+                self.q.put(packed, nbytes, seconds)
+
+    def _read(self, task: ReadTask, pbar) -> int:
+        """
+        Reads one task's rows into the queue, tagging every item with its dataset and row.
+        With a sort window, items are queued in length order once the window is full.
+        Rows that fail are dead-lettered and reading goes on with the next row
+        """
+        n = 0
+        if task.lease is not None and not lease_held(*task.lease):
+            print(f"⚠️  Reader {self.reader_id}: skipping a {task.prefix} task whose lease was taken over")
+            return n
+        processor = self._processor_for(task)
+        metrics = self.metrics
+        ranges = task.row_ranges
+        window: List[dict] = []
+        last_row = None
+        lease_checked = time.monotonic()
+        try:
+            while True:
+                rows = processor.iter_rows(ranges, return_errors=True)
+                while True:
+                    last = time.perf_counter()
+                    try:
+                        row, ex = next(rows)
+                    except StopIteration:
+                        return n
+                    except Exception as e:
+                        # The dataset iterator itself broke: a row range task restarts after the
+                        # row it was on, a streamed partition cannot be resumed
+                        if ranges is None:
+                            raise
+                        ranges = rows_after(ranges, last_row)
+                        if not ranges:
+                            return n
+                        last_row = ranges[0][0]
+                        self._dead_letter(e, "read", task.prefix, last_row)
+                        ranges = rows_after(ranges, last_row)
+                        break
+                    last_row = row
+                    if task.lease is not None and time.monotonic() - lease_checked >= LEASE_CHECK_SECONDS:
+                        lease_checked = time.monotonic()
+                        if not lease_held(*task.lease):
+                            # Another node took the unit over and reads it again; the rows in the window are its
+                            window = []
+                            print(f"⚠️  Reader {self.reader_id}: stopping a {task.prefix} task whose lease was taken over")
+                            return n
+                    # Examples are decoded and resampled lazily while iterating
+                    metrics.observe("decode", time.perf_counter() - last)
+                    if isinstance(ex, Exception):
+                        self._dead_letter(ex, "decode", task.prefix, row)
+                        continue
+                    try:
+                        with metrics.time("prepare"):
+                            prepared_item = processor.prepare_item(ex)
+                            prepared_item["_prefix"] = task.prefix
+                            prepared_item["_row"] = row
+                    except Exception as e:
+                        self._dead_letter(e, "prepare", task.prefix, row)
+                        continue
+                    if self.filters is not None:
+                        length = len(prepared_item["wave"])
+                        with metrics.time("filter"):
+                            reason = self.filters(prepared_item, task.prefix, row)
+                        if len(prepared_item["wave"]) < length:
+                            metrics.inc("trimmed_seconds", (length - len(prepared_item["wave"])) / processor.sample_rate)
+                        if reason is not None:
+                            self._filtered(reason, task.prefix, row)
+                            continue
+                    window.append(prepared_item)
+                    if len(window) >= max(1, self.sort_window):
+                        full, window = window, []
+                        self._queue(full, processor.sample_rate)
+                    n += 1
+                    metrics.inc("items")
+                    metrics.inc("audio_seconds", len(prepared_item["wave"]) / processor.sample_rate)
+                    self.reporter.maybe_report()
+                    pbar.update(1)
+
+                    if n % 1000 == 0:
+                        pbar.set_description(f"📖 Reader-{self.reader_id} {task.prefix} ({n:,} processed)")
+                if not ranges:
+                    return n
+        finally:
+            # Items read before an error are still queued, as without a sort window
+            self._queue(window, processor.sample_rate)
+
+    def _filtered(self, reason: str, prefix: str, row: Optional[int]):
+        """Drops a row the filters rejected; the manager counts it as done"""
+        self.metrics.inc(f"filtered_{reason}")
+        self.reporter.send("filtered", {"prefix": prefix, "row": row, "reason": reason})
+
+    def _dead_letter(self, e: Exception, stage: str, prefix: str, row: Optional[int]):
+        """Gives up on a row: it goes to the dead-letter log and reading continues"""
+        self.reporter.dead_letter(e, stage, prefix, row)
+
+    def run(self) -> bool:
+        """
+        Reader worker that takes tasks from the shared task queue until it is retired.
+        Returns False if its shared-memory slab could not be drained before exiting.
+        """
+        tqdm.set_lock(mp.RLock())
 
         pbar = tqdm(
             desc=f"📖 Reader-{self.reader_id}",
@@ -28,25 +218,47 @@ class ReaderWorker:
             mininterval=0.5
         )
 
-        n = 0
+        total = 0
+        drained = True
         try:
-            for i, ex in enumerate(ds):
-                prepared_item = self.dataset_processor.prepare_item(ex)
-                self.q.put(prepared_item)
-                n += 1
-                pbar.update(1)
-
-                if n % 1000 == 0:
-                    pbar.set_description(f"📖 Reader-{self.reader_id} ({n:,} processed)")
+            while True:
+                self._poll_control()
+                if self.retiring:
+                    break
+                try:
+                    task = self.task_q.get(timeout=0.5)
+                except queue.Empty:
+                    continue
 
-        except Exception as e:
-            pbar.set_description(f"📖 Reader-{self.reader_id} ERROR: {e}")
+                pbar.set_description(f"📖 Reader-{self.reader_id} {task.prefix}")
+                # Tells the manager which dataset this reader holds rows of, in case it dies
+                self.done_q.put((self.reader_id, task.prefix, None))
+                n = 0
+                try:
+                    n = self._read(task, pbar)
+                except Exception as e:
+                    pbar.set_description(f"📖 Reader-{self.reader_id} {task.prefix} ERROR: {e}")
+                    self.reporter.error(e, stage="read", prefix=task.prefix)
+                finally:
+                    total += n
+                    self.reporter.report()
+                    self.q.flush()
+                    self.done_q.put((self.reader_id, task.prefix, n))
         finally:
-            pbar.set_description(f"📖 Reader-{self.reader_id} DONE ({n:,} items)")
+            if self.ring_writer is not None:
+                drained = self.ring_writer.drain()
+                self.ring_writer.close()
+            pbar.set_description(f"📖 Reader-{self.reader_id} DONE ({total:,} items)")
             pbar.close()
+        return drained
 
 
-def reader_worker_process(reader_id: int, total_readers: int, dataset_processor: DatasetProcessor, q: mp.Queue):
+def reader_worker_process(reader_id: int, task_q: mp.Queue, control_q: mp.Queue, q: BudgetedQueue,
+                          done_q: mp.Queue, ring_writer: Optional[RingWriter] = None,
+                          report_q: Optional[mp.Queue] = None, metrics_interval: float = 10.0,
+                          generation: int = 0, sort_window: int = 0, filters: Optional[AudioFilter] = None):
     """Entry point for reader worker process"""
-    worker = ReaderWorker(reader_id, total_readers, dataset_processor, q)
-    worker.run()
+    worker = ReaderWorker(reader_id, task_q, control_q, q, done_q, ring_writer,
+                          report_q, metrics_interval, generation, sort_window, filters)
+    if not worker.run():
+        sys.exit(DIRTY_SLAB_EXIT_CODE)
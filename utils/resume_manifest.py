@@ -0,0 +1,151 @@
+"""
+Per-shard completion manifests for resumable pipeline runs.
+
+Workers write each shard to a temporary file. When a shard is complete, they first
+write a small sidecar manifest listing the source rows it contains, then rename the
+shard into place. The rename is the commit point: a manifest only counts if its shard
+exists, so a crash at any moment leaves either a finished shard with its rows recorded
+or nothing at all. Shard and manifest are flushed to disk before the rename, and a shard
+that fails to close is never renamed.
+
+Rows are stored as [start, end) ranges in the order the lines were written, which
+keeps the manifest compact for contiguous reads while still mapping lines to rows.
+"""
+
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from utils.shard_writer import match_shards, shard_name_pattern
+
+MANIFEST_SUFFIX = ".rows.json"
+# Token-length index sidecar of a shard (see utils.length_index), committed the same way
+INDEX_SUFFIX = ".index.npz"
+SIDECAR_SUFFIXES = (MANIFEST_SUFFIX, INDEX_SUFFIX)
+TMP_SUFFIX = ".tmp"
+
+Range = Tuple[int, int]
+
+
+def fsync_path(path: str) -> None:
+    """Flushes a written file to disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def encode_rows(rows: Iterable[int]) -> List[List[int]]:
+    """Run-length encodes row indices into [start, end) ranges, keeping their order"""
+    ranges: List[List[int]] = []
+    for row in rows:
+        if ranges and ranges[-1][1] == row:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([row, row + 1])
+    return ranges
+
+
+def decode_rows(ranges: Iterable[Range]) -> Iterator[int]:
+    """Expands [start, end) ranges back into row indices"""
+    for start, end in ranges:
+        yield from range(start, end)
+
+
+def merge_ranges(ranges: Iterable[Range]) -> List[Range]:
+    """Sorts ranges and merges the ones that touch or overlap"""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract_ranges(start: int, end: int, completed: List[Range]) -> List[Range]:
+    """Returns the parts of [start, end) not covered by merged, sorted completed ranges"""
+    remaining = []
+    cursor = start
+    for done_start, done_end in completed:
+        if done_end <= cursor:
+            continue
+        if done_start >= end:
+            break
+        if done_start > cursor:
+            remaining.append((cursor, done_start))
+        cursor = max(cursor, done_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        remaining.append((cursor, end))
+    return remaining
+
+
+class ResumeManifest:
+    """Reads and writes shard completion manifests in an output directory"""
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+
+    def _shard_files(self, prefix: str) -> List[str]:
+        """Lists finished shard files of a dataset"""
+        if not os.path.isdir(self.out_dir):
+            return []
+        return match_shards(os.listdir(self.out_dir), prefix)
+
+    def write(self, shard_path: str, rows: Iterable[int]) -> None:
+        """Atomically writes the manifest for a shard (call before the shard is renamed into place)"""
+        path = shard_path + MANIFEST_SUFFIX
+        tmp = path + TMP_SUFFIX
+        with open(tmp, "w") as f:
+            json.dump({"shard": os.path.basename(shard_path), "rows": encode_rows(rows)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def read(shard_path: str) -> List[Range]:
+        """Reads the row ranges of a shard in line order"""
+        with open(shard_path + MANIFEST_SUFFIX) as f:
+            return [tuple(r) for r in json.load(f)["rows"]]
+
+    def cleanup(self, prefix: str, tag: str = "") -> int:
+        """
+        Removes unfinished shards and manifests or index sidecars without a shard (only those of
+        one node if tag is given, e.g. "node01"). Returns the number of files removed
+        """
+        if not os.path.isdir(self.out_dir):
+            return 0
+        removed = 0
+        pattern = shard_name_pattern(prefix, tag)
+        for f in os.listdir(self.out_dir):
+            m = pattern.match(f)
+            if not m:
+                continue
+            path = os.path.join(self.out_dir, f)
+            orphan = m.group(2) in SIDECAR_SUFFIXES and not os.path.exists(path[:-len(m.group(2))])
+            if f.endswith(TMP_SUFFIX) or orphan:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def shard_ranges(self, prefix: str) -> Dict[str, List[Range]]:
+        """Returns the row ranges of every finished shard of a dataset, by shard name"""
+        shards: Dict[str, List[Range]] = {}
+        for f in self._shard_files(prefix):
+            path = os.path.join(self.out_dir, f)
+            if os.path.exists(path + MANIFEST_SUFFIX):
+                shards[f] = self.read(path)
+        return shards
+
+    def completed_ranges(self, prefix: str) -> List[Range]:
+        """Returns the merged row ranges already encoded for a dataset"""
+        return merge_ranges(r for ranges in self.shard_ranges(prefix).values() for r in ranges)
+
+    def next_file_index(self, prefix: str, worker_tag: str) -> int:
+        """Returns the file index after the last finished shard of a worker"""
+        pattern = shard_name_pattern(prefix, worker_tag)
+        indices = [int(m.group(1)) for m in map(pattern.match, self._shard_files(prefix)) if m]
+        return max(indices) + 1 if indices else 0
@@ -0,0 +1,412 @@
+"""
+Dataset scheduling of one pipeline run.
+
+`RunScheduler` holds what the manager tracks while datasets are read: the tasks dispatched
+per dataset, the datasets with tasks still out, the dataset each reader is on, the DatasetEnd
+rounds of every dataset with the workers that finalized them, and the datasets that may have
+lost rows in a crash. It dispatches read tasks (planned, or from units leased from the work
+ledger), waits for them while keeping the reader and worker pools up, ends datasets, and reads
+the rows lost in crashes again once the affected datasets are finalized. Units whose lease
+another node took over are not read again, and their rows that node did not skip are dropped
+from this node's shards.
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from utils.audio_filters import FilterLog
+from utils.audio_worker import DatasetEnd
+from utils.config_manager import BaseSettings
+from utils.dataset_processor import DatasetProcessor
+from utils.length_index import backfill_shard_index
+from utils.reader_worker import ReadTask
+from utils.resume_manifest import (INDEX_SUFFIX, MANIFEST_SUFFIX, TMP_SUFFIX, ResumeManifest, decode_rows,
+                                   fsync_path, merge_ranges, subtract_ranges)
+from utils.sample_queue import BudgetedQueue
+from utils.scheduler import ReaderAutoscaler, ReaderPool
+from utils.shard_writer import iter_shard_records, match_shards, shard_writer_for_path
+from utils.shm_transport import SharedWaveTransport, owner_tag
+from utils.supervision import RECOVERY_ROUNDS, DeadLetterLog, WorkerSupervisor
+from utils.work_ledger import Lease, WorkLedger, lease_held
+
+
+class RunScheduler:
+    """Dispatches the read tasks of a run and supervises its readers and workers"""
+
+    def __init__(self, settings: BaseSettings, q: BudgetedQueue, task_q: mp.Queue, done_q: mp.Queue,
+                 readers: ReaderPool, workers: WorkerSupervisor, autoscaler: Optional[ReaderAutoscaler],
+                 min_readers: int, prefixes: List[str], worker_tag: Callable[[int], str],
+                 dead_letters: DeadLetterLog, filtered: FilterLog, ledger: Optional[WorkLedger] = None,
+                 transport: Optional[SharedWaveTransport] = None):
+        """
+        Args:
+            settings: Base settings of the run
+            q: Sample queue (DatasetEnds are sent through its control lanes)
+            task_q: Read task queue of the readers
+            done_q: Queue readers announce started and finished tasks on
+            readers: Reader pool
+            workers: Worker supervisor
+            autoscaler: Reader pool autoscaler (None = fixed pool)
+            min_readers: Readers that exit unexpectedly are replaced up to this many
+            prefixes: Dataset prefixes of the run (a crashed worker's unfinished shards of each are removed)
+            worker_tag: Shard name tag of a worker rank
+            dead_letters: Dead-letter log (dead-lettered rows are not read again)
+            filtered: Filtered rows (not read again either)
+            ledger: Work ledger of a multi-node run
+            transport: Shared-memory transport (the slots a crashed worker held are handed back)
+        """
+        self.settings = settings
+        self.q = q
+        self.task_q = task_q
+        self.done_q = done_q
+        self.readers = readers
+        self.workers = workers
+        self.autoscaler = autoscaler
+        self.min_readers = min_readers
+        self.prefixes = prefixes
+        self.worker_tag = worker_tag
+        self.dead_letters = dead_letters
+        self.filtered = filtered
+        self.ledger = ledger
+        self.transport = transport
+        self.manifest = ResumeManifest(settings.OUT_DIR)
+
+        self.processors: Dict[str, DatasetProcessor] = {}
+        # The tasks read of every dataset, datasets with tasks out and no DatasetEnd sent yet,
+        # datasets that may have lost rows in a crash, and the dataset each reader is on
+        self.dispatched: Dict[str, List[ReadTask]] = {}
+        self.reading: Set[str] = set()
+        self.dirty: Set[str] = set()
+        self.recoveries: Dict[str, int] = {}
+        self.holding: Dict[int, str] = {}
+        self.finished = deque()
+
+        # Units read in each DatasetEnd round of a dataset, and the worker ranks that finalized the round
+        self.rounds: Dict[str, List[List[int]]] = {}
+        self.acks: Dict[Tuple[str, int], Set[int]] = {}
+        # Rounds that may have lost rows in a worker crash; their units are marked done after recovery
+        self.suspect: Set[Tuple[str, int]] = set()
+        self.rounds_lock = threading.Lock()
+
+    def add_dataset(self, prefix: str, processor: DatasetProcessor):
+        """Makes a loaded dataset known (its processor is needed to read lost rows again)"""
+        self.processors[prefix] = processor
+
+    def on_dataset_end(self, source: str, payload: dict):
+        """
+        report_q handler for workers that finalized a dataset: once every worker has finalized
+        a round of the dataset, the units read in that round are marked done in the ledger
+        """
+        prefix, round_idx = payload["prefix"], payload["round"]
+        with self.rounds_lock:
+            acks = self.acks.setdefault((prefix, round_idx), set())
+            acks.add(payload["rank"])
+            if len(acks) < len(self.workers) or self.ledger is None or (prefix, round_idx) in self.suspect:
+                return
+            # Under the lock, so a round is never seen finalized before its refused units are pending
+            self.ledger.complete(prefix, self.rounds[prefix][round_idx])
+
+    def rounds_finalized(self, prefix: str) -> bool:
+        """Whether every worker has finalized every DatasetEnd round of a dataset"""
+        with self.rounds_lock:
+            return all(len(self.acks.get((prefix, i), ())) >= len(self.workers)
+                       for i in range(len(self.rounds.get(prefix, []))))
+
+    def dispatch(self, task: ReadTask):
+        """Queues a read task for the readers"""
+        self.dispatched.setdefault(task.prefix, []).append(task)
+        self.reading.add(task.prefix)
+        self.task_q.put(task)
+
+    def _take_done(self, msg):
+        """Readers announce each task they start (count None) and report its item count when done"""
+        reader_id, prefix, count = msg
+        if count is None:
+            self.holding[reader_id] = prefix
+        else:
+            self.holding.pop(reader_id, None)
+            self.finished.append(count)
+
+    def _restart_worker(self, rank: int):
+        """
+        Restarts a crashed worker, sending it again the DatasetEnds it did not finalize. Every
+        dataset with a round not finalized by all workers, or with tasks out, may have lost rows
+        """
+        for prefix in self.prefixes:
+            self.manifest.cleanup(prefix, self.worker_tag(rank))
+        self.q.reset_consumer(rank)
+        if self.transport is not None:
+            # The crashed worker never releases the slots it held, and its readers would wait for them forever
+            self.transport.release_owner(owner_tag(rank, self.workers.generations[rank] - 1))
+        code = self.workers.restart(rank)
+        resend = []
+        with self.rounds_lock:
+            for prefix, rounds in self.rounds.items():
+                for round_idx in range(len(rounds)):
+                    acks = self.acks.get((prefix, round_idx), set())
+                    if len(acks) < len(self.workers):
+                        self.dirty.add(prefix)
+                        self.suspect.add((prefix, round_idx))
+                        if rank not in acks:
+                            resend.append(DatasetEnd(prefix, round_idx, rank))
+        self.dirty.update(self.reading)
+        for end in resend:
+            self.q.send(rank, end)
+        print(f"💥 Worker {rank} exited (code {code}) and was restarted; "
+              f"rows it held are read again once {', '.join(sorted(self.dirty)) or 'nothing'} is finalized")
+
+    def _collect_exited_readers(self):
+        """Counts the task of a reader that died mid-task as finished; its dataset is reconciled later"""
+        exited = self.readers.pop_exited()
+        if not exited:
+            return
+        # Collect what the readers reported before exiting, then see who left a task behind
+        while True:
+            try:
+                self._take_done(self.done_q.get_nowait())
+            except queue.Empty:
+                break
+        for reader_id, code in exited:
+            prefix = self.holding.pop(reader_id, None)
+            if prefix is not None:
+                self.dirty.add(prefix)
+                self.finished.append(0)
+                print(f"💥 Reader {reader_id} exited (code {code}) in the middle of a {prefix} task; "
+                      f"its rows are read again once {prefix} is finalized")
+
+    def supervise(self):
+        """Restarts crashed workers and accounts for readers that exited"""
+        for rank in self.workers.crashed():
+            self._restart_worker(rank)
+        self._collect_exited_readers()
+
+    def wait_for_task(self) -> Optional[int]:
+        """Waits briefly for a finished task (returns its item count), keeping the reader and worker pools up"""
+        if not self.finished:
+            try:
+                self._take_done(self.done_q.get(timeout=min(1.0, self.settings.autoscale_interval)))
+            except queue.Empty:
+                pass
+        self.q.deliver()
+        if self.autoscaler is not None:
+            self.autoscaler.step()
+        self.readers.reap()
+        self.supervise()
+        while self.readers.active < self.min_readers:
+            if self.readers.grow() is None:
+                break
+        return self.finished.popleft() if self.finished else None
+
+    def wait(self, seconds: float):
+        """Keeps the pools supervised for a while"""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self.wait_for_task()
+
+    def read_tasks(self, prefix: str, tasks: List[ReadTask]) -> int:
+        """Reads tasks of a dataset and waits until they are all read. Returns the item count"""
+        if any(task.dataset_processor is None for task in tasks):
+            self.readers.register(prefix, self.processors[prefix])
+        for task in tasks:
+            self.dispatch(task)
+        n = 0
+        remaining = len(tasks)
+        while remaining:
+            count = self.wait_for_task()
+            if count is not None:
+                n += count
+                remaining -= 1
+        return n
+
+    def lease_task(self, processor: DatasetProcessor, lease: Lease, completed: List[tuple]) -> Optional[ReadTask]:
+        """The read task of a leased unit, leaving out rows already in shards. None if nothing is left"""
+        plan = self.ledger.plans[lease.prefix]
+        if lease.takeover:
+            shards = self.manifest.shard_ranges(lease.prefix)
+            completed = merge_ranges(r for ranges in shards.values() for r in ranges)
+            # The node the unit was taken from keeps the rows of these shards and drops the rest
+            self.ledger.keep(lease.prefix, lease.unit, list(shards))
+        token = self.ledger.lease_token(lease.prefix, lease.unit)
+        if plan["streaming"]:
+            part = processor.for_reader(lease.unit, len(plan["units"]), completed)
+            return ReadTask(lease.prefix, part, None, token)
+        start, end = plan["units"][lease.unit]
+        ranges = subtract_ranges(start, end, completed)
+        return ReadTask(lease.prefix, None, ranges, token) if ranges else None
+
+    def read_leased(self, prefix: str, processor: DatasetProcessor, completed: List[tuple]):
+        """
+        Claims units of a dataset from the ledger and reads them, keeping a few tasks per
+        reader queued, until no unit is left to claim. Returns (items, tasks, units)
+        """
+        n = tasks = inflight = 0
+        units = []
+        exhausted = False
+        while True:
+            while not exhausted and inflight < 2 * self.readers.max_readers:
+                lease = self.ledger.claim(prefix)
+                if lease is None:
+                    exhausted = True
+                    break
+                if not units and not processor.streaming:
+                    self.readers.register(prefix, processor)
+                units.append(lease.unit)
+                task = self.lease_task(processor, lease, completed)
+                if task is not None:
+                    self.dispatch(task)
+                    inflight += 1
+                    tasks += 1
+            if not inflight:
+                return n, tasks, units
+            count = self.wait_for_task()
+            if count is not None:
+                n += count
+                inflight -= 1
+
+    def end_dataset(self, prefix: str, units: Optional[List[int]] = None):
+        """Has every worker finalize the dataset's shards; the units are marked done after that"""
+        with self.rounds_lock:
+            rounds = self.rounds.setdefault(prefix, [])
+            rounds.append(units or [])
+            round_idx = len(rounds) - 1
+            if prefix in self.dirty:
+                self.suspect.add((prefix, round_idx))
+        for rank in range(len(self.workers)):
+            self.q.send(rank, DatasetEnd(prefix, round_idx, rank))
+        self.reading.discard(prefix)
+        self.readers.forget(prefix)
+
+    def recovery_tasks(self, prefix: str) -> Tuple[List[ReadTask], List[tuple]]:
+        """
+        Read tasks for the rows of a dataset that were dispatched in this run but are neither in
+        a finished shard nor dead-lettered or filtered. Streamed partitions are streamed again, skipping the
+        rows already done. Returns the tasks and the missing row ranges (of row range tasks)
+        """
+        # Units taken over by another node are read there
+        dispatched = [task for task in self.dispatched.get(prefix, [])
+                      if task.lease is None or lease_held(*task.lease)]
+        skip = merge_ranges(self.manifest.completed_ranges(prefix)
+                            + self.dead_letters.dead_ranges(prefix) + self.filtered.filtered_ranges(prefix))
+        read = merge_ranges(r for task in dispatched if task.row_ranges for r in task.row_ranges)
+        missing = [r for start, end in read for r in subtract_ranges(start, end, skip)]
+        rows_per_task = max(1, self.settings.task_rows)
+        tasks = [ReadTask(prefix, None, [(task_start, min(task_start + rows_per_task, end))])
+                 for start, end in missing for task_start in range(start, end, rows_per_task)]
+        partitions = sorted({(task.dataset_processor.row_offset, task.dataset_processor.row_stride)
+                             for task in dispatched if task.row_ranges is None})
+        tasks += [ReadTask(prefix, self.processors[prefix].for_reader(offset, stride, skip), None)
+                  for offset, stride in partitions]
+        return tasks, missing
+
+    def recover(self, prefix: str) -> bool:
+        """
+        Reads the rows a crash lost of a dataset whose rounds are all finalized. Returns True
+        once nothing is missing; rows still missing after RECOVERY_ROUNDS are dead-lettered
+        """
+        tasks, missing = self.recovery_tasks(prefix)
+        if self.recoveries.get(prefix, 0) >= RECOVERY_ROUNDS:
+            for start, end in missing:
+                for row in range(start, end):
+                    self.dead_letters.add({"time": time.time(), "source": "manager", "prefix": prefix,
+                                           "row": row, "stage": "lost", "attempts": RECOVERY_ROUNDS,
+                                           "error": "lost in worker crashes"})
+            return True
+        if not tasks:
+            return True
+        self.recoveries[prefix] = self.recoveries.get(prefix, 0) + 1
+        n = self.read_tasks(prefix, tasks)
+        print(f"🩹 Read {n:,} item(s) of {prefix} again after a crash")
+        if n == 0 and not missing:
+            # Streamed partitions came up with nothing left to encode
+            return True
+        self.end_dataset(prefix)
+        return False
+
+    def drop_unit_rows(self, prefix: str, unit: int, kept: Set[str]) -> int:
+        """
+        Drops the rows of a unit from this node's finished shards of a dataset, except in the
+        shards the node that took the unit over skipped. Returns the number of rows dropped
+        """
+        out_dir = self.settings.OUT_DIR
+        dropped = 0
+        names = match_shards(os.listdir(out_dir), prefix, f"node{self.ledger.node_rank:02d}")
+        for name in names:
+            path = os.path.join(out_dir, name)
+            if name in kept or not os.path.exists(path + MANIFEST_SUFFIX):
+                continue
+            rows = list(decode_rows(ResumeManifest.read(path)))
+            keep = [not self.ledger.in_unit(prefix, unit, row) for row in rows]
+            if all(keep):
+                continue
+            dropped += len(keep) - sum(keep)
+            if not any(keep):
+                for f in (path, path + MANIFEST_SUFFIX, path + INDEX_SUFFIX):
+                    if os.path.exists(f):
+                        os.remove(f)
+                continue
+            writer = None
+            for rec, keep_rec in zip(iter_shard_records(path), keep):
+                if writer is None:
+                    writer = shard_writer_for_path(path)(
+                        path + TMP_SUFFIX, int(rec["num_layers"]), gzip_level=self.settings.gzip_level,
+                        buffer_size=self.settings.buffer_size,
+                        row_group_size=self.settings.row_group_size or self.settings.lines_per_file,
+                        compact_tokens=self.settings.compact_tokens)
+                if keep_rec:
+                    writer.write(rec)
+            writer.close()
+            fsync_path(path + TMP_SUFFIX)
+            # The shard goes first: a crash in between leaves the dropped rows recorded as done,
+            # which only the node that took the unit over reads
+            os.replace(path + TMP_SUFFIX, path)
+            self.manifest.write(path, [row for row, keep_rec in zip(rows, keep) if keep_rec])
+            if os.path.exists(path + INDEX_SUFFIX):
+                backfill_shard_index(path)
+        return dropped
+
+    def drop_refused(self):
+        """Drops the rows of units whose completion was refused, once their new holder recorded what it skipped"""
+        for prefix, unit in self.ledger.pending_drops():
+            kept = self.ledger.kept(prefix, unit)
+            if kept is None:
+                continue
+            dropped = self.drop_unit_rows(prefix, unit, kept)
+            self.ledger.release(prefix, unit)
+            print(f"✂️  Dropped {dropped:,} row(s) of {prefix} unit {unit} that another node took over")
+
+    def settle(self, block: bool):
+        """
+        Recovers crashed datasets whose rounds are all finalized; with block, until every
+        round of every dataset is finalized, nothing is left to recover and the rows of units
+        taken over by other nodes are dropped
+        """
+        def busy() -> bool:
+            # Rounds first: their refused units are pending by the time they are finalized
+            if block and not all(self.rounds_finalized(prefix) for prefix in list(self.rounds)):
+                return True
+            return bool(self.dirty) or (self.ledger is not None and bool(self.ledger.pending_drops()))
+
+        while busy():
+            ready = [prefix for prefix in sorted(self.dirty)
+                     if prefix not in self.reading and self.rounds_finalized(prefix)]
+            for prefix in ready:
+                if not self.recover(prefix):
+                    continue
+                self.dirty.discard(prefix)
+                with self.rounds_lock:
+                    held = [key for key in self.suspect if key[0] == prefix]
+                    self.suspect.difference_update(held)
+                    units = [unit for _, round_idx in held for unit in self.rounds[prefix][round_idx]]
+                if self.ledger is not None and units:
+                    self.ledger.complete(prefix, units)
+            if self.ledger is not None:
+                self.drop_refused()
+            if not block:
+                return
+            if not ready:
+                self.wait_for_task()
@@ -0,0 +1,243 @@
+"""
+Memory-budgeted sample queue between readers and workers.
+
+`qsize` bounds the number of queued items, which says little about memory: 100k queued
+one-minute clips take hundreds of GB while 100k short utterances take a few. `BudgetedQueue`
+additionally admits items by the total bytes and audio-seconds of their waveforms, so readers
+block once the queued audio reaches `queue_max_bytes` / `queue_max_seconds` regardless of how
+many items that is. A lane that holds nothing always admits one item, so clips larger than the
+budget still pass.
+
+Clips longer than `slow_lane_seconds` go to a separate slow lane. They do not sit between the
+short clips that workers bucket into padded batches, and workers take them between fast-lane
+items (every SLOW_LANE_EVERY items, or whenever the fast lane is empty).
+
+Control messages are not dicts and bypass the budget. The shutdown sentinel goes to the fast
+lane; a worker that takes it while the slow lane still holds items returns those items first.
+Messages for one worker (DatasetEnd) go to that worker's own control lane, which it waits on
+together with the fast lane. `send` holds such a message back until every item queued before
+it has been taken, counted per lane, so no item of a dataset reaches a worker after it has
+finalized that dataset, and no worker ever takes a message meant for another.
+"""
+
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import connection
+from typing import Any, Dict, List, Optional, Tuple
+
+# Workers take a slow-lane item after this many fast-lane items
+SLOW_LANE_EVERY = 8
+# How often a worker waiting on an empty fast lane looks at the slow lane
+POLL_INTERVAL = 0.05
+
+
+class BudgetedQueue:
+    """Sample queue that admits items by count, bytes and audio-seconds, with a slow lane for long clips"""
+
+    def __init__(self, maxsize: int, max_bytes: int = 0, max_seconds: float = 0.0,
+                 slow_lane_seconds: float = 0.0, consumers: int = 0):
+        """
+        Args:
+            maxsize: Maximum number of queued items per lane (as mp.Queue's maxsize)
+            max_bytes: Maximum waveform bytes queued in both lanes (0 = no limit)
+            max_seconds: Maximum audio-seconds queued in both lanes (0 = no limit)
+            slow_lane_seconds: Clips longer than this go to the slow lane (0 = no slow lane)
+            consumers: Number of workers with their own control lane (ranks 0..consumers-1)
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.slow_lane_seconds = slow_lane_seconds
+        self.fast = mp.Queue(maxsize=maxsize)
+        self.slow = mp.Queue(maxsize=maxsize) if slow_lane_seconds > 0 else None
+        self.cond = mp.Condition()
+        # Queued items, bytes and audio-seconds per lane (fast, slow), guarded by cond
+        self.items = mp.Array("q", 2, lock=False)
+        self.bytes = mp.Array("q", 2, lock=False)
+        self.seconds = mp.Array("d", 2, lock=False)
+        # Items ever queued and taken per lane, guarded by cond
+        self.queued = mp.Array("q", 2, lock=False)
+        self.taken = mp.Array("q", 2, lock=False)
+        self.control = [mp.Queue() for _ in range(consumers)]
+        self._gets = 0
+        self._stash: List[Any] = []
+        # Control messages held back by send (manager side): (queued counts, consumer, message)
+        self._pending: List[Tuple[Tuple[int, int], int, Any]] = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_gets"] = 0
+        state["_stash"] = []
+        state["_pending"] = []
+        return state
+
+    def _over_budget(self, lane: int, nbytes: int, seconds: float) -> bool:
+        if self.items[lane] == 0:
+            return False
+        if self.max_bytes and sum(self.bytes) + nbytes > self.max_bytes:
+            return True
+        return bool(self.max_seconds) and sum(self.seconds) + seconds > self.max_seconds
+
+    def put(self, item: Any, nbytes: int = 0, seconds: float = 0.0):
+        """
+        Queues an item, blocking while the budget is used up. Items (dicts) carry their cost
+        to the consumer; anything else is a control message and goes to the fast lane unbudgeted
+        """
+        if not isinstance(item, dict):
+            self.fast.put(item)
+            return
+        lane = 1 if self.slow is not None and seconds > self.slow_lane_seconds else 0
+        with self.cond:
+            while self._over_budget(lane, nbytes, seconds):
+                self.cond.wait(timeout=1.0)
+            self.items[lane] += 1
+            self.bytes[lane] += nbytes
+            self.seconds[lane] += seconds
+            self.queued[lane] += 1
+        item["_cost"] = (lane, nbytes, seconds)
+        (self.slow if lane else self.fast).put(item)
+
+    def _taken(self, item: Any) -> Any:
+        """Returns an item's budget once a worker has taken it"""
+        if isinstance(item, dict) and "_cost" in item:
+            lane, nbytes, seconds = item.pop("_cost")
+            with self.cond:
+                self.items[lane] -= 1
+                self.bytes[lane] -= nbytes
+                self.seconds[lane] -= seconds
+                self.taken[lane] += 1
+                self.cond.notify_all()
+        return item
+
+    def send(self, consumer: int, message: Any):
+        """Sends a control message to one consumer once every item queued so far has been taken"""
+        with self.cond:
+            mark = (self.queued[0], self.queued[1])
+        self._pending.append((mark, consumer, message))
+        self.deliver()
+
+    def deliver(self):
+        """Hands held-back control messages to their consumers once the items queued before them are taken"""
+        if not self._pending:
+            return
+        with self.cond:
+            taken = (self.taken[0], self.taken[1])
+        waiting = []
+        for mark, consumer, message in self._pending:
+            if taken[0] >= mark[0] and taken[1] >= mark[1]:
+                self.control[consumer].put(message)
+            else:
+                waiting.append((mark, consumer, message))
+        self._pending = waiting
+
+    def reset_consumer(self, consumer: int):
+        """
+        Gives a consumer a new control lane, before its replacement process is started. A crashed
+        process may have died holding the old lane's lock; messages still in it are dropped
+        """
+        self.control[consumer] = mp.Queue()
+
+    def _get_fast(self, timeout: Optional[float], consumer: Optional[int]) -> Tuple[Any, bool]:
+        """
+        Takes the next message of the consumer's control lane or the fast lane, whichever has
+        one first. Returns it with whether it came from the control lane
+        """
+        if consumer is None:
+            return self.fast.get(timeout=timeout), False
+        control = self.control[consumer]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return control.get_nowait(), True
+            except queue.Empty:
+                pass
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready = connection.wait([self.fast._reader, control._reader], remaining)
+            if not ready:
+                raise queue.Empty
+            if self.fast._reader in ready:
+                try:
+                    # Bounded, as other workers woken by the same item may have taken it
+                    return self.fast.get(timeout=POLL_INTERVAL), False
+                except queue.Empty:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise
+
+    def _get_slow(self) -> Optional[Any]:
+        if self.slow is None:
+            return None
+        try:
+            return self.slow.get_nowait()
+        except queue.Empty:
+            return None
+
+    def get(self, timeout: Optional[float] = None, consumer: Optional[int] = None) -> Any:
+        """
+        Takes the next item or control message (including those sent to consumer). Raises
+        queue.Empty after timeout seconds
+        """
+        if self.slow is None:
+            return self._taken(self._get_fast(timeout, consumer)[0])
+
+        self._gets += 1
+        if self._stash or self._gets % SLOW_LANE_EVERY == 0:
+            item = self._get_slow()
+            if item is not None:
+                return self._taken(item)
+        if self._stash:
+            if self.items[1] == 0:
+                return self._stash.pop(0)
+            time.sleep(POLL_INTERVAL)
+            raise queue.Empty
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, deadline - time.monotonic())
+            try:
+                item, addressed = self._get_fast(max(0.0, wait), consumer)
+            except queue.Empty:
+                item = self._get_slow()
+                if item is not None:
+                    return self._taken(item)
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+                continue
+            if not isinstance(item, dict) and not addressed and self.items[1] > 0:
+                # Slow-lane items queued before the sentinel are taken first
+                self._stash.append(item)
+                return self.get(timeout, consumer)
+            return self._taken(item)
+
+    def get_nowait(self, consumer: Optional[int] = None) -> Any:
+        return self.get(timeout=0, consumer=consumer)
+
+    def flush(self):
+        """
+        Waits until this process's puts have been handed to the pipe. mp.Queue sends them from
+        a feeder thread, so without this a later message from another process (the manager's
+        DatasetEnd) could overtake items already put
+        """
+        for lane in (self.fast, self.slow):
+            while lane is not None and lane._buffer:
+                time.sleep(0.001)
+
+    def qsize(self) -> int:
+        """Number of queued items in both lanes"""
+        return self.items[0] + self.items[1]
+
+    def fill(self) -> Dict[str, float]:
+        """Queued items, bytes and audio-seconds, and the fraction of the tightest limit in use"""
+        items, nbytes, seconds = self.qsize(), sum(self.bytes), sum(self.seconds)
+        fractions = [items / max(1, self.maxsize)]
+        if self.max_bytes:
+            fractions.append(nbytes / self.max_bytes)
+        if self.max_seconds:
+            fractions.append(seconds / self.max_seconds)
+        return {
+            "items": items,
+            "slow_items": self.items[1],
+            "bytes": nbytes,
+            "seconds": round(seconds, 2),
+            "fraction": round(max(fractions), 4),
+        }
@@ -0,0 +1,200 @@
+"""
+Work-stealing reader scheduling.
+
+Datasets are cut into small row range tasks on one shared task queue. Readers take the
+next task as soon as they finish one, so a reader that hits long audio simply takes
+fewer tasks and no reader is left with a long tail at the end of a dataset.
+
+`ReaderPool` runs the reader processes and can start or retire readers while the
+pipeline runs; `ReaderAutoscaler` decides when to do so from the sample queue fill and
+the time encoders spend waiting for samples.
+"""
+
+import multiprocessing as mp
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from utils.dataset_processor import DatasetProcessor
+from utils.metrics import MetricsAggregator
+from utils.reader_worker import DIRTY_SLAB_EXIT_CODE, ForgetDataset, ReaderWorker, RegisterDataset
+
+
+class ReaderPool:
+    """Reader processes that can be started and retired while the pipeline runs"""
+
+    def __init__(self, max_readers: int, spawn: Callable[[int, mp.Queue, int], mp.Process]):
+        """
+        Args:
+            max_readers: Number of reader slots (and shared-memory slabs)
+            spawn: Creates the process for a reader slot given its id, control queue and generation
+        """
+        self.max_readers = max_readers
+        self.spawn = spawn
+        self.control_qs = [mp.Queue() for _ in range(max_readers)]
+        self.procs: Dict[int, mp.Process] = {}
+        self.retiring: Set[int] = set()
+        self.unusable: Set[int] = set()
+        self.generations = [0] * max_readers
+        self.datasets: Dict[str, DatasetProcessor] = {}
+        self.exited: List[Tuple[int, int]] = []
+
+    @property
+    def active(self) -> int:
+        """Readers that are running and not retiring"""
+        return len(self.procs) - len(self.retiring)
+
+    def start(self, reader_id: int):
+        """Starts a reader in a free slot and sends it the registered datasets"""
+        for processor_prefix, processor in self.datasets.items():
+            self.control_qs[reader_id].put(RegisterDataset(processor_prefix, processor))
+        proc = self.spawn(reader_id, self.control_qs[reader_id], self.generations[reader_id])
+        self.generations[reader_id] += 1
+        proc.start()
+        self.procs[reader_id] = proc
+
+    def grow(self) -> Optional[int]:
+        """Starts one more reader if a slot is free. Returns its id"""
+        self.reap()
+        for reader_id in range(self.max_readers):
+            if reader_id not in self.procs and reader_id not in self.unusable:
+                self.start(reader_id)
+                return reader_id
+        return None
+
+    def shrink(self) -> Optional[int]:
+        """Asks the newest active reader to exit after its current task. Returns its id"""
+        candidates = [i for i in self.procs if i not in self.retiring]
+        if len(candidates) <= 1:
+            return None
+        reader_id = max(candidates)
+        self.control_qs[reader_id].put(ReaderWorker.RETIRE)
+        self.retiring.add(reader_id)
+        return reader_id
+
+    def reap(self):
+        """Forgets readers that have exited, remembering their exit codes for pop_exited"""
+        for reader_id, proc in list(self.procs.items()):
+            if proc.exitcode is None:
+                continue
+            proc.join()
+            self.exited.append((reader_id, proc.exitcode))
+            if proc.exitcode == DIRTY_SLAB_EXIT_CODE:
+                self.unusable.add(reader_id)
+            del self.procs[reader_id]
+            self.retiring.discard(reader_id)
+
+    def pop_exited(self) -> List[Tuple[int, int]]:
+        """(reader id, exit code) of the readers that exited since the last call"""
+        exited, self.exited = self.exited, []
+        return exited
+
+    def register(self, prefix: str, processor: DatasetProcessor):
+        """Sends a dataset's processor to every reader (and to readers started later)"""
+        self.datasets[prefix] = processor
+        for reader_id in self.procs:
+            self.control_qs[reader_id].put(RegisterDataset(prefix, processor))
+
+    def forget(self, prefix: str):
+        """Lets readers drop a finished dataset's processor"""
+        self.datasets.pop(prefix, None)
+        for reader_id in self.procs:
+            self.control_qs[reader_id].put(ForgetDataset(prefix))
+
+    def stop(self):
+        """Retires all readers and waits for them to exit"""
+        for reader_id in self.procs:
+            if reader_id not in self.retiring:
+                self.control_qs[reader_id].put(ReaderWorker.RETIRE)
+        for proc in self.procs.values():
+            proc.join()
+        self.procs.clear()
+        self.retiring.clear()
+
+    def terminate(self):
+        """Kills all readers"""
+        for proc in self.procs.values():
+            proc.terminate()
+        for proc in self.procs.values():
+            proc.join(timeout=10)
+        self.procs.clear()
+
+
+class ReaderAutoscaler:
+    """
+    Resizes the reader pool from the sample queue fill and the encoders' idle time.
+
+    Every interval, a reader is added when the queue stayed nearly empty and encoders
+    were waiting for samples, and one is retired when the queue stayed nearly full and
+    encoders never waited (readers are then only blocked on a full queue). Without
+    worker metrics the decision falls back to the queue fill alone.
+    """
+
+    LOW_FILL = 0.1
+    HIGH_FILL = 0.8
+    IDLE_GROW = 0.2
+    IDLE_SHRINK = 0.05
+
+    def __init__(self, pool: ReaderPool, q: mp.Queue, qsize: int, interval: float,
+                 min_readers: int, aggregator: Optional[MetricsAggregator] = None):
+        self.pool = pool
+        self.q = q
+        self.qsize = max(1, qsize)
+        self.interval = interval
+        self.min_readers = max(1, min_readers)
+        self.aggregator = aggregator
+        self.fills: List[float] = []
+        self.last_decision = time.monotonic()
+        self.last_windows: Dict[str, Tuple[float, float]] = {}
+        self.idle: Dict[str, float] = {}
+
+    def _idle_fraction(self) -> Optional[float]:
+        """
+        Mean fraction of time encoders spent waiting for samples, each over the window between
+        its two latest snapshots (whenever they arrived), so it does not depend on
+        autoscale_interval being longer than metrics_interval
+        """
+        if self.aggregator is None:
+            return None
+        windows = self.aggregator.stage_windows("worker", "queue_wait")
+        for source, (wait, uptime) in windows.items():
+            previous = self.last_windows.get(source)
+            if previous is None or uptime < previous[1]:
+                # First snapshot of a (possibly restarted) worker: its window is its whole uptime
+                previous = (0.0, 0.0)
+            if uptime > previous[1]:
+                self.idle[source] = min(1.0, max(0.0, wait - previous[0]) / (uptime - previous[1]))
+                self.last_windows[source] = (wait, uptime)
+        fractions = [self.idle[source] for source in windows if source in self.idle]
+        if not fractions:
+            return None
+        return sum(fractions) / len(fractions)
+
+    def step(self):
+        """Samples the queue, and resizes the pool once per interval"""
+        try:
+            if hasattr(self.q, "fill"):
+                # Budgeted queue: fill of the tightest of its item, byte and audio-seconds limits
+                self.fills.append(self.q.fill()["fraction"])
+            else:
+                self.fills.append(self.q.qsize() / self.qsize)
+        except (NotImplementedError, OSError):
+            return
+        if time.monotonic() - self.last_decision < self.interval:
+            return
+
+        fill = sum(self.fills) / len(self.fills)
+        idle = self._idle_fraction()
+        self.fills = []
+        self.last_decision = time.monotonic()
+        self.pool.reap()
+
+        if fill < self.LOW_FILL and (idle is None or idle > self.IDLE_GROW):
+            reader_id = self.pool.grow()
+            if reader_id is not None:
+                print(f"📈 Queue {fill:.0%} full, encoders idle: started Reader-{reader_id} "
+                      f"({self.pool.active} active)")
+        elif fill > self.HIGH_FILL and (idle is None or idle < self.IDLE_SHRINK) \
+                and self.pool.active > self.min_readers:
+            reader_id = self.pool.shrink()
+            if reader_id is not None:
+                print(f"📉 Queue {fill:.0%} full: retiring Reader-{reader_id} ({self.pool.active} active)")
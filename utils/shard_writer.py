@@ -0,0 +1,372 @@
+"""
+Shard writers: the on-disk formats an AudioWorker can write its records in.
+
+Every writer writes one shard file. Rotation, naming and atomic finalization stay in
+AudioWorker, so all formats share the same `{prefix}-worker{rank}-{idx}` layout
+(`{prefix}-node{rank}-worker{rank}-{idx}` in multi-node runs).
+
+- jsonl.gz: one JSON object per line, gzip compressed (the original format)
+- parquet:  columnar, zstd compressed row groups
+- arrow:    Arrow IPC stream with the same schema, memory-mappable without decoding
+
+The columnar formats keep the int64 types `load_dataset("json")` gives the jsonl.gz records.
+With `compact_tokens`, `snac_layer_N` is stored as list<int16> and `token_lengths`/`num_layers`
+as int32 instead.
+
+`iter_shard_records` reads finished shards of any format back, for tools that post-process them.
+`match_shards` picks the shards of one dataset out of a directory listing by that exact layout,
+so a dataset `libritts` never takes the shards of `libritts-r`.
+"""
+
+import gzip
+import io
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Type
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.metrics import Metrics, timed
+
+try:
+    import orjson
+    USE_ORJSON = True
+except Exception:
+    import json
+    USE_ORJSON = False
+
+
+class ShardWriter:
+    """Base class for writers of a single shard file"""
+
+    extension = ""
+    builder = ""
+
+    def __init__(self, path: str, num_layers: int, gzip_level: int = 1,
+                 buffer_size: int = 16777216, row_group_size: int = 50000, compress_threads: int = 1,
+                 compact_tokens: bool = False, metrics: Optional[Metrics] = None):
+        self.path = path
+        self.metrics = metrics
+        self.num_layers = num_layers
+        self.gzip_level = gzip_level
+        self.buffer_size = buffer_size
+        self.row_group_size = row_group_size
+        self.compress_threads = compress_threads
+        self.compact_tokens = compact_tokens
+
+    def write(self, rec: dict) -> None:
+        """Writes one record"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Flushes and closes the shard"""
+        raise NotImplementedError
+
+
+class _TimedFile(io.RawIOBase):
+    """Raw file wrapper that records the time spent in writes as the file_io stage"""
+
+    def __init__(self, f, metrics: Metrics):
+        self.f = f
+        self.metrics = metrics
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        with self.metrics.time("file_io"):
+            return self.f.write(b)
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+class JsonlGzShardWriter(ShardWriter):
+    """
+    Writes records as gzip-compressed JSON lines
+
+    With compress_threads > 1, lines are collected into blocks of PARALLEL_BLOCK_BYTES that
+    are compressed concurrently (zlib releases the GIL) and written in order as separate gzip
+    members. A multi-member file is still a valid .gz file and decompresses to the same lines.
+    """
+
+    extension = ".jsonl.gz"
+    builder = "json"
+
+    PARALLEL_BLOCK_BYTES = 1 << 20
+
+    def __init__(self, path: str, num_layers: int, **kwargs):
+        super().__init__(path, num_layers, **kwargs)
+        self.raw = open(path, "wb", buffering=0)
+        if self.metrics is not None:
+            self.raw = _TimedFile(self.raw, self.metrics)
+        self.buf = io.BufferedWriter(self.raw, buffer_size=self.buffer_size)
+        self.pool = None
+        if self.compress_threads > 1:
+            self.pool = ThreadPoolExecutor(max_workers=self.compress_threads)
+            self.blocks = deque()
+            self.gz = io.BytesIO()
+            self.txt = io.TextIOWrapper(self.gz, encoding="utf-8", newline="\n", write_through=True)
+        else:
+            self.gz = gzip.GzipFile(fileobj=self.buf, mode="wb", compresslevel=self.gzip_level, mtime=0)
+            self.txt = io.TextIOWrapper(self.gz, encoding="utf-8", newline="\n")
+
+    def _dump_line(self, obj, gz, txt):
+        """Writes line to file"""
+        if USE_ORJSON:
+            with timed(self.metrics, "serialize"):
+                b = orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+            with timed(self.metrics, "compress"):
+                gz.write(b)
+                gz.write(b"\n")
+        else:
+            with timed(self.metrics, "serialize"):
+                for i in range(1, self.num_layers + 1):
+                    k = f"snac_layer_{i}"
+                    if k in obj and hasattr(obj[k], "tolist"):
+                        obj[k] = obj[k].tolist()
+                if "token_lengths" in obj and hasattr(obj["token_lengths"], "tolist"):
+                    obj["token_lengths"] = obj["token_lengths"].tolist()
+                line = json.dumps(obj, ensure_ascii=False)
+            with timed(self.metrics, "compress"):
+                txt.write(line)
+                txt.write("\n")
+
+    def write(self, rec: dict) -> None:
+        self._dump_line(rec, self.gz, self.txt)
+        if self.pool is not None and self.gz.tell() >= self.PARALLEL_BLOCK_BYTES:
+            self._submit_block()
+
+    def _submit_block(self):
+        """Hands the current block to the compression pool and writes finished blocks in order"""
+        data = self.gz.getvalue()
+        self.gz.seek(0)
+        self.gz.truncate()
+        if data:
+            self.blocks.append(self.pool.submit(self._compress_block, data))
+        while self.blocks and (self.blocks[0].done() or len(self.blocks) > 2 * self.compress_threads):
+            self.buf.write(self.blocks.popleft().result())
+
+    def _compress_block(self, data: bytes) -> bytes:
+        """Compresses one block into a standalone gzip member (runs on the compression pool)"""
+        with timed(self.metrics, "compress_block"):
+            return gzip.compress(data, self.gzip_level, mtime=0)
+
+    def close(self) -> None:
+        """Closes every layer of the file, then raises the first flush or close error"""
+        error = None
+        if self.pool is not None:
+            try:
+                self._submit_block()
+                while self.blocks:
+                    self.buf.write(self.blocks.popleft().result())
+            finally:
+                self.pool.shutdown()
+                self.txt.detach()
+                self.txt = self.gz = None
+        for f, name in [(self.txt, "txt"), (self.gz, "gz"), (self.buf, "buf"), (self.raw, "raw")]:
+            try:
+                # Closing a layer closes the ones below it
+                if f is not None and not f.closed:
+                    if hasattr(f, 'flush'):
+                        f.flush()
+                    if hasattr(f, 'detach') and name == "txt":
+                        f.detach()
+                    elif hasattr(f, 'close'):
+                        f.close()
+            except Exception as e:
+                # A shard that did not reach the disk in full must not be finalized
+                error = error or e
+        if error is not None:
+            raise error
+
+
+def _token_list_array(values: List[np.ndarray], compact: bool = False) -> pa.Array:
+    """Builds a list<int64> (list<int16> if compact) column from per-record token arrays without per-element conversion"""
+    lengths = np.fromiter((v.shape[0] for v in values), dtype=np.int32, count=len(values))
+    offsets = np.zeros(len(values) + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    flat = np.concatenate(values) if values else np.zeros(0, dtype=np.int64)
+    if not compact:
+        return pa.ListArray.from_arrays(pa.array(offsets), pa.array(flat.astype(np.int64)))
+    if flat.size and (flat.min() < 0 or flat.max() > np.iinfo(np.int16).max):
+        raise ValueError("Token ids do not fit into int16")
+    return pa.ListArray.from_arrays(pa.array(offsets), pa.array(flat.astype(np.int16)))
+
+
+def records_to_table(records: List[dict], num_layers: int, compact: bool = False) -> pa.Table:
+    """Converts encoded records into an Arrow table; `compact` narrows the token columns to int16/int32"""
+    keys: List[str] = []
+    for rec in records:
+        for key in rec:
+            if key not in keys:
+                keys.append(key)
+
+    layer_keys = {f"snac_layer_{i}" for i in range(1, num_layers + 1)}
+    count_type = pa.int32() if compact else pa.int64()
+    columns: Dict[str, pa.Array] = {}
+    for key in keys:
+        if key in layer_keys:
+            columns[key] = _token_list_array([np.asarray(r[key]).reshape(-1) for r in records], compact)
+        elif key == "token_lengths":
+            columns[key] = pa.array([list(map(int, r[key])) for r in records], type=pa.list_(count_type))
+        elif key == "num_layers":
+            columns[key] = pa.array([r[key] for r in records], type=count_type)
+        else:
+            columns[key] = pa.array([r.get(key) for r in records])
+    return pa.table(columns)
+
+
+class _ArrowBufferedWriter(ShardWriter):
+    """Buffers records and writes them to an Arrow-based file one row group at a time"""
+
+    def __init__(self, path: str, num_layers: int, **kwargs):
+        super().__init__(path, num_layers, **kwargs)
+        self.pending: List[dict] = []
+        self.schema = None
+        self.writer = None
+
+    def _open(self, schema: pa.Schema):
+        raise NotImplementedError
+
+    def _flush(self):
+        if not self.pending:
+            return
+        with timed(self.metrics, "serialize"):
+            table = records_to_table(self.pending, self.num_layers, self.compact_tokens)
+            self.pending = []
+            if self.writer is None:
+                self.schema = table.schema
+                self.writer = self._open(self.schema)
+            else:
+                table = table.select(self.schema.names).cast(self.schema)
+        with timed(self.metrics, "write_table"):
+            self.writer.write_table(table)
+
+    def write(self, rec: dict) -> None:
+        self.pending.append(rec)
+        if len(self.pending) >= self.row_group_size:
+            self._flush()
+
+    def close(self) -> None:
+        try:
+            self._flush()
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+
+class ParquetShardWriter(_ArrowBufferedWriter):
+    """Writes records as a zstd-compressed Parquet file"""
+
+    extension = ".parquet"
+    builder = "parquet"
+
+    def _open(self, schema: pa.Schema):
+        return pq.ParquetWriter(self.path, schema, compression="zstd")
+
+
+class ArrowShardWriter(_ArrowBufferedWriter):
+    """Writes records as an uncompressed Arrow IPC stream"""
+
+    extension = ".arrow"
+    builder = "arrow"
+
+    def _open(self, schema: pa.Schema):
+        return pa.ipc.new_stream(self.path, schema)
+
+
+SHARD_WRITERS: Dict[str, Type[ShardWriter]] = {
+    "jsonl.gz": JsonlGzShardWriter,
+    "parquet": ParquetShardWriter,
+    "arrow": ArrowShardWriter,
+}
+
+SHARD_EXTENSIONS = tuple(cls.extension for cls in SHARD_WRITERS.values())
+
+# Shard tag of a worker: workerNN, or nodeNN-workerNN in multi-node runs
+SHARD_TAG = r"(?:node\d+-)?worker\d+"
+
+
+def shard_name_pattern(prefix: str, tag: str = "") -> "re.Pattern":
+    """
+    Matches the names of a dataset's shards, `{prefix}-{tag}-{idx}{extension}`, and of the files
+    named after them (tmp files, sidecars). Group 1 is the file index, group 2 what follows the
+    extension. A tag (e.g. "node01" or "node01-worker00") limits it to the shards of that tag
+    """
+    tag_re = rf"(?:{re.escape(tag)}|{re.escape(tag)}-worker\d+)" if tag else SHARD_TAG
+    extensions = "|".join(re.escape(ext) for ext in SHARD_EXTENSIONS)
+    return re.compile(rf"^{re.escape(prefix)}-{tag_re}-(\d+)(?:{extensions})(.*)$")
+
+
+def match_shards(names: Iterable[str], prefix: str, tag: str = "") -> List[str]:
+    """The finished shard names of a dataset among file names, in name order"""
+    pattern = shard_name_pattern(prefix, tag)
+    shards = []
+    for name in names:
+        m = pattern.match(name)
+        if m and not m.group(2):
+            shards.append(name)
+    return sorted(shards)
+
+
+def get_shard_writer(shard_format: str) -> Type[ShardWriter]:
+    """Returns the writer class for a shard format name"""
+    if shard_format not in SHARD_WRITERS:
+        raise ValueError(
+            f"Unknown shard_format '{shard_format}'. Choose one of: {', '.join(SHARD_WRITERS)}"
+        )
+    return SHARD_WRITERS[shard_format]
+
+
+def shard_writer_for_path(path: str) -> Type[ShardWriter]:
+    """Returns the writer class of a finished shard file from its extension"""
+    for cls in SHARD_WRITERS.values():
+        if path.endswith(cls.extension):
+            return cls
+    raise ValueError(f"Not a shard file: {path}")
+
+
+def _iter_jsonl_gz(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line) if USE_ORJSON else json.loads(line)
+
+
+def _iter_table_batches(batches) -> Iterator[Dict[str, Any]]:
+    """Yields rows of Arrow record batches, with snac_layer_N columns as numpy views"""
+    for batch in batches:
+        layer_columns, other_columns = {}, {}
+        for name, column in zip(batch.schema.names, batch.columns):
+            if name.startswith("snac_layer_") and pa.types.is_list(column.type):
+                values = column.values.to_numpy(zero_copy_only=False)
+                offsets = column.offsets.to_numpy()
+                layer_columns[name] = (values, offsets)
+            else:
+                other_columns[name] = column.to_pylist()
+        for row in range(batch.num_rows):
+            rec = {name: values[row] for name, values in other_columns.items()}
+            for name, (values, offsets) in layer_columns.items():
+                rec[name] = values[offsets[row]:offsets[row + 1]]
+            yield rec
+
+
+def iter_shard_records(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Iterates over the records of a finished shard in any shard format, in write order.
+    Token layers come back as lists (jsonl.gz) or numpy arrays (parquet, arrow).
+    """
+    cls = shard_writer_for_path(path)
+    if cls is JsonlGzShardWriter:
+        yield from _iter_jsonl_gz(path)
+    elif cls is ParquetShardWriter:
+        yield from _iter_table_batches(pq.ParquetFile(path).iter_batches())
+    else:
+        with pa.memory_map(path) as source:
+            yield from _iter_table_batches(pa.ipc.open_stream(source))
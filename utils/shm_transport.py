@@ -0,0 +1,292 @@
+"""
+Zero-copy waveform transport between reader and worker processes.
+
+Readers write waveforms as float32 into a shared-memory slab (one ring per reader)
+and only send a small WaveRef descriptor through the sample queue. Workers map the
+descriptor to a numpy view of the slab and hand the slot back once encoding is done.
+Because a reader blocks when its slab is full, backpressure is bounded by bytes
+rather than by the number of queued items. Slots are reclaimed in allocation order,
+so a slab should be large enough to hold everything a worker keeps pending in its
+length buckets (roughly max_padded_samples per worker).
+
+Every slot starts with a header word naming the worker that took it (its owner tag), so
+the slots of a worker that crashed can be handed back to their readers.
+"""
+
+import multiprocessing as mp
+import queue
+import time
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+# Owner tag of a slot no worker has taken yet
+UNTAKEN = -1
+
+
+class WaveRef(NamedTuple):
+    """Location of a waveform inside a shared-memory slab (in float32 samples)"""
+    slab: int
+    offset: int
+    length: int
+
+
+def owner_tag(rank: int, generation: int) -> int:
+    """Owner tag of a worker process, unique across restarts of its rank"""
+    return generation << 16 | rank
+
+
+def _attach(name: str) -> SharedMemory:
+    """Attaches to an existing shared-memory block without taking ownership of it"""
+    return SharedMemory(name=name, create=False)
+
+
+class RingWriter:
+    """Reader-side allocator of one shared-memory slab, used as a ring buffer"""
+
+    def __init__(self, slab: int, name: str, capacity: int, release_q: mp.Queue):
+        self.slab = slab
+        self.name = name
+        self.capacity = capacity
+        self.release_q = release_q
+        self._shm = None
+        self._buf = None
+        self._owners = None
+        self._head = 0
+        self._pending = deque()
+        self._released = set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shm"] = None
+        state["_buf"] = None
+        state["_owners"] = None
+        return state
+
+    def _ensure_attached(self):
+        """Maps the slab into this process on first use"""
+        if self._buf is None:
+            self._shm = _attach(self.name)
+            self._buf = np.ndarray((self.capacity,), dtype=np.float32, buffer=self._shm.buf)
+            self._owners = np.ndarray((self.capacity,), dtype=np.int32, buffer=self._shm.buf)
+
+    def _take(self, msg):
+        """Records a message of the release queue: a released slot, or ("lost", owner) for a crashed worker"""
+        if isinstance(msg, tuple):
+            _, owner = msg
+            self._released.update(start for start, _ in self._pending if self._owners[start] == owner)
+        else:
+            self._released.add(msg)
+
+    def _collect(self, block: bool):
+        """Takes released slots from workers and advances the ring tail"""
+        while True:
+            try:
+                msg = self.release_q.get(block=block)
+            except queue.Empty:
+                break
+            self._take(msg)
+            block = False
+
+        while self._pending and self._pending[0][0] in self._released:
+            offset, _ = self._pending.popleft()
+            self._released.discard(offset)
+
+    def _find_space(self, n: int) -> Optional[int]:
+        """Returns a free offset for n samples, or None if the ring is full"""
+        if not self._pending:
+            self._head = 0
+            return 0
+
+        tail = self._pending[0][0]
+        wrapped = self._pending[-1][0] < tail
+        if not wrapped:
+            if self.capacity - self._head >= n:
+                return self._head
+            if tail >= n:
+                return 0
+            return None
+
+        if tail - self._head >= n:
+            return self._head
+        return None
+
+    def put(self, wave: np.ndarray) -> Optional[WaveRef]:
+        """
+        Copies a waveform into the slab, blocking until enough space is released.
+        Returns None if the waveform is larger than the whole slab.
+        """
+        wave = wave.reshape(-1)
+        n = wave.shape[0]
+        if n >= self.capacity:
+            return None
+        if n == 0:
+            return WaveRef(self.slab, 0, 0)
+
+        self._ensure_attached()
+        self._collect(block=False)
+
+        # The slot is the owner header followed by the samples
+        start = self._find_space(n + 1)
+        while start is None:
+            self._collect(block=True)
+            start = self._find_space(n + 1)
+
+        self._owners[start] = UNTAKEN
+        self._buf[start + 1:start + 1 + n] = wave
+        self._pending.append((start, n + 1))
+        self._head = start + 1 + n
+        return WaveRef(self.slab, start + 1, n)
+
+    def drain(self, timeout: float = 300.0) -> bool:
+        """
+        Waits until workers have released every slot, so another process can take over
+        the slab. Returns False if slots are still in use after the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        self._collect(block=False)
+        while self._pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                self._take(self.release_q.get(timeout=remaining))
+            except queue.Empty:
+                return False
+            self._collect(block=False)
+        return True
+
+    def close(self):
+        """Unmaps the slab from this process"""
+        self._buf = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+
+class RingReader:
+    """Worker-side access to all reader slabs"""
+
+    def __init__(self, names: List[str], capacities: List[int], release_qs: List[mp.Queue], owner: int = UNTAKEN):
+        self.names = names
+        self.capacities = capacities
+        self.release_qs = release_qs
+        self.owner = owner
+        self._shms: Dict[int, SharedMemory] = {}
+        self._bufs: Dict[int, np.ndarray] = {}
+        self._owners: Dict[int, np.ndarray] = {}
+        self._cancelled = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shms"] = {}
+        state["_bufs"] = {}
+        state["_owners"] = {}
+        state["_cancelled"] = False
+        return state
+
+    def view(self, ref: WaveRef) -> np.ndarray:
+        """Returns a zero-copy float32 view of a waveform"""
+        buf = self._bufs.get(ref.slab)
+        if buf is None:
+            shm = _attach(self.names[ref.slab])
+            buf = np.ndarray((self.capacities[ref.slab],), dtype=np.float32, buffer=shm.buf)
+            self._shms[ref.slab] = shm
+            self._bufs[ref.slab] = buf
+            self._owners[ref.slab] = np.ndarray((self.capacities[ref.slab],), dtype=np.int32, buffer=shm.buf)
+        return buf[ref.offset:ref.offset + ref.length]
+
+    def take(self, ref: WaveRef) -> np.ndarray:
+        """Marks a slot as held by this worker and returns a zero-copy view of its waveform"""
+        wave = self.view(ref)
+        if ref.length:
+            self._owners[ref.slab][ref.offset - 1] = self.owner
+        return wave
+
+    def release(self, ref: WaveRef):
+        """Hands a slot back to the reader that owns it"""
+        if ref.length == 0:
+            return
+        if not self._cancelled:
+            # Readers may exit before draining the last releases; never block on them at exit
+            for q in self.release_qs:
+                q.cancel_join_thread()
+            self._cancelled = True
+        self.release_qs[ref.slab].put(ref.offset - 1)
+
+    def close(self):
+        """Unmaps all slabs from this process"""
+        self._bufs.clear()
+        self._owners.clear()
+        for shm in self._shms.values():
+            shm.close()
+        self._shms.clear()
+
+
+class SharedWaveTransport:
+    """Owns the shared-memory slabs and release queues for one pipeline run"""
+
+    def __init__(self, num_slabs: int, slab_bytes: int):
+        self.capacity = slab_bytes // np.dtype(np.float32).itemsize
+        self._slabs = [
+            SharedMemory(create=True, size=self.capacity * np.dtype(np.float32).itemsize)
+            for _ in range(num_slabs)
+        ]
+        self.names = [shm.name for shm in self._slabs]
+        self.release_qs = [mp.Queue() for _ in range(num_slabs)]
+
+    def writer(self, slab: int) -> RingWriter:
+        """Creates the writer for a reader's slab"""
+        return RingWriter(slab, self.names[slab], self.capacity, self.release_qs[slab])
+
+    def reader(self, owner: int = UNTAKEN) -> RingReader:
+        """Creates a reader that can view every slab, marking the slots it takes with an owner tag"""
+        return RingReader(self.names, [self.capacity] * len(self.names), self.release_qs, owner)
+
+    def release_owner(self, owner: int):
+        """
+        Hands back the slots held by a worker that crashed: each reader frees the slots
+        marked with the worker's owner tag when it next collects releases
+        """
+        for q in self.release_qs:
+            q.put(("lost", owner))
+
+    def close(self):
+        """Releases the shared-memory slabs"""
+        for shm in self._slabs:
+            try:
+                shm.close()
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._slabs = []
+
+
+def pack_item(item: dict, writer: Optional[RingWriter]) -> dict:
+    """Moves an item's waveform into shared memory, keeping it inline if it does not fit"""
+    if writer is None:
+        return item
+    ref = writer.put(item["wave"])
+    if ref is None:
+        item["wave"] = np.asarray(item["wave"], dtype=np.float32)
+    else:
+        item["wave"] = ref
+    return item
+
+
+def unpack_item(item: dict, reader: Optional[RingReader]) -> dict:
+    """Replaces an item's WaveRef with a zero-copy view, remembering the ref for release"""
+    if reader is not None and isinstance(item.get("wave"), WaveRef):
+        item["_wave_ref"] = item["wave"]
+        item["wave"] = reader.take(item["wave"])
+    return item
+
+
+def release_item(item: dict, reader: Optional[RingReader]):
+    """Returns an item's shared-memory slot, if it has one"""
+    ref = item.pop("_wave_ref", None)
+    if reader is not None and ref is not None:
+        item["wave"] = None
+        reader.release(ref)
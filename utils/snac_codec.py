@@ -1,23 +1,152 @@
+import contextlib
+import hashlib
+import json
+import os
 import torch
 import numpy as np
+from typing import Dict, List, Optional, Union
 from snac import SNAC
+from utils.metrics import Metrics, timed
+
+PRECISIONS = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+# Default model cache directory inside OUT_DIR
+MODEL_CACHE_DIR = "_model_cache"
+
+# "random:<name>" model ids build a tiny randomly initialized SNAC with the named model's
+# sample rate, strides and number of layers, for benchmarks that run fast and offline
+RANDOM_MODEL_PREFIX = "random:"
+RANDOM_MODELS = {
+    "snac_24khz": dict(sampling_rate=24000, encoder_rates=[2, 4, 8, 8], decoder_rates=[8, 8, 4, 2],
+                       attn_window_size=None, vq_strides=[4, 2, 1]),
+    "snac_32khz": dict(sampling_rate=32000, encoder_rates=[2, 3, 8, 8], decoder_rates=[8, 8, 3, 2],
+                       attn_window_size=32, vq_strides=[8, 4, 2, 1]),
+    "snac_44khz": dict(sampling_rate=44100, encoder_rates=[2, 3, 8, 8], decoder_rates=[8, 8, 3, 2],
+                       attn_window_size=32, vq_strides=[8, 4, 2, 1]),
+}
+RANDOM_MODEL_DIMS = dict(encoder_dim=16, decoder_dim=64)
+
+
+def random_model_config(model_id: str) -> dict:
+    """SNAC config of a "random:" model id (e.g. random:snac_24khz)"""
+    name = model_id[len(RANDOM_MODEL_PREFIX):].split("/")[-1]
+    if name not in RANDOM_MODELS:
+        raise ValueError(f"❌ Unknown random model {model_id!r}, expected one of "
+                         f"{', '.join(RANDOM_MODEL_PREFIX + n for n in RANDOM_MODELS)}")
+    return {**RANDOM_MODELS[name], **RANDOM_MODEL_DIMS}
+
+
+def _from_pretrained(model_id: str) -> SNAC:
+    """SNAC.from_pretrained, or a tiny random model (seeded, so identical in every process) for "random:" ids"""
+    if not model_id.startswith(RANDOM_MODEL_PREFIX):
+        return SNAC.from_pretrained(model_id)
+    with torch.random.fork_rng():
+        torch.manual_seed(0)
+        return SNAC(**random_model_config(model_id))
+
+
+def _model_cache_path(model_id: str, cache_dir: str) -> str:
+    """Cache directory of a model; local model directories are keyed by their weights' modification time too"""
+    key = model_id
+    weights = os.path.join(model_id, "pytorch_model.bin")
+    if os.path.isdir(model_id) and os.path.exists(weights):
+        key += f"|{os.path.getmtime(weights)}"
+    name = os.path.basename(model_id.rstrip("/")).replace(":", "-") or "model"
+    return os.path.join(cache_dir, f"{name}-{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}")
+
+
+def cache_model(model_id: str, cache_dir: str) -> str:
+    """
+    Stores a model's config and state_dict in the model cache unless they are there already.
+    Returns the model's cache directory
+    """
+    path = _model_cache_path(model_id, cache_dir)
+    if os.path.exists(os.path.join(path, "state_dict.pt")):
+        return path
+    if model_id.startswith(RANDOM_MODEL_PREFIX):
+        config = random_model_config(model_id)
+    else:
+        if os.path.isdir(model_id):
+            config_path = os.path.join(model_id, "config.json")
+        else:
+            from huggingface_hub import hf_hub_download
+            config_path = hf_hub_download(repo_id=model_id, filename="config.json")
+        with open(config_path) as f:
+            config = json.load(f)
+    model = _from_pretrained(model_id)
+    os.makedirs(path, exist_ok=True)
+    tmp = f".{os.getpid()}.tmp"
+    with open(os.path.join(path, "config.json") + tmp, "w") as f:
+        json.dump(config, f)
+    os.replace(os.path.join(path, "config.json") + tmp, os.path.join(path, "config.json"))
+    torch.save(model.state_dict(), os.path.join(path, "state_dict.pt") + tmp)
+    # The state_dict is written last, so its presence means the cache entry is complete
+    os.replace(os.path.join(path, "state_dict.pt") + tmp, os.path.join(path, "state_dict.pt"))
+    return path
+
+
+@contextlib.contextmanager
+def _skip_init():
+    """Builds layers without initializing their weights, for models whose weights are loaded right after"""
+    layers = (torch.nn.modules.conv._ConvNd, torch.nn.Linear, torch.nn.Embedding)
+    originals = [layer.reset_parameters for layer in layers]
+    for layer in layers:
+        layer.reset_parameters = lambda self: None
+    try:
+        yield
+    finally:
+        for layer, original in zip(layers, originals):
+            layer.reset_parameters = original
+
+
+def load_model(model_id: str, cache_dir: Optional[str] = None) -> SNAC:
+    """
+    Loads a SNAC model, from the model cache if cache_dir is set. The model is built without
+    initializing its weights and the cached weights are memory-mapped into it, so loading copies
+    no weights and several workers on one machine share the pages
+    """
+    if not cache_dir:
+        return _from_pretrained(model_id).eval()
+    path = cache_model(model_id, cache_dir)
+    with open(os.path.join(path, "config.json")) as f:
+        config = json.load(f)
+    with _skip_init():
+        model = SNAC(**config)
+    state_dict = torch.load(os.path.join(path, "state_dict.pt"), map_location="cpu", mmap=True, weights_only=True)
+    model.load_state_dict(state_dict, assign=True)
+    return model.eval()
+
+
+def resolve_device(device: Union[int, str, torch.device]) -> torch.device:
+    """Turns a CUDA device index or a device string into a torch.device"""
+    if isinstance(device, int):
+        return torch.device(f"cuda:{device}")
+    return torch.device(device)
 
 
 class SNACCoder:
-    def __init__(self, device_rank: int, model_id: str = "hubertsiuzdak/snac_24khz"):
+    metrics: Optional[Metrics] = None
+    precision: str = "fp32"
+    compiled = None
+
+    def __init__(self, device: Union[int, str, torch.device], model_id: str = "hubertsiuzdak/snac_24khz",
+                 cache_dir: Optional[str] = None):
         """
         Initialize SNAC codec
         
         Args:
-            device_rank: CUDA device index
+            device: CUDA device index, or a torch device string such as "cpu" or "cuda:1"
             model_id: SNAC model ID
                 - "hubertsiuzdak/snac_24khz" (3 layers, 0.98 kbps, speech)
                 - "hubertsiuzdak/snac_32khz" (4 layers, 1.9 kbps, music/SFX)
                 - "hubertsiuzdak/snac_44khz" (4 layers, 2.6 kbps, music/SFX)
+                - "random:snac_24khz" etc. (tiny random model of the same shape, for benchmarks)
+            cache_dir: Model cache directory to load memory-mapped weights from (None = load from the Hub)
         """
-        self.snac_model = SNAC.from_pretrained(model_id).eval()
-        self.device = torch.device(f"cuda:{device_rank}")
-        torch.cuda.set_device(self.device)
+        self.snac_model = load_model(model_id, cache_dir)
+        self.device = resolve_device(device)
+        if self.device.type == "cuda":
+            torch.cuda.set_device(self.device)
         self.snac_model = self.snac_model.to(self.device)
         self.model_id = model_id
         
@@ -28,6 +157,81 @@ class SNACCoder:
         else:
             self.num_layers = None
 
+        lcm = int(np.lcm(self.snac_model.vq_strides[0], self.snac_model.attn_window_size or 1))
+        self.pad_to = int(self.snac_model.hop_length) * lcm
+        self.set_chunking(0.0, 0.0)
+
+    def set_chunking(self, chunk_seconds: float, overlap_seconds: float, max_batch_samples: int = 0):
+        """
+        Enable chunked encoding of waveforms longer than chunk_seconds (0 disables it)
+
+        Chunk and overlap lengths are rounded up to the codec's alignment (hop length times
+        the coarsest layer stride and attention window), so every chunk boundary falls on a
+        token boundary of every layer. Windows of equal length are encoded together, at most
+        max_batch_samples padded samples per forward pass.
+        """
+        sampling_rate = self.snac_model.sampling_rate
+        strides = list(self.snac_model.vq_strides) + [self.snac_model.attn_window_size or 1]
+        self.chunk_align = int(self.snac_model.hop_length) * int(np.lcm.reduce(strides))
+        align = lambda seconds: -(-int(seconds * sampling_rate) // self.chunk_align) * self.chunk_align
+        self.chunk_samples = align(chunk_seconds) if chunk_seconds > 0 else 0
+        self.chunk_overlap = align(overlap_seconds) if overlap_seconds > 0 else 0
+        window = self.chunk_samples + 2 * self.chunk_overlap
+        self.chunk_batch_size = max(1, max_batch_samples // window) if window else 1
+
+    def set_inference_mode(self, precision: str = "fp32", compile_model: bool = False,
+                           compile_mode: str = "default", cudnn_benchmark: bool = False, tf32: bool = False):
+        """
+        Select how the encoder runs (the defaults are float32 eager mode)
+
+        Args:
+            precision: "fp32", or "bf16"/"fp16" to run the encoder under autocast
+            compile_model: Compile the encoder with torch.compile. Batches are padded to a
+                power-of-two number of rows and the sample axis is marked dynamic, so a run
+                compiles a handful of graphs instead of one per batch shape
+            compile_mode: torch.compile mode ("default", "reduce-overhead", "max-autotune")
+            cudnn_benchmark: Let cuDNN pick the fastest convolution algorithms (CUDA only)
+            tf32: Allow TF32 matmuls on Ampere and newer GPUs (CUDA only)
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"❌ Unknown precision {precision!r}, expected one of {', '.join(PRECISIONS)}")
+        if precision == "bf16" and self.device.type == "cuda" and not torch.cuda.is_bf16_supported():
+            raise ValueError(f"❌ {self.device} does not support bf16")
+        self.precision = precision
+        self.compiled = torch.compile(self._encode_aligned, mode=compile_mode) if compile_model else None
+        if self.device.type == "cuda":
+            torch.backends.cudnn.benchmark = cudnn_benchmark
+            if tf32:
+                torch.backends.cuda.matmul.allow_tf32 = True
+
+    @property
+    def fast_mode(self) -> bool:
+        """Whether the encoder runs in anything other than float32 eager mode"""
+        return self.precision != "fp32" or self.compiled is not None
+
+    def cache_namespace(self) -> str:
+        """Everything besides the waveform that determines the codes, for content-addressed caching"""
+        namespace = (f"{self.model_id}|{self.snac_model.sampling_rate}|"
+                     f"chunk={self.chunk_samples}|overlap={self.chunk_overlap}")
+        if self.precision != "fp32":
+            namespace += f"|precision={self.precision}"
+        if self.compiled is not None:
+            namespace += "|compiled"
+        return namespace
+
+    def needs_chunking(self, num_samples: int) -> bool:
+        """Whether a waveform of this length is encoded in chunks"""
+        return 0 < self.chunk_samples < num_samples
+
+    def padded_length(self, num_samples: int) -> int:
+        """Length (in samples) the model right-pads a waveform to before encoding"""
+        return max(1, -(-num_samples // self.pad_to)) * self.pad_to
+
+    def token_lengths_for(self, padded_length: int) -> List[int]:
+        """Number of tokens per layer produced for a padded waveform length"""
+        frames = padded_length // int(self.snac_model.hop_length)
+        return [-(-frames // stride) for stride in self.snac_model.vq_strides]
+
     def __call__(self, waveform: np.ndarray) -> dict:
         """
         Encode audio waveform to SNAC tokens
@@ -38,23 +242,274 @@ class SNACCoder:
         Returns:
             Dictionary with encoded tokens at each layer and metadata
         """
-        audio_tensor = torch.from_numpy(waveform).unsqueeze(dim=0)
-        if audio_tensor.dim() == 2:
-            audio_tensor = audio_tensor.unsqueeze(1)
-        audio_tensor = audio_tensor.to(dtype=torch.float32)
-        audio_tensor = audio_tensor.to(self.device)
+        if self.needs_chunking(waveform.shape[-1]):
+            return self.encode_chunked(waveform)
+
+        with timed(self.metrics, "h2d"):
+            audio_tensor = torch.from_numpy(waveform).unsqueeze(dim=0)
+            if audio_tensor.dim() == 2:
+                audio_tensor = audio_tensor.unsqueeze(1)
+            audio_tensor = audio_tensor.to(dtype=torch.float32)
+            audio_tensor = audio_tensor.to(self.device)
+            self._sync_for_timing()
         
-        with torch.inference_mode():
-            codes = self.snac_model.encode(audio_tensor)
+        with timed(self.metrics, "encode"):
+            codes = self._encode(audio_tensor)
+            self._sync_for_timing()
         
         if self.num_layers is None:
             self.num_layers = len(codes)
         
         encoded_audio = {}
-        for i, code in enumerate(codes, start=1):
-            encoded_audio[f'snac_layer_{i}'] = code.squeeze().cpu().numpy()
+        with timed(self.metrics, "d2h"):
+            for i, code in enumerate(codes, start=1):
+                encoded_audio[f'snac_layer_{i}'] = code.squeeze().cpu().numpy()
         
         encoded_audio['num_layers'] = self.num_layers
         encoded_audio['token_lengths'] = [code.shape[1] for code in codes]
         
         return encoded_audio
+
+    def encode_batch(self, waveforms: List[np.ndarray]) -> List[dict]:
+        """
+        Encode several waveforms with as few forward passes as possible
+
+        Waveforms are grouped by padded length, so every forward pass sees exactly
+        the zero padding the single-item path would add and the codes are identical
+        to calling the coder once per waveform.
+
+        Args:
+            waveforms: List of mono audio waveforms as numpy arrays
+
+        Returns:
+            List of dictionaries in the same format as __call__, in input order
+        """
+        groups: Dict[int, List[int]] = {}
+        results: List[dict] = [None] * len(waveforms)
+        for idx, wave in enumerate(waveforms):
+            if self.needs_chunking(wave.shape[-1]):
+                results[idx] = self.encode_chunked(wave)
+                continue
+            groups.setdefault(self.padded_length(wave.shape[-1]), []).append(idx)
+
+        for length, indices in groups.items():
+            encoded = self._encode_padded([waveforms[i] for i in indices], length)
+            for idx, enc in zip(indices, encoded):
+                results[idx] = enc
+        return results
+
+    def _encode_padded(self, waveforms: List[np.ndarray], length: int) -> List[dict]:
+        """Encodes waveforms zero-padded to a common length and slices each to its true token lengths"""
+        batch = np.zeros((len(waveforms), 1, length), dtype=np.float32)
+        for row, wave in enumerate(waveforms):
+            wave = wave.reshape(-1)
+            batch[row, 0, :wave.shape[0]] = wave
+
+        codes = self._forward(batch)
+
+        encoded = []
+        for row, wave in enumerate(waveforms):
+            token_lengths = self.token_lengths_for(self.padded_length(wave.shape[-1]))
+            encoded_audio = {}
+            for i, (code, n_tokens) in enumerate(zip(codes, token_lengths), start=1):
+                encoded_audio[f'snac_layer_{i}'] = code[row, :n_tokens]
+            encoded_audio['num_layers'] = self.num_layers
+            encoded_audio['token_lengths'] = token_lengths
+            encoded.append(encoded_audio)
+        return encoded
+
+    def _forward(self, batch: np.ndarray) -> List[np.ndarray]:
+        """Runs the encoder on a float32 (batch, 1, samples) array and returns the codes of every layer"""
+        with timed(self.metrics, "h2d"):
+            audio_tensor = torch.from_numpy(batch).to(self.device)
+            self._sync_for_timing()
+
+        with timed(self.metrics, "encode"):
+            codes = self._encode(audio_tensor)
+            self._sync_for_timing()
+
+        if self.num_layers is None:
+            self.num_layers = len(codes)
+
+        with timed(self.metrics, "d2h"):
+            return [code.cpu().numpy() for code in codes]
+
+    def _encode(self, audio_tensor: torch.Tensor) -> List[torch.Tensor]:
+        """Runs the encoder in the selected inference mode"""
+        autocast = contextlib.nullcontext()
+        if self.precision != "fp32":
+            autocast = torch.autocast(self.device.type, dtype=PRECISIONS[self.precision])
+        with torch.inference_mode(), autocast:
+            if self.compiled is None:
+                return self.snac_model.encode(audio_tensor)
+            # Rows are encoded independently, so zero rows only round the batch up to a cached graph
+            rows, length = audio_tensor.shape[0], audio_tensor.shape[-1]
+            bucket = 1 << (rows - 1).bit_length()
+            audio_tensor = torch.nn.functional.pad(
+                audio_tensor, (0, self.padded_length(length) - length, 0, 0, 0, bucket - rows))
+            torch._dynamo.mark_dynamic(audio_tensor, 2)
+            return [code[:rows] for code in self.compiled(audio_tensor)]
+
+    def _encode_aligned(self, audio_tensor: torch.Tensor) -> List[torch.Tensor]:
+        """SNAC.encode without its padding step, for inputs already padded to pad_to (compiles without graph breaks)"""
+        _, codes = self.snac_model.quantizer(self.snac_model.encoder(audio_tensor))
+        return codes
+
+    def token_agreement(self, waveforms: List[np.ndarray], codes: Optional[List[dict]] = None) -> List[List[int]]:
+        """
+        Compares codes of the selected inference mode with float32 eager codes of the same waveforms
+
+        Args:
+            waveforms: Mono audio waveforms
+            codes: Their codes in the selected mode, as returned by encode_batch (encoded here if None)
+
+        Returns:
+            [mismatched tokens, total tokens] per layer
+        """
+        if codes is None:
+            codes = self.encode_batch(waveforms)
+        precision, compiled, metrics = self.precision, self.compiled, self.metrics
+        self.precision, self.compiled, self.metrics = "fp32", None, None
+        try:
+            reference = self.encode_batch(waveforms)
+        finally:
+            self.precision, self.compiled, self.metrics = precision, compiled, metrics
+
+        counts = [[0, 0] for _ in range(reference[0]['num_layers'] if reference else 0)]
+        for fast, ref in zip(codes, reference):
+            for layer, layer_counts in enumerate(counts, start=1):
+                a, b = np.asarray(fast[f'snac_layer_{layer}']), np.asarray(ref[f'snac_layer_{layer}'])
+                layer_counts[0] += int(np.count_nonzero(a != b))
+                layer_counts[1] += int(b.size)
+        return counts
+
+    def _sync_for_timing(self):
+        """Waits for queued CUDA work when stage timings are recorded, so each stage gets its own time"""
+        if self.metrics is not None and self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+    def encode_chunked(self, waveform: np.ndarray) -> dict:
+        """
+        Encode a long waveform in overlapping windows with bounded memory
+
+        The padded waveform is cut into chunks of chunk_samples. Each chunk is encoded
+        together with chunk_overlap samples of context on both sides, and only the tokens
+        of the chunk itself are kept, so every token sees (almost) the same receptive field
+        as in single-shot encoding. Memory use depends on the window length only.
+
+        Args:
+            waveform: Audio waveform as numpy array (mono audio expected)
+
+        Returns:
+            Dictionary in the same format as __call__
+        """
+        wave = np.asarray(waveform).reshape(-1)
+        total = self.padded_length(wave.shape[0])
+        hop = int(self.snac_model.hop_length)
+        samples_per_token = [hop * stride for stride in self.snac_model.vq_strides]
+
+        windows = []
+        for start in range(0, total, self.chunk_samples):
+            end = min(total, start + self.chunk_samples)
+            windows.append((start, end, max(0, start - self.chunk_overlap), min(total, end + self.chunk_overlap)))
+
+        layers: List[List[np.ndarray]] = [[] for _ in samples_per_token]
+        i = 0
+        while i < len(windows):
+            length = windows[i][3] - windows[i][2]
+            group = [windows[i]]
+            while (i + len(group) < len(windows) and len(group) < self.chunk_batch_size
+                   and windows[i + len(group)][3] - windows[i + len(group)][2] == length):
+                group.append(windows[i + len(group)])
+            i += len(group)
+
+            batch = np.zeros((len(group), 1, length), dtype=np.float32)
+            for row, (_, _, win_start, win_end) in enumerate(group):
+                piece = wave[win_start:win_end]
+                batch[row, 0, :piece.shape[0]] = piece
+
+            codes = self._forward(batch)
+            for row, (start, end, win_start, _) in enumerate(group):
+                for layer, (code, unit) in enumerate(zip(codes, samples_per_token)):
+                    first = (start - win_start) // unit
+                    layers[layer].append(code[row, first:first + (end - start) // unit])
+
+        encoded_audio = {}
+        for i, chunks in enumerate(layers, start=1):
+            encoded_audio[f'snac_layer_{i}'] = np.concatenate(chunks)
+        encoded_audio['num_layers'] = self.num_layers
+        encoded_audio['token_lengths'] = self.token_lengths_for(total)
+        return encoded_audio
+
+
+class SNACDecoder:
+    """Decodes SNAC codes back to waveforms, the decode-side counterpart of SNACCoder"""
+
+    def __init__(self, device: Union[int, str, torch.device], model_id: str = "hubertsiuzdak/snac_24khz",
+                 cache_dir: Optional[str] = None, max_batch_samples: int = 1920000):
+        """
+        Args:
+            device: CUDA device index, or a torch device string such as "cpu" or "cuda:1"
+            model_id: SNAC model ID the codes were encoded with
+            cache_dir: Model cache directory to load memory-mapped weights from (None = load from the Hub)
+            max_batch_samples: Decoded samples per forward pass (rows times waveform length)
+        """
+        self.device = resolve_device(device)
+        if self.device.type == "cuda":
+            torch.cuda.set_device(self.device)
+        self.snac_model = load_model(model_id, cache_dir).to(self.device)
+        self.model_id = model_id
+        self.sampling_rate = int(self.snac_model.sampling_rate)
+        self.strides = [int(stride) for stride in self.snac_model.vq_strides]
+        self.num_layers = len(self.strides)
+        self.max_batch_samples = max_batch_samples
+
+    def decoded_length(self, coarse_tokens: int) -> int:
+        """Waveform length (in samples) decoded from a number of coarsest-layer tokens"""
+        return coarse_tokens * self.strides[0] * int(self.snac_model.hop_length)
+
+    def check_layers(self, layers: List[np.ndarray]) -> int:
+        """Validates the layer lengths of one item against the model's strides. Returns its coarse token count"""
+        if len(layers) != self.num_layers:
+            raise ValueError(f"❌ Expected {self.num_layers} code layers, got {len(layers)}")
+        coarse = len(layers[0])
+        expected = [coarse * self.strides[0] // stride for stride in self.strides]
+        if coarse == 0 or [len(layer) for layer in layers] != expected:
+            raise ValueError(f"❌ Code layer lengths {[len(layer) for layer in layers]} do not match "
+                             f"the model's strides (expected {expected})")
+        return coarse
+
+    def decode_batch(self, codes: List[List[np.ndarray]]) -> List[np.ndarray]:
+        """
+        Decode several items with as few forward passes as possible
+
+        Items are grouped by coarsest-layer token count. Encoded lengths are already aligned
+        to the model's padding quantum, so each group decodes without extra padding and the
+        waveforms equal decoding the items one by one (up to the random noise SNAC's decoder
+        injects, which comes from the torch RNG).
+
+        Args:
+            codes: Per item, its snac_layer_N token arrays (coarsest first)
+
+        Returns:
+            float32 waveforms in input order, each `decoded_length(len(layer 1))` samples long
+        """
+        groups: Dict[int, List[int]] = {}
+        for idx, layers in enumerate(codes):
+            groups.setdefault(self.check_layers(layers), []).append(idx)
+
+        results: List[np.ndarray] = [None] * len(codes)
+        for coarse, indices in groups.items():
+            rows = max(1, self.max_batch_samples // self.decoded_length(coarse))
+            for start in range(0, len(indices), rows):
+                batch = indices[start:start + rows]
+                tensors = [
+                    torch.from_numpy(np.stack([np.asarray(codes[i][layer], dtype=np.int64) for i in batch]))
+                    .to(self.device)
+                    for layer in range(self.num_layers)
+                ]
+                with torch.inference_mode():
+                    audio = self.snac_model.decode(tensors)
+                for i, wave in zip(batch, audio[:, 0].float().cpu().numpy()):
+                    results[i] = wave
+        return results
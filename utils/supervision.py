@@ -0,0 +1,130 @@
+"""
+Failure handling around the encode workers.
+
+Items that keep failing are not retried forever: readers and workers give up on them after
+`item_retries` attempts and report them on report_q as "dead_letter" messages, which the
+manager appends to a `.jsonl` dead-letter log (one line per sample: dataset prefix, source row,
+stage and error). A handful of bad files then costs a handful of log lines, not throughput.
+
+`WorkerSupervisor` runs the encode worker processes. A worker that exits before it is told
+to stop has crashed: it is restarted at the same rank (up to `max_worker_restarts` times),
+and the items it held in its open shards or had taken from the queue are lost. The manager
+then reconciles the affected datasets against the shard manifests once their current round
+is finalized, and reads the rows that are neither in a shard nor dead-lettered again.
+"""
+
+import json
+import multiprocessing as mp
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from utils.resume_manifest import Range, encode_rows
+
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+# Times a dataset is read again after crashes before its still missing rows are dead-lettered
+RECOVERY_ROUNDS = 3
+
+
+def is_oom(e: BaseException) -> bool:
+    """Whether an exception means the device (or host) ran out of memory"""
+    if isinstance(e, MemoryError):
+        return True
+    message = str(e).lower()
+    return isinstance(e, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+
+class DeadLetterLog:
+    """Appends given-up samples to a .jsonl file and remembers their rows per dataset"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.rows: Dict[str, Set[int]] = {}
+        self.count = 0
+
+    def on_dead_letter(self, source: str, payload: Dict[str, Any]):
+        """report_q handler for "dead_letter" messages"""
+        self.add({"source": source, **payload})
+
+    def add(self, entry: Dict[str, Any]):
+        """Appends one entry (called from the metrics thread and the main thread)"""
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+            if entry.get("prefix") is not None and entry.get("row") is not None:
+                self.rows.setdefault(entry["prefix"], set()).add(int(entry["row"]))
+            self.count += 1
+
+    def dead_ranges(self, prefix: str) -> List[Range]:
+        """The dead-lettered rows of a dataset as merged [start, end) ranges"""
+        with self.lock:
+            rows = sorted(self.rows.get(prefix, ()))
+        return [tuple(r) for r in encode_rows(rows)]
+
+
+class WorkerSupervisor:
+    """Runs the encode worker processes and restarts those that exit before they are told to stop"""
+
+    def __init__(self, num_workers: int, spawn: Callable[[int, int], mp.Process], max_restarts: int = 3):
+        """
+        Args:
+            num_workers: Number of worker ranks
+            spawn: Creates the process of a worker given its rank and generation (0 = first start)
+            max_restarts: Restarts allowed per rank before the run is aborted
+        """
+        self.spawn = spawn
+        self.max_restarts = max_restarts
+        self.procs: List[Optional[mp.Process]] = [None] * num_workers
+        self.generations = [0] * num_workers
+        self.restarts = 0
+        self.stopping = False
+
+    def __len__(self) -> int:
+        return len(self.procs)
+
+    def start(self, rank: int):
+        proc = self.spawn(rank, self.generations[rank])
+        self.generations[rank] += 1
+        proc.start()
+        self.procs[rank] = proc
+
+    def start_all(self):
+        for rank in range(len(self.procs)):
+            self.start(rank)
+
+    def crashed(self) -> List[int]:
+        """Ranks whose worker has exited although it was not told to stop"""
+        if self.stopping:
+            return []
+        return [rank for rank, proc in enumerate(self.procs) if proc is not None and proc.exitcode is not None]
+
+    def restart(self, rank: int) -> int:
+        """Replaces a crashed worker. Returns its exit code; raises once the rank used up its restarts"""
+        proc = self.procs[rank]
+        proc.join()
+        if self.generations[rank] > self.max_restarts:
+            raise RuntimeError(f"❌ Worker {rank} exited {self.generations[rank]} time(s) "
+                               f"(exit code {proc.exitcode}), giving up")
+        self.restarts += 1
+        self.start(rank)
+        return proc.exitcode
+
+    def stop(self, q, sentinel):
+        """Sends every worker the shutdown sentinel and waits for them to exit"""
+        self.stopping = True
+        for _ in self.procs:
+            q.put(sentinel)
+        for proc in self.procs:
+            proc.join()
+
+    def terminate(self):
+        """Kills all workers"""
+        self.stopping = True
+        for proc in self.procs:
+            if proc is not None:
+                proc.terminate()
+        for proc in self.procs:
+            if proc is not None:
+                proc.join(timeout=10)
@@ -0,0 +1,222 @@
+"""
+Token store: a compact binary layout of encoded datasets for LM training.
+
+A store is a directory with
+- `layer_N.bin`:     the codes of SNAC layer N of all samples, concatenated as flat uint16
+- `offsets.npy`:     int64 array of shape (num_samples + 1, num_layers); sample i's layer N
+                     tokens are `layer_N.bin[offsets[i, N-1]:offsets[i + 1, N-1]]`
+- `meta.jsonl`:      text, speaker and the other fields of every sample, one JSON line each
+- `meta_offsets.npy`: int64 byte offsets of the lines in meta.jsonl (num_samples + 1)
+- `store.json`:      format version, number of samples and layers
+
+`TokenStore` memory-maps the files, so opening a store is instant regardless of its size and
+a sample's layers are returned in O(1) as zero-copy views of the mapped files.
+
+Existing shards (any shard format) are converted with
+
+    python -m utils.token_store OUT_DIR DEST [--prefix PREFIX]
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from utils.shard_writer import SHARD_EXTENSIONS, iter_shard_records, match_shards
+
+try:
+    import orjson
+    USE_ORJSON = True
+except Exception:
+    USE_ORJSON = False
+
+FORMAT_VERSION = 1
+TOKEN_DTYPE = np.dtype("<u2")
+
+
+def _dumps(obj: Dict[str, Any]) -> bytes:
+    if USE_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _loads(data: bytes) -> Dict[str, Any]:
+    return orjson.loads(data) if USE_ORJSON else json.loads(data)
+
+
+class TokenStoreWriter:
+    """Appends encoded records to a new token store; the store appears atomically on close"""
+
+    def __init__(self, path: str, num_layers: int):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.num_layers = num_layers
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.layer_files = [
+            open(os.path.join(self.tmp_path, f"layer_{i}.bin"), "wb")
+            for i in range(1, num_layers + 1)
+        ]
+        self.meta_file = open(os.path.join(self.tmp_path, "meta.jsonl"), "wb")
+        self.offsets: List[List[int]] = [[0] * num_layers]
+        self.meta_offsets: List[int] = [0]
+
+    def __len__(self) -> int:
+        return len(self.meta_offsets) - 1
+
+    def write(self, rec: Dict[str, Any]) -> None:
+        """Appends one record (the same dict the shard writers take)"""
+        ends = []
+        for i, f in enumerate(self.layer_files, start=1):
+            tokens = np.asarray(rec[f"snac_layer_{i}"]).reshape(-1)
+            if tokens.size and (tokens.min() < 0 or tokens.max() > np.iinfo(TOKEN_DTYPE).max):
+                raise ValueError("Token ids do not fit into uint16")
+            f.write(tokens.astype(TOKEN_DTYPE).tobytes())
+            ends.append(self.offsets[-1][i - 1] + tokens.shape[0])
+        self.offsets.append(ends)
+
+        meta = {k: v for k, v in rec.items()
+                if not k.startswith("snac_layer_") and k not in ("num_layers", "token_lengths")}
+        line = _dumps(meta) + b"\n"
+        self.meta_file.write(line)
+        self.meta_offsets.append(self.meta_offsets[-1] + len(line))
+
+    def close(self) -> None:
+        """Writes the index and moves the store into place"""
+        for f in self.layer_files + [self.meta_file]:
+            f.close()
+        np.save(os.path.join(self.tmp_path, "offsets.npy"), np.asarray(self.offsets, dtype=np.int64))
+        np.save(os.path.join(self.tmp_path, "meta_offsets.npy"), np.asarray(self.meta_offsets, dtype=np.int64))
+        with open(os.path.join(self.tmp_path, "store.json"), "w") as f:
+            json.dump({"version": FORMAT_VERSION, "num_samples": len(self),
+                       "num_layers": self.num_layers, "dtype": TOKEN_DTYPE.str}, f, indent=2)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self.tmp_path, self.path)
+
+
+class TokenStore:
+    """Memory-mapped random access to a token store"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "store.json")) as f:
+            info = json.load(f)
+        if info["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported token store version {info['version']} in {path}")
+        self.num_layers = info["num_layers"]
+        self.num_samples = info["num_samples"]
+        self.dtype = np.dtype(info["dtype"])
+        self._open()
+
+    def _open(self):
+        self.offsets = np.load(os.path.join(self.path, "offsets.npy"), mmap_mode="r")
+        self.meta_offsets = np.load(os.path.join(self.path, "meta_offsets.npy"), mmap_mode="r")
+        self.layer_data = [self._map(f"layer_{i}.bin", self.dtype) for i in range(1, self.num_layers + 1)]
+        self.meta_data = self._map("meta.jsonl", np.uint8)
+
+    def _map(self, name: str, dtype) -> np.ndarray:
+        """Maps a data file read-only (np.memmap cannot map empty files)"""
+        path = os.path.join(self.path, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __getstate__(self):
+        # Re-map in the receiving process (e.g. DataLoader workers) instead of pickling the data
+        return {"path": self.path, "num_layers": self.num_layers,
+                "num_samples": self.num_samples, "dtype": self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def _check(self, idx: int) -> int:
+        if idx < 0:
+            idx += self.num_samples
+        if not 0 <= idx < self.num_samples:
+            raise IndexError(f"Sample {idx} out of range for a store of {self.num_samples}")
+        return idx
+
+    def layers(self, idx: int) -> List[np.ndarray]:
+        """Token arrays of every layer of a sample (read-only views, no copy)"""
+        idx = self._check(idx)
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return [data[start[i]:end[i]] for i, data in enumerate(self.layer_data)]
+
+    def token_lengths(self, idx: int) -> List[int]:
+        """Number of tokens per layer of a sample"""
+        idx = self._check(idx)
+        return (self.offsets[idx + 1] - self.offsets[idx]).tolist()
+
+    def meta(self, idx: int) -> Dict[str, Any]:
+        """Text and other fields of a sample"""
+        idx = self._check(idx)
+        return _loads(self.meta_data[self.meta_offsets[idx]:self.meta_offsets[idx + 1]].tobytes())
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        """A sample in the record format of the shards"""
+        rec = self.meta(idx)
+        layers = self.layers(idx)
+        for i, tokens in enumerate(layers, start=1):
+            rec[f"snac_layer_{i}"] = tokens
+        rec["num_layers"] = self.num_layers
+        rec["token_lengths"] = [int(t.shape[0]) for t in layers]
+        return rec
+
+    def __iter__(self):
+        for idx in range(self.num_samples):
+            yield self[idx]
+
+
+def find_shards(shard_dir: str, prefix: Optional[str] = None) -> List[str]:
+    """Finished shards in a directory (optionally of one dataset prefix), in name order"""
+    if prefix:
+        names = os.listdir(shard_dir) if os.path.isdir(shard_dir) else []
+        return [os.path.join(shard_dir, name) for name in match_shards(names, prefix)]
+    return sorted(p for p in glob.glob(os.path.join(shard_dir, "*")) if p.endswith(SHARD_EXTENSIONS))
+
+
+def convert_shards(shard_files: Iterable[str], dest: str, num_layers: Optional[int] = None) -> int:
+    """Converts shards of any format into a token store. Returns the number of samples"""
+    writer = None
+    try:
+        for path in shard_files:
+            for rec in iter_shard_records(path):
+                if writer is None:
+                    writer = TokenStoreWriter(dest, num_layers or int(rec["num_layers"]))
+                writer.write(rec)
+        if writer is None:
+            if num_layers is None:
+                raise ValueError("No records to convert and num_layers not given")
+            writer = TokenStoreWriter(dest, num_layers)
+        writer.close()
+    except BaseException:
+        if writer is not None:
+            shutil.rmtree(writer.tmp_path, ignore_errors=True)
+        raise
+    return len(writer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert encoded shards into a memory-mapped token store")
+    parser.add_argument("shard_dir", help="Directory with finished shards (OUT_DIR)")
+    parser.add_argument("dest", help="Token store directory to create")
+    parser.add_argument("--prefix", default=None, help="Only convert shards of this dataset prefix")
+    args = parser.parse_args()
+
+    shards = find_shards(args.shard_dir, args.prefix)
+    print(f"🔄 Converting {len(shards)} shard(s) from {args.shard_dir}")
+    n = convert_shards(shards, args.dest)
+    print(f"✅ Token store with {n:,} samples written to {args.dest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Round-trip verification of encoded shards.
+
+Decodes a random sample of every shard back to audio with `SNACDecoder` and compares it with
+the source audio it was encoded from, found through the shard's row manifest. Checking a few
+items per shard this way validates terabytes of output without sampling by hand. Shards are
+verified in parallel worker processes, and one JSON report per dataset is written to
+`OUT_DIR/verify/<prefix>.json`:
+
+    python -m utils.verify --config config.yaml --samples-per-shard 8 --workers 4
+
+Per sample the report records
+- snr_db: signal-to-noise ratio of the decoded waveform against the source audio, in dB
+- mel_distance: mean absolute difference of their log10 mel spectrograms (80 bands)
+and per shard and dataset the mean, min and percentiles of both, plus the worst samples.
+
+Source rows are dataset indices only for map-style datasets, so runs with `streaming`
+cannot be verified against their source.
+"""
+
+import argparse
+import dataclasses
+import json
+import multiprocessing as mp
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from utils.audio_filters import AudioFilter
+from utils.config_manager import ConfigManager, DatasetConfig, FilterSettings
+from utils.dataset_processor import DatasetProcessor
+from utils.resume_manifest import MANIFEST_SUFFIX, ResumeManifest, decode_rows
+from utils.shard_writer import iter_shard_records
+from utils.snac_codec import MODEL_CACHE_DIR, SNACDecoder, cache_model
+
+VERIFY_DIR = "verify"
+N_FFT = 1024
+HOP_LENGTH = 256
+N_MELS = 80
+# Samples listed by name in a report's "worst" section
+WORST_SAMPLES = 10
+
+# Per-process state of verification workers, set up by _init_worker
+_state: Dict[str, Any] = {}
+
+
+def mel_filterbank(sample_rate: int, n_fft: int = N_FFT, n_mels: int = N_MELS) -> np.ndarray:
+    """Triangular mel filters (HTK scale) as an (n_mels, n_fft // 2 + 1) matrix"""
+    to_mel = lambda hz: 2595.0 * np.log10(1.0 + hz / 700.0)
+    to_hz = lambda mel: 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+    edges = to_hz(np.linspace(0.0, to_mel(sample_rate / 2), n_mels + 2))
+    freqs = np.linspace(0.0, sample_rate / 2, n_fft // 2 + 1)
+    lower = (freqs[None, :] - edges[:-2, None]) / (edges[1:-1, None] - edges[:-2, None])
+    upper = (edges[2:, None] - freqs[None, :]) / (edges[2:, None] - edges[1:-1, None])
+    return np.maximum(0.0, np.minimum(lower, upper)).astype(np.float32)
+
+
+def log_mel(wave: np.ndarray, filterbank: np.ndarray, n_fft: int = N_FFT, hop: int = HOP_LENGTH) -> np.ndarray:
+    """log10 mel spectrogram of a waveform, (frames, n_mels)"""
+    wave = np.pad(wave.astype(np.float32), (n_fft // 2, n_fft // 2))
+    if wave.shape[0] < n_fft:
+        wave = np.pad(wave, (0, n_fft - wave.shape[0]))
+    frames = np.lib.stride_tricks.sliding_window_view(wave, n_fft)[::hop] * np.hanning(n_fft).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames, axis=-1)) ** 2
+    return np.log10(np.maximum(power @ filterbank.T, 1e-5))
+
+
+def snr_db(reference: np.ndarray, decoded: np.ndarray) -> Optional[float]:
+    """SNR of a reconstruction in dB (None for a silent reference)"""
+    signal = float(np.sum(np.square(reference, dtype=np.float64)))
+    noise = float(np.sum(np.square(reference - decoded, dtype=np.float64)))
+    if signal == 0.0:
+        return None
+    return 10.0 * np.log10(signal / max(noise, 1e-20))
+
+
+def reconstruction_metrics(reference: np.ndarray, decoded: np.ndarray, filterbank: np.ndarray) -> Dict[str, Any]:
+    """Compares a decoded waveform (padded length) with the source waveform it was encoded from"""
+    n = reference.shape[0]
+    decoded = decoded[:n]
+    if decoded.shape[0] < n:
+        raise ValueError(f"decoded audio has {decoded.shape[0]} samples, the source {n}")
+    mel_distance = float(np.mean(np.abs(log_mel(reference, filterbank) - log_mel(decoded, filterbank))))
+    return {"snr_db": snr_db(reference, decoded), "mel_distance": mel_distance}
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """Mean, min, max and percentiles of a metric"""
+    if not values:
+        return {"mean": None, "min": None, "p5": None, "p50": None, "p95": None, "max": None}
+    a = np.asarray(values, dtype=np.float64)
+    p5, p50, p95 = np.percentile(a, [5, 50, 95])
+    return {"mean": float(a.mean()), "min": float(a.min()), "p5": float(p5), "p50": float(p50),
+            "p95": float(p95), "max": float(a.max())}
+
+
+def sample_lines(shard_path: str, num_lines: int, samples: int, seed: int) -> List[int]:
+    """Picks the lines to verify in a shard, the same ones for the same seed"""
+    rng = random.Random(f"{seed}:{os.path.basename(shard_path)}")
+    return sorted(rng.sample(range(num_lines), min(samples, num_lines)))
+
+
+def read_lines(shard_path: str, lines: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Reads some records of a shard by line number"""
+    wanted, records = set(lines), {}
+    for line, rec in enumerate(iter_shard_records(shard_path)):
+        if line in wanted:
+            records[line] = rec
+            if len(records) == len(wanted):
+                break
+    return records
+
+
+def _init_worker(devices, model_id: str, cache_dir: Optional[str], max_batch_samples: int,
+                 threads: int, fast_decode: bool, num_proc: int, filter_settings: FilterSettings):
+    """Loads the decoder of one verification worker on the next free device"""
+    torch.set_num_threads(threads)
+    decoder = SNACDecoder(devices.get(), model_id, cache_dir, max_batch_samples)
+    _state.update(decoder=decoder, filterbank=mel_filterbank(decoder.sampling_rate), processors={},
+                  fast_decode=fast_decode, num_proc=num_proc,
+                  # Sources are trimmed like the readers trimmed them before encoding
+                  filters=AudioFilter(dataclasses.replace(filter_settings, dedup="off"), decoder.sampling_rate))
+
+
+def _processor(dataset_config: DatasetConfig):
+    """The source dataset of a prefix, loaded once per worker"""
+    prefix = dataset_config.dataset_prefix
+    if prefix not in _state["processors"]:
+        processor = DatasetProcessor(dataset_config, _state["decoder"].sampling_rate,
+                                     fast_decode=_state["fast_decode"])
+        processor.load_dataset(_state["num_proc"])
+        _state["processors"][prefix] = processor
+    return _state["processors"][prefix]
+
+
+def verify_shard(shard_path: str, dataset_config: DatasetConfig, samples: int, seed: int) -> Dict[str, Any]:
+    """Decodes sampled records of one shard and measures them against their source rows (worker side)"""
+    result: Dict[str, Any] = {"shard": os.path.basename(shard_path), "samples": []}
+    if not os.path.exists(shard_path + MANIFEST_SUFFIX):
+        result["error"] = "shard has no row manifest"
+        return result
+    rows = list(decode_rows(ResumeManifest.read(shard_path)))
+    result["lines"] = len(rows)
+    lines = sample_lines(shard_path, len(rows), samples, seed)
+    records = read_lines(shard_path, lines)
+
+    decoder, processor = _state["decoder"], _processor(dataset_config)
+    sources = {}
+    for row, ex in processor.iter_rows([(rows[line], rows[line] + 1) for line in lines], return_errors=True):
+        sources[row] = ex if isinstance(ex, Exception) else processor.prepare_item(ex)
+
+    entries, codes = [], []
+    for line in lines:
+        rec, source = records.get(line), sources.get(rows[line])
+        entry = {"line": line, "row": rows[line]}
+        if rec is None:
+            entry["error"] = "line missing from shard"
+        elif isinstance(source, Exception) or source is None:
+            entry["error"] = f"source row unreadable: {source!r}"
+        elif rec.get("text") != source["text"]:
+            entry["error"] = "shard text does not match the source row"
+        else:
+            layers = [rec[f"snac_layer_{i}"] for i in range(1, decoder.num_layers + 1)]
+            try:
+                decoder.check_layers(layers)
+            except ValueError as e:
+                entry["error"] = str(e)
+            else:
+                reference = _state["filters"].trim(np.asarray(source["wave"], dtype=np.float32).reshape(-1))
+                if reference is None:
+                    entry["error"] = "source row is silent"
+                else:
+                    entry["seconds"] = round(len(reference) / decoder.sampling_rate, 3)
+                    codes.append((entry, layers, reference))
+        entries.append(entry)
+
+    # The decoder injects random noise; seeding it per shard keeps reports reproducible
+    torch.manual_seed(seed)
+    waves = decoder.decode_batch([layers for _, layers, _ in codes])
+    for (entry, _, reference), wave in zip(codes, waves):
+        try:
+            entry.update(reconstruction_metrics(reference, wave, _state["filterbank"]))
+        except ValueError as e:
+            entry["error"] = str(e)
+
+    result["samples"] = entries
+    for metric in ("snr_db", "mel_distance"):
+        values = [e[metric] for e in entries if e.get(metric) is not None]
+        result[f"{metric}_mean"] = float(np.mean(values)) if values else None
+    return result
+
+
+def dataset_report(prefix: str, shards: List[Dict[str, Any]], settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Aggregates the shard results of one dataset"""
+    shards = sorted(shards, key=lambda s: s["shard"])
+    samples = [dict(e, shard=s["shard"]) for s in shards for e in s["samples"]]
+    measured = [e for e in samples if e.get("snr_db") is not None]
+    return {
+        "dataset": prefix,
+        **settings,
+        "shards_verified": len(shards),
+        "samples": len(samples),
+        "errors": sum(1 for e in samples if "error" in e) + sum(1 for s in shards if "error" in s),
+        "snr_db": summarize([e["snr_db"] for e in measured]),
+        "mel_distance": summarize([e["mel_distance"] for e in samples if e.get("mel_distance") is not None]),
+        "worst": sorted(measured, key=lambda e: e["snr_db"])[:WORST_SAMPLES],
+        "shards": shards,
+    }
+
+
+def write_report(report_dir: str, report: Dict[str, Any]) -> str:
+    """Atomically writes a dataset report. Returns its path"""
+    os.makedirs(report_dir, exist_ok=True)
+    path = os.path.join(report_dir, f"{report['dataset']}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def worker_devices(device: str, workers: int) -> List[str]:
+    """Device of each worker; "cuda" spreads the workers over all visible GPUs"""
+    if device == "cuda":
+        import torch
+        return [f"cuda:{i % torch.cuda.device_count()}" for i in range(workers)]
+    return [device] * workers
+
+
+def verify(config: ConfigManager, samples_per_shard: int = 8, workers: int = 1, device: str = "cpu",
+           seed: int = 0, threads: int = 1, report_dir: Optional[str] = None,
+           prefixes: Optional[List[str]] = None) -> List[str]:
+    """
+    Verifies a sample of every finished shard of the configured datasets in parallel workers
+    and writes one report per dataset. Returns the report paths
+    """
+    from utils.token_store import find_shards
+
+    base = config.get_base_settings()
+    if base.streaming:
+        raise ValueError("❌ Shards of a streaming run cannot be verified: their rows are stream positions")
+    report_dir = report_dir or os.path.join(base.OUT_DIR, VERIFY_DIR)
+    datasets: Dict[str, Tuple[DatasetConfig, List[str]]] = {}
+    for ds in config.get_datasets():
+        if prefixes and ds.dataset_prefix not in prefixes:
+            continue
+        datasets[ds.dataset_prefix] = (ds, find_shards(base.OUT_DIR, ds.dataset_prefix))
+        print(f"🔍 {ds.dataset_prefix}: verifying {samples_per_shard} sample(s) in each of "
+              f"{len(datasets[ds.dataset_prefix][1])} shard(s)")
+
+    ctx = mp.get_context("spawn")
+    devices = ctx.Queue()
+    for d in worker_devices(device, workers):
+        devices.put(d)
+    cache_dir = base.model_cache_dir or os.path.join(base.OUT_DIR, MODEL_CACHE_DIR)
+    # Cached once here, so the workers only memory-map the weights
+    cache_model(base.audio_codec, cache_dir)
+    initargs = (devices, base.audio_codec, cache_dir, base.max_padded_samples, threads,
+                base.fast_decode, base.load_dataset_num_proc, config.get_filter_settings())
+
+    results: Dict[str, List[Dict[str, Any]]] = {prefix: [] for prefix in datasets}
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker, initargs=initargs) as pool:
+        futures = {
+            pool.submit(verify_shard, path, ds, samples_per_shard, seed): (prefix, path)
+            for prefix, (ds, shards) in datasets.items() for path in shards
+        }
+        for future in as_completed(futures):
+            prefix, path = futures[future]
+            try:
+                results[prefix].append(future.result())
+            except Exception as e:
+                results[prefix].append({"shard": os.path.basename(path), "samples": [], "error": repr(e)})
+
+    settings = {"model": base.audio_codec, "samples_per_shard": samples_per_shard, "seed": seed}
+    paths = []
+    for prefix, shards in results.items():
+        report = dataset_report(prefix, shards, settings)
+        paths.append(write_report(report_dir, report))
+        snr, mel = report["snr_db"], report["mel_distance"]
+        fmt = lambda v: "n/a" if v is None else f"{v:.2f}"
+        print(f"  ✅ {prefix}: {report['samples']} sample(s), SNR mean {fmt(snr['mean'])} dB "
+              f"(p5 {fmt(snr['p5'])}), log-mel distance mean {fmt(mel['mean'])}, "
+              f"{report['errors']} error(s) -> {paths[-1]}")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a sample of every shard and measure reconstruction quality")
+    parser.add_argument("--config", default="config.yaml", help="Pipeline configuration file of the run")
+    parser.add_argument("--samples-per-shard", type=int, default=8, help="Records decoded per shard")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel verification processes")
+    parser.add_argument("--device", default=None, help="cpu, cuda (all GPUs) or cuda:N (default: cuda if available)")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per worker")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the per-shard sample")
+    parser.add_argument("--report-dir", default=None, help="Report directory (default: OUT_DIR/verify)")
+    parser.add_argument("--prefix", action="append", default=None, help="Only verify this dataset prefix (repeatable)")
+    args = parser.parse_args()
+
+    device = args.device
+    if device is None:
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    verify(ConfigManager(args.config), args.samples_per_shard, args.workers, device, args.seed,
+           args.threads, args.report_dir, args.prefix)
+
+
+if __name__ == "__main__":
+    main()
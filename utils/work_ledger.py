@@ -0,0 +1,373 @@
+"""
+Lease-based work ledger for multi-node runs.
+
+Nodes share the output directory, so they coordinate through files next to it instead of a
+server. Every dataset is cut into the same numbered work units on all nodes (row ranges, or
+partitions of a streamed dataset); the first node to plan a dataset writes the plan and the
+others adopt it. A node claims a unit by creating its lease file with O_EXCL, keeps the lease
+alive by touching it from a heartbeat thread, and marks the unit done once the shards holding
+its rows are finalized. A lease that has not been touched for `lease_seconds` belongs to a
+dead node: the first node to rename it away takes the unit over, recording the shards whose
+rows it skips as already encoded.
+
+The node that lost the lease may only have been slow. It stops reading the unit once it sees
+its lease is gone, is refused when it tries to complete the unit, and then drops the unit's
+rows from its shards that the new holder did not skip. Until it has, it keeps the renamed
+lease (the revocation) fresh, and the dataset does not count as done.
+
+Layout, per dataset prefix:
+
+    LEDGER_DIR/<prefix>/plan.json         units of the dataset
+    LEDGER_DIR/<prefix>/<unit>.lease      held by a node (rank, pid, token)
+    LEDGER_DIR/<prefix>/<unit>.revoked    lease taken over from a node that may still be writing rows
+    LEDGER_DIR/<prefix>/<unit>.kept       shards whose rows the node that took it over skipped
+    LEDGER_DIR/<prefix>/<unit>.done       finished
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+LEDGER_DIR = "_ledger"
+PLAN_FILE = "plan.json"
+LEASE_SUFFIX = ".lease"
+DONE_SUFFIX = ".done"
+REVOKED_SUFFIX = ".revoked"
+KEPT_SUFFIX = ".kept"
+
+
+class Lease(NamedTuple):
+    """
+    A claimed work unit. Takeovers were leased before, by a node that stopped heartbeating
+    or by this node rank in an earlier run, so some of their rows may already be in shards
+    """
+    prefix: str
+    unit: int
+    takeover: bool
+
+
+def _create_exclusive(path: str, data: bytes) -> bool:
+    """Creates a file only if it does not exist yet. Returns whether this call created it"""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    return True
+
+
+def _read(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def lease_held(lease_path: str, token: bytes) -> bool:
+    """Whether a lease file still holds a token (readers check this to stop reading a lost unit)"""
+    return _read(lease_path) == token
+
+
+class WorkLedger:
+    """Claims, renews and completes work units in a ledger directory shared by all nodes"""
+
+    def __init__(self, ledger_dir: str, node_rank: int, num_nodes: int, lease_seconds: float = 120.0):
+        self.ledger_dir = ledger_dir
+        self.node_rank = node_rank
+        self.num_nodes = num_nodes
+        self.lease_seconds = lease_seconds
+        self.owner = f"node{node_rank:02d} {socket.gethostname()}:{os.getpid()}"
+        self.lock = threading.Lock()
+        self.held: Dict[Tuple[str, int], bytes] = {}
+        self.plans: Dict[str, Dict[str, Any]] = {}
+        self.cursor: Dict[str, int] = {}
+        self.known_done: Dict[str, Set[int]] = {}
+        self.busy: Dict[str, Set[int]] = {}
+        self.recovered: Dict[str, Set[int]] = {}
+        # Tokens of leases taken over from this node, and the ones whose rows are ready to be dropped
+        self.revoked: Dict[Tuple[str, int], bytes] = {}
+        self.refused: Set[Tuple[str, int]] = set()
+        self.lost = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(ledger_dir, exist_ok=True)
+
+    def _dir(self, prefix: str) -> str:
+        return os.path.join(self.ledger_dir, prefix)
+
+    def _path(self, prefix: str, unit: int, suffix: str) -> str:
+        return os.path.join(self._dir(prefix), f"{unit:06d}{suffix}")
+
+    # Plans
+
+    def plan(self, prefix: str, proposal: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the units of a dataset: this node's proposal ({"num_rows": ..., "units": [...]})
+        if it is the first to plan the dataset, otherwise the plan another node wrote
+        """
+        os.makedirs(self._dir(prefix), exist_ok=True)
+        path = os.path.join(self._dir(prefix), PLAN_FILE)
+        tmp = f"{path}.{self.node_rank}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(proposal, f)
+        try:
+            # os.link fails if the plan exists, so exactly one proposal becomes the plan
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+        with open(path) as f:
+            plan = json.load(f)
+        if plan.get("num_rows") != proposal.get("num_rows"):
+            raise RuntimeError(f"❌ Ledger plan of {prefix} is for {plan.get('num_rows')} rows, "
+                               f"this node loaded {proposal.get('num_rows')}: are all nodes using the same config?")
+        self.plans[prefix] = plan
+        self.cursor.setdefault(prefix, 0)
+        self.known_done.setdefault(prefix, set())
+        self.busy.setdefault(prefix, set())
+        return plan
+
+    # Claiming
+
+    def _acquire(self, prefix: str, unit: int) -> bool:
+        """Creates the lease of a unit and keeps it unless the unit turned out to be done"""
+        token = f"{self.owner} {uuid.uuid4().hex}".encode()
+        lease_path = self._path(prefix, unit, LEASE_SUFFIX)
+        if not _create_exclusive(lease_path, token):
+            return False
+        if os.path.exists(self._path(prefix, unit, DONE_SUFFIX)):
+            # Completed (and its lease removed) between the done check and the lease creation
+            os.remove(lease_path)
+            self.known_done[prefix].add(unit)
+            return False
+        with self.lock:
+            self.held[(prefix, unit)] = token
+        return True
+
+    def _steal(self, prefix: str, unit: int) -> bool:
+        """Takes over a unit whose lease expired. Returns False if it is alive, done or taken"""
+        lease_path = self._path(prefix, unit, LEASE_SUFFIX)
+        try:
+            age = time.time() - os.stat(lease_path).st_mtime
+        except FileNotFoundError:
+            return self._acquire(prefix, unit)
+        if age <= self.lease_seconds:
+            return False
+        revoked = self._path(prefix, unit, REVOKED_SUFFIX)
+        try:
+            # Only one node can rename the expired lease away. Its holder may still be alive and
+            # keeps the revocation fresh until it has dropped the rows it encoded too late
+            os.rename(lease_path, revoked)
+            os.utime(revoked)
+        except FileNotFoundError:
+            return False
+        return self._acquire(prefix, unit)
+
+    def claim(self, prefix: str) -> Optional[Lease]:
+        """
+        Claims the next unit of a dataset: first units nobody has leased (each node starts at its
+        own offset to spread the nodes over the dataset), then units whose lease expired.
+        Returns None if every unit is done or held by a live node.
+        """
+        n = len(self.plans[prefix]["units"])
+        done = self.known_done[prefix]
+        busy = self.busy[prefix]
+        start = self.node_rank * n // max(1, self.num_nodes)
+
+        while self.cursor[prefix] < n:
+            unit = (start + self.cursor[prefix]) % n
+            self.cursor[prefix] += 1
+            if os.path.exists(self._path(prefix, unit, DONE_SUFFIX)):
+                done.add(unit)
+            elif self._acquire(prefix, unit):
+                return Lease(prefix, unit, unit in self.recovered.get(prefix, ()))
+            elif unit not in done:
+                busy.add(unit)
+
+        for unit in sorted(busy):
+            if os.path.exists(self._path(prefix, unit, DONE_SUFFIX)):
+                done.add(unit)
+                busy.discard(unit)
+            elif self._steal(prefix, unit):
+                busy.discard(unit)
+                return Lease(prefix, unit, True)
+        return None
+
+    def recover(self, prefixes: List[str]) -> int:
+        """Releases leases this node rank left behind in an earlier run, so they need not expire first"""
+        released = 0
+        tag = f"node{self.node_rank:02d} ".encode()
+        for prefix in prefixes:
+            if not os.path.isdir(self._dir(prefix)):
+                continue
+            for name in os.listdir(self._dir(prefix)):
+                path = os.path.join(self._dir(prefix), name)
+                if name.endswith(LEASE_SUFFIX) and (_read(path) or b"").startswith(tag):
+                    os.remove(path)
+                    self.recovered.setdefault(prefix, set()).add(int(name[:-len(LEASE_SUFFIX)]))
+                    released += 1
+                elif name.endswith(REVOKED_SUFFIX) and (_read(path) or b"").startswith(tag):
+                    # Taken over while this node rank was running before: its late rows are dropped now
+                    key = (prefix, int(name[:-len(REVOKED_SUFFIX)]))
+                    with self.lock:
+                        self.revoked[key] = _read(path) or b""
+                        self.refused.add(key)
+        return released
+
+    # Completion
+
+    def complete(self, prefix: str, units: List[int]) -> List[int]:
+        """
+        Marks units done (call once the shards holding their rows are finalized). Units whose
+        lease was taken over are refused: their rows are dropped instead. Returns the refused units
+        """
+        refused = []
+        for unit in units:
+            with self.lock:
+                token = self.held.pop((prefix, unit), None)
+            lease_path = self._path(prefix, unit, LEASE_SUFFIX)
+            if token is None or _read(lease_path) != token:
+                with self.lock:
+                    if token is not None:
+                        self.revoked[(prefix, unit)] = token
+                        self.lost += 1
+                    self.refused.add((prefix, unit))
+                refused.append(unit)
+                print(f"⚠️  Not completing {prefix} unit {unit}: its lease was taken over by another node")
+                continue
+            with open(self._path(prefix, unit, DONE_SUFFIX), "w") as f:
+                f.write(self.owner)
+            try:
+                os.remove(lease_path)
+            except FileNotFoundError:
+                pass
+        return refused
+
+    def lease_token(self, prefix: str, unit: int) -> Optional[Tuple[str, bytes]]:
+        """Lease file and token of a held unit, for the readers to check (None if not held)"""
+        with self.lock:
+            token = self.held.get((prefix, unit))
+        return None if token is None else (self._path(prefix, unit, LEASE_SUFFIX), token)
+
+    def in_unit(self, prefix: str, unit: int, row: int) -> bool:
+        """Whether a row belongs to a unit (streamed partitions number their rows position * units + unit)"""
+        plan = self.plans[prefix]
+        if plan["streaming"]:
+            return row % len(plan["units"]) == unit
+        start, end = plan["units"][unit]
+        return start <= row < end
+
+    # Takeovers
+
+    def keep(self, prefix: str, unit: int, shards: List[str]):
+        """Records the shards whose rows a takeover skips; the node that lost the unit keeps their rows"""
+        path = self._path(prefix, unit, KEPT_SUFFIX)
+        with open(path + ".tmp", "w") as f:
+            json.dump(sorted(shards), f)
+        os.replace(path + ".tmp", path)
+
+    def kept(self, prefix: str, unit: int) -> Optional[Set[str]]:
+        """The shards a takeover of a unit skipped, or None if it has not recorded them yet"""
+        data = _read(self._path(prefix, unit, KEPT_SUFFIX))
+        return None if data is None else set(json.loads(data))
+
+    def pending_drops(self) -> List[Tuple[str, int]]:
+        """Refused units of planned datasets whose rows this node still has to drop"""
+        with self.lock:
+            return sorted(key for key in self.refused if key[0] in self.plans)
+
+    def release(self, prefix: str, unit: int):
+        """Ends the revocation of a unit once this node has dropped its rows of it"""
+        with self.lock:
+            token = self.revoked.pop((prefix, unit), None)
+            self.refused.discard((prefix, unit))
+        revoked = self._path(prefix, unit, REVOKED_SUFFIX)
+        if token is not None and _read(revoked) == token:
+            try:
+                os.remove(revoked)
+            except FileNotFoundError:
+                pass
+
+    def _revocations_pending(self, prefix: str) -> bool:
+        """Whether a node that lost a unit of the dataset may still be dropping rows of it"""
+        now = time.time()
+        for name in os.listdir(self._dir(prefix)):
+            if not name.endswith(REVOKED_SUFFIX):
+                continue
+            try:
+                if now - os.stat(os.path.join(self._dir(prefix), name)).st_mtime <= self.lease_seconds:
+                    return True
+            except FileNotFoundError:
+                pass
+        return False
+
+    def is_done(self, prefix: str) -> bool:
+        """
+        Whether every unit of a planned dataset is done, and no node that lost a unit is still
+        dropping its rows of it (a revocation nobody renews for lease_seconds is of a dead node)
+        """
+        n = len(self.plans[prefix]["units"])
+        if len(self.known_done[prefix]) < n:
+            names = os.listdir(self._dir(prefix))
+            self.known_done[prefix].update(int(f[:-len(DONE_SUFFIX)]) for f in names if f.endswith(DONE_SUFFIX))
+        return len(self.known_done[prefix]) >= n and not self._revocations_pending(prefix)
+
+    def held_count(self) -> int:
+        with self.lock:
+            return len(self.held)
+
+    # Heartbeat
+
+    def _renew(self):
+        """
+        Touches every held lease; a lease that was taken over is dropped. The revocations of
+        lost leases are touched until their rows are dropped
+        """
+        with self.lock:
+            held = list(self.held.items())
+            revoked = list(self.revoked.items())
+        for (prefix, unit), token in revoked:
+            path = self._path(prefix, unit, REVOKED_SUFFIX)
+            if _read(path) == token:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+        for (prefix, unit), token in held:
+            lease_path = self._path(prefix, unit, LEASE_SUFFIX)
+            if _read(lease_path) == token:
+                try:
+                    os.utime(lease_path)
+                    continue
+                except FileNotFoundError:
+                    pass
+            with self.lock:
+                if self.held.pop((prefix, unit), None) is not None:
+                    self.revoked[(prefix, unit)] = token
+                    self.lost += 1
+            print(f"⚠️  Lease on {prefix} unit {unit} was taken over by another node")
+
+    def _heartbeat(self):
+        interval = max(0.1, self.lease_seconds / 4)
+        while not self._stop.wait(interval):
+            self._renew()
+
+    def start(self):
+        """Starts renewing held leases in the background"""
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the heartbeat; leases still held expire and are taken over by other nodes"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()